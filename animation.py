@@ -0,0 +1,105 @@
+import time
+from dataclasses import dataclass
+
+from globalEnums import Point, TermColor
+from levelData import LevelData
+from screenDrawing import VFX, Camera
+
+# Animations are short runs of overlay frames (projectiles in flight, hit flashes, spell bursts) played between a turn
+# and the next keypress. Each frame only redraws the cells it or the frame before it covered, through the same
+# draw_cells path targeting uses, and a keypress skips whatever's left (the key still counts as input)
+ANIMATION_FPS = 30
+HIT_FLASH_FRAMES = 4
+HIT_FLASH_COLORS = (TermColor.RED, TermColor.WHITE)  # Alternated between, frame by frame
+BURST_CHAR = "*"
+
+
+@dataclass
+class Animation:
+    """Overlay frames, each drawn on top of the map for one frame's time"""
+    frames: list[dict[Point, VFX]]
+
+
+class Animations:
+    """Static queue of the animations waiting to be played after this turn
+        Nothing is queued unless enabled is set, so headless runs and the game server (which never play them) don't
+        pile them up"""
+    enabled: bool = False
+    fps: int = ANIMATION_FPS
+    pending: list[Animation] = []
+
+    @staticmethod
+    def add(animation: Animation):
+        if Animations.enabled and animation.frames:
+            Animations.pending.append(animation)
+
+    @staticmethod
+    def take() -> list[Animation]:
+        pending = Animations.pending
+        Animations.pending = []
+        return pending
+
+
+def _frame(frames: list[dict[Point, VFX]], index: int) -> dict[Point, VFX]:
+    while len(frames) <= index:
+        frames.append({})
+    return frames[index]
+
+
+def flight_animation(impacts) -> Animation:
+    """Every projectile of a volley (projectiles.Impact) in flight at once, a cell per frame, then a flash on
+        whatever each one hit"""
+    frames: list[dict[Point, VFX]] = []
+    for impact in impacts:
+        projectile = impact.projectile
+        for i, pos in enumerate(projectile.path[:impact.steps]):
+            _frame(frames, i)[pos] = VFX(pos=pos, display_char=projectile.display_char,
+                                         display_color=projectile.display_color, is_visible=True)
+        if impact.hit is not None:
+            for i in range(HIT_FLASH_FRAMES):
+                _frame(frames, impact.steps + i)[impact.pos] = VFX(
+                    pos=impact.pos, display_char=projectile.display_char,
+                    display_color=HIT_FLASH_COLORS[i % len(HIT_FLASH_COLORS)], is_visible=True)
+    return Animation(frames)
+
+
+def burst_animation(center: Point, radius: int, color: TermColor, char: str = BURST_CHAR) -> Animation:
+    """A ring growing out from center, a cell per frame, for spells and explosions"""
+    frames = []
+    for r in range(1, radius + 1):
+        ring = [Point(center.x + dx, center.y + dy) for dx in range(-r, r + 1) for dy in range(-r, r + 1)
+                if max(abs(dx), abs(dy)) == r]
+        frames.append({p: VFX(pos=p, display_char=char, display_color=color, is_visible=True) for p in ring})
+    return Animation(frames)
+
+
+def play_animations(term, camera: Camera, level_data: LevelData) -> bool:
+    """Plays everything queued, all together, at Animations.fps. Frames with nothing the player can see are
+        skipped. A keypress stops it early and is put back, to be read as normal input. Returns True if it was skipped"""
+    animations = Animations.take()
+    tiles = level_data.tiles
+    frames = []
+    for i in range(max((len(a.frames) for a in animations), default=0)):
+        overlay = {}
+        for animation in animations:
+            if i < len(animation.frames):
+                overlay.update(animation.frames[i])
+        overlay = {p: fx for p, fx in overlay.items() if p in tiles and tiles[p].is_visible}
+        if overlay:
+            frames.append(overlay)
+
+    frame_seconds = 1 / Animations.fps
+    drawn: set[Point] = set()
+    skipped = False
+    start = time.perf_counter()
+    for i, overlay in enumerate(frames):
+        camera.draw_cells(level_data, drawn | overlay.keys(), overlay)
+        drawn = set(overlay)
+        key = term.inkey(timeout=max(0.0, start + (i + 1) * frame_seconds - time.perf_counter()))
+        if key:
+            term.ungetch(key)
+            skipped = True
+            break
+    # Put back whatever the last frame covered
+    camera.draw_cells(level_data, drawn)
+    return skipped
@@ -0,0 +1,89 @@
+import logging
+
+from globalEnums import Point
+from keymap import Command
+from levelData import LevelData, dijkstra_map, dijkstra_map_step
+
+# Queued up by gameTurn.run_keys after each step while a TravelPlan is active. It isn't bound to any key
+CONTINUE_TRAVEL = Command("continue_travel")
+
+MAX_TRAVEL_STEPS = 500  # A single explore/travel command never runs longer than this
+EXPLORE_MAX_COST = 200  # How far out the explore search looks. Only matters on levels too big to search all of
+
+
+def explore_goals(level_data: LevelData) -> list[Point]:
+    """Returns every seen, walkable tile that borders a tile that hasn't been seen yet"""
+    tiles = level_data.tiles
+    goals = []
+    for p in tiles:
+        tile = tiles[p]
+        if not tile.has_been_visible or tile.is_blocking_move:
+            continue
+        for dx, dy in ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+            neighbor = Point(p.x + dx, p.y + dy)
+            if neighbor in tiles and not tiles[neighbor].has_been_visible:
+                goals.append(p)
+                break
+    return goals
+
+
+class TravelPlan:
+    """Walks the player over several turns by following a dijkstra_map downhill
+        The map is built once and reused for every step. Exploring only rebuilds it once the player reaches the
+        edge of the explored area it was built for, rather than searching again every step"""
+
+    def __init__(self, level_data: LevelData, goal: Point | None = None):
+        self.level_data = level_data
+        self.goal = goal  # None means explore
+        self.steps_taken = 0
+        self.searches = 0
+        self.costs: dict[Point, float] = {}
+        self._build_map()
+
+    @property
+    def is_exploring(self) -> bool:
+        return self.goal is None
+
+    def _build_map(self):
+        if self.is_exploring:
+            self.costs = dijkstra_map(self.level_data, explore_goals(self.level_data), max_cost=EXPLORE_MAX_COST)
+        else:
+            # Only through tiles the player has seen, so travel never leads (or gives away a way) into the unknown
+            self.costs = dijkstra_map(self.level_data, [self.goal], known_only=True)
+        self.searches += 1
+
+    def has_route(self) -> bool:
+        """False if the player can't get to any goal from where they're standing"""
+        return dijkstra_map_step(self.level_data, self.costs, self.level_data.player.pos) is not None
+
+    def next_step(self) -> Point | None:
+        """Returns where the player should move next, or None once they've arrived (or there's nowhere left to go)"""
+        if self.steps_taken >= MAX_TRAVEL_STEPS:
+            return None
+        pos = self.level_data.player.pos
+        step = dijkstra_map_step(self.level_data, self.costs, pos)
+        if step is None and self.is_exploring:
+            # Reached the edge of what was explored when the map was built. Look for the new edge
+            self._build_map()
+            step = dijkstra_map_step(self.level_data, self.costs, pos)
+        return step
+
+
+class TravelManager:
+
+    _plan = None
+
+    @staticmethod
+    def set_plan(plan: TravelPlan | None):
+        TravelManager._plan = plan
+
+    @staticmethod
+    def get_plan() -> TravelPlan | None:
+        return TravelManager._plan
+
+    @staticmethod
+    def stop():
+        plan = TravelManager._plan
+        if plan is not None:
+            logging.debug(f"Travel ended after {plan.steps_taken} steps and {plan.searches} searches")
+        TravelManager._plan = None
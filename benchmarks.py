@@ -0,0 +1,403 @@
+# Timing for the slower bits of the game, on seeded levels at a few map sizes
+# Run with: python benchmarks.py
+# To catch regressions, save a baseline and compare later runs against it:
+#   python benchmarks.py --output baseline.json
+#   python benchmarks.py --baseline baseline.json --threshold 0.15
+import argparse
+import json
+import pickle
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from dungeon import Dungeon
+from entity import create_player
+from gameTurn import end_player_turn, run_keys
+from globalEnums import Point
+from headlessRunner import headless_terminal
+from keymap import DEFAULT_BINDINGS, Keymap
+from levelData import LevelData, a_star_search, dijkstra_map, dijkstra_search, reconstruct_path
+from levelGeneration import generate_level, generate_orc
+from levelPipeline import LevelPipeline
+from levelStorage import pack_level, unpack_level
+from minimap import MINIMAP_BLOCK, Minimap, compose_blocks
+from offscreenSim import OffscreenSimulator
+from profiler import Profiler
+from projectiles import Projectile, fire_volley
+from saveGame import GameSnapshot, SaveWriter, load_game, player_record, snapshot_floor
+from screenDrawing import TopMessage, compose_camera
+from shadowCasting import refresh_visibility
+
+# (width, height) pairs to generate at. 140x40 is the size main() uses
+GENERATION_SIZES = [(140, 40), (500, 500), (2000, 2000)]
+# Sizes the per-turn benchmarks (FOV/pathing/drawing) run at. FOV scans the whole map, so these stay smaller
+SIZE_LADDER = [(140, 40), (250, 250), (500, 500)]
+SIGHT_RANGES = [4, 12, 30]
+CAMERA_SIZE = (120, 27)  # What main() ends up with in a 120x30 console
+SHORT_PATH_COST = 10  # Roughly how far the "short" paths go. The "long" ones go as far as possible
+PACK_SIZE = 10  # Orcs that spot the player at once, for the pack AI benchmark
+PACK_DISTANCE = 8  # How far (in path cost) they stand from the player - an orc's sight range
+VOLLEY_SIZE = 40  # Monsters shooting at the player in the same tick, for the projectile benchmark
+OFFSCREEN_FLOORS = 8  # Stored floors, each with OFFSCREEN_MONSTERS orcs, for the off-screen simulation benchmark
+OFFSCREEN_MONSTERS = 20
+RESULTS_VERSION = 1
+
+
+def generation_kwargs(width: int, height: int, generation_type: int = 1) -> dict:
+    """Returns lvlargs for a level of the given size and type
+        Rooms-and-corridors levels keep the room density of the default 140x40 level"""
+    if generation_type == 3:
+        return {"generation_type": 3, "height": height, "width": width}
+    num_rooms = max(20, (width * height) // 280)
+    return {"generation_type": 1, "height": height, "width": width,
+            "num_rooms": num_rooms, "room_size": 9, "room_size_mod": 3}
+
+
+def time_repeats(func, repeats: int) -> list[float]:
+    """Runs func repeats times, returning how long each run took"""
+    timings = []
+    for i in range(repeats):
+        tic = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - tic)
+    return timings
+
+
+def benchmark_generation(width: int, height: int, repeats: int, generation_type: int = 1) -> list[float]:
+    """Generates a level of the given size repeats times, returning the time each one took"""
+    timings = []
+    for i in range(repeats):
+        tic = time.perf_counter()
+        generate_level(**generation_kwargs(width, height, generation_type), seed=i)
+        toc = time.perf_counter()
+        timings.append(toc - tic)
+    return timings
+
+
+def benchmark_level_storage(width: int, height: int, repeats: int) -> dict:
+    """Packs/unpacks a partly explored level repeats times, returning best times and sizes"""
+    level_data = generate_level(**generation_kwargs(width, height), seed=0)
+    # Look around from the start so there's some has_been_visible memory to store
+    refresh_visibility(level_data.player_start_pos.x, level_data.player_start_pos.y, 12, level_data)
+
+    pack_times, unpack_times = [], []
+    for i in range(repeats):
+        tic = time.perf_counter()
+        blob = pack_level(level_data)
+        toc = time.perf_counter()
+        unpack_level(blob)
+        pack_times.append(toc - tic)
+        unpack_times.append(time.perf_counter() - toc)
+
+    return {"packed_bytes": len(blob), "pickled_bytes": len(pickle.dumps(level_data)),
+            "pack_seconds": min(pack_times), "unpack_seconds": min(unpack_times)}
+
+
+def benchmark_save_game(width: int, height: int, repeats: int) -> dict:
+    """Saves a one-floor game repeats times (a full save, then a save after a step), and loads it back"""
+    level_data = benchmark_level(width, height)
+    player = level_data.player
+    refresh_visibility(player.pos.x, player.pos.y, player.sight_range, level_data)
+    state = {"seed": 0, "lvlargs": generation_kwargs(width, height), "depth": 0, "turns": 0,
+             "player": player_record(player)}
+
+    snapshot_times, full_times, step_times, load_times = [], [], [], []
+    for i in range(repeats):
+        save_dir = tempfile.mkdtemp(prefix="imla_bench_save_")
+        writer = SaveWriter(save_dir)
+        tic = time.perf_counter()
+        snapshot = GameSnapshot(state=state, floors=[snapshot_floor(level_data, 0)])
+        snapshot_times.append(time.perf_counter() - tic)
+        full = writer.write(snapshot)
+        full_times.append(full.seconds)
+        # One more turn's worth of change: the player looked around a bit more
+        refresh_visibility(player.pos.x + 1, player.pos.y, player.sight_range, level_data)
+        step = writer.write(GameSnapshot(state=state, floors=[snapshot_floor(level_data, 0)]))
+        step_times.append(step.seconds)
+        load_times.append(load_game(save_dir).seconds)
+        shutil.rmtree(save_dir)
+
+    return {"save_bytes": full.save_size, "step_bytes_written": step.bytes_written,
+            "pickled_bytes": len(pickle.dumps(level_data)), "snapshot_seconds": min(snapshot_times),
+            "full_save_seconds": min(full_times), "step_save_seconds": min(step_times),
+            "load_seconds": min(load_times)}
+
+
+def benchmark_level(width: int, height: int, seed: int = 0) -> LevelData:
+    """A seeded rooms-and-corridors level with a player standing on the start"""
+    level_data = generate_level(**generation_kwargs(width, height), seed=seed)
+    level_data.player = create_player(level_data.player_start_pos, name="Benchmark")
+    return level_data
+
+
+def path_goals(level_data: LevelData) -> tuple[Point, Point]:
+    """Returns a (short, long) pair of goals to path to from the player's start
+        short is about SHORT_PATH_COST away, long is the furthest reachable tile"""
+    start = level_data.player_start_pos
+    costs = dijkstra_map(level_data, [start])
+    # Ties are broken on position so the same level always gives the same goals
+    short_goal = min(costs, key=lambda p: (abs(costs[p] - SHORT_PATH_COST), p))
+    long_goal = max(costs, key=lambda p: (costs[p], p))
+    return short_goal, long_goal
+
+
+def pack_positions(level_data: LevelData, count: int) -> list[Point]:
+    """The count walkable tiles closest to PACK_DISTANCE from the player's start, for a pack to stand on"""
+    start = level_data.player_start_pos
+    costs = dijkstra_map(level_data, [start])
+    return sorted(costs, key=lambda p: (abs(costs[p] - PACK_DISTANCE), p))[:count]
+
+
+def benchmark_pack_ai(level_data: LevelData, repeats: int) -> dict[str, list[float]]:
+    """A pack of orcs all seeing the player at once: one monster turn for all of them, sharing a blackboard, against
+        what it cost for each of them to A* to the player on their own"""
+    positions = pack_positions(level_data, PACK_SIZE)
+    player_pos = level_data.player.pos
+    saved_monsters = level_data.monsters
+
+    def pack_turn() -> float:
+        level_data.monsters = [generate_orc(p) for p in positions]
+        level_data.packs = {}
+        tic = time.perf_counter()
+        end_player_turn(level_data)
+        return time.perf_counter() - tic
+
+    def separate_paths():
+        for p in positions:
+            came_from, _ = a_star_search(level_data, p, player_pos)
+            reconstruct_path(came_from, p, player_pos)
+
+    refresh_visibility(player_pos.x, player_pos.y, level_data.player.sight_range, level_data)
+    results = {"pack": [pack_turn() for _ in range(repeats)], "separate": time_repeats(separate_paths, repeats)}
+    level_data.monsters = saved_monsters
+    level_data.packs = {}
+    return results
+
+
+def benchmark_volley(level_data: LevelData, repeats: int) -> dict[str, list[float]]:
+    """VOLLEY_SIZE monsters around the player all shooting at them in one tick, resolved against the occupancy index,
+        against checking every step of every shot by going through the monster list"""
+    positions = pack_positions(level_data, VOLLEY_SIZE)
+    player = level_data.player
+    saved_monsters = level_data.monsters
+    level_data.monsters = [generate_orc(p) for p in positions]
+    # No damage, so nobody dies and every repeat resolves the same volley
+    volley = [Projectile(owner=m, origin=m.pos, target=player.pos, damage=0) for m in level_data.monsters]
+
+    def indexed():
+        fire_volley(level_data, volley, animate=False)
+        TopMessage.message_buffer = ""
+
+    def scanned():
+        tiles = level_data.tiles
+        for projectile in volley:
+            for pos in projectile.path:
+                if tiles[pos].is_blocking_move:
+                    break
+                hit = next((e for e in [player, *level_data.monsters] if e.pos == pos and e is not projectile.owner),
+                           None)
+                if hit is not None:
+                    hit.take_damage(projectile.damage, projectile.damage_type, level_data)
+                    break
+        TopMessage.message_buffer = ""
+
+    results = {"index": time_repeats(indexed, repeats), "scan": time_repeats(scanned, repeats)}
+    level_data.monsters = saved_monsters
+    return results
+
+
+def benchmark_offscreen(repeats: int) -> dict[str, list[float]]:
+    """One coarse step of OFFSCREEN_FLOORS stored floors, each interval turns behind, against running every
+        monster's update on every one of them for those interval turns"""
+    floors = []
+    for seed in range(OFFSCREEN_FLOORS):
+        level_data = benchmark_level(*SIZE_LADDER[0], seed=seed)
+        level_data.monsters = [generate_orc(p) for p in pack_positions(level_data, OFFSCREEN_MONSTERS)]
+        floors.append((seed, level_data))
+    simulator = OffscreenSimulator()
+    interval = simulator.settings.interval
+    for seed, _ in floors:
+        simulator.left(seed, 0)
+    turn = 0
+
+    def coarse_step():
+        nonlocal turn
+        turn += interval
+        simulator.step(floors, turn)
+
+    def every_turn():
+        for _, level_data in floors:
+            for _ in range(interval):
+                end_player_turn(level_data)
+
+    return {"lod": time_repeats(coarse_step, repeats), "full": time_repeats(every_turn, repeats)}
+
+
+def compose_frame(term, level_data: LevelData) -> str:
+    """Builds the frame main() would draw for level_data, centered on the player"""
+    cam_width, cam_height = CAMERA_SIZE
+    player_pos = level_data.player.pos
+    return compose_camera(term, player_pos.x - cam_width // 2, player_pos.y - cam_height // 2, cam_width, cam_height,
+                          0, 1, level_data)
+
+
+def run_turn_benchmarks(width: int, height: int, repeats: int) -> dict[str, list[float]]:
+    """FOV, pathfinding, frame composition and a whole turn on one level. Returns timings by benchmark name"""
+    level_data = benchmark_level(width, height)
+    player = level_data.player
+    size = f"{width}x{height}"
+    results = {}
+
+    for sight_range in SIGHT_RANGES:
+        results[f"fov/{size}/range{sight_range}"] = time_repeats(
+            lambda: refresh_visibility(player.pos.x, player.pos.y, sight_range, level_data), repeats)
+
+    start = level_data.player_start_pos
+    for length, goal in zip(("short", "long"), path_goals(level_data)):
+        results[f"a_star/{size}/{length}"] = time_repeats(
+            lambda: a_star_search(level_data, start, goal), repeats)
+        results[f"dijkstra/{size}/{length}"] = time_repeats(
+            lambda: dijkstra_search(level_data, start, goal), repeats)
+
+    for kind, timings in benchmark_pack_ai(level_data, repeats).items():
+        results[f"pack_ai/{size}/{kind}"] = timings
+    for kind, timings in benchmark_volley(level_data, repeats).items():
+        results[f"volley/{size}/{kind}"] = timings
+
+    term = headless_terminal()
+    refresh_visibility(player.pos.x, player.pos.y, player.sight_range, level_data)
+    results[f"compose/{size}"] = time_repeats(lambda: compose_frame(term, level_data), repeats)
+
+    # The minimap after a step: re-read and re-pool the blocks in sight (as refresh_visibility marks them), then
+    # build the corner panel's worth of it
+    level_data.minimap = Minimap(level_data)
+    level_data.minimap.pooled(level_data, MINIMAP_BLOCK)
+
+    def minimap_step():
+        level_data.minimap.note_view(player.pos.x, player.pos.y, player.sight_range)
+        codes = level_data.minimap.pooled(level_data, MINIMAP_BLOCK)
+        compose_blocks(term, level_data, codes, MINIMAP_BLOCK, Point(0, 0), 32, 10, 0, 1)
+
+    results[f"minimap/{size}"] = time_repeats(minimap_step, repeats)
+    level_data.minimap = None
+
+    # One whole turn - the player waits, the monsters act, FOV catches up and the next frame gets built
+    dungeon = Dungeon(LevelPipeline(lvlargs=generation_kwargs(width, height), base_seed=0))
+    dungeon.current_level = level_data
+    keymap = Keymap(DEFAULT_BINDINGS)
+
+    def turn():
+        run_keys(["5"], keymap, dungeon, term)
+        refresh_visibility(player.pos.x, player.pos.y, player.sight_range, level_data)
+        compose_frame(term, level_data)
+
+    results[f"turn/{size}"] = time_repeats(turn, repeats)
+    dungeon.pipeline.shutdown()
+    return results
+
+
+def summarize(timings: list[float]) -> dict:
+    return {"best": min(timings), "median": statistics.median(timings), "runs": len(timings)}
+
+
+def compare_to_baseline(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Returns a line for every benchmark whose best time is more than threshold (0.1 = 10%) slower than baseline"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["best"], result["best"]
+        if before > 0 and after > before * (1 + threshold):
+            regressions.append(f"{name}: {before * 1000:0.3f}ms -> {after * 1000:0.3f}ms "
+                               f"({(after / before - 1) * 100:+0.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times FOV, pathfinding, drawing and level generation on seeded "
+                                                 "levels, optionally comparing against a saved baseline")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per benchmark (1 for the biggest generation)")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--output", metavar="PATH", help="write the results to PATH as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against results saved earlier with --output")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="how much slower (0.10 = 10%%) than the baseline counts as a regression")
+    args = parser.parse_args()
+
+    # The spans would only add overhead to what's being timed
+    Profiler.enabled = False
+    results: dict[str, dict] = {}
+
+    def record(name: str, timings: list[float]):
+        if args.filter in name:
+            results[name] = summarize(timings)
+            print(f"{name:<32} best {results[name]['best'] * 1000:>10.3f}ms  "
+                  f"median {results[name]['median'] * 1000:>10.3f}ms")
+
+    for width, height in SIZE_LADDER:
+        size = f"{width}x{height}"
+        if not any(args.filter in f"{kind}/{size}" for kind in ("fov", "a_star", "dijkstra", "pack_ai", "volley",
+                                                                  "compose", "minimap", "turn")):
+            continue
+        for name, timings in run_turn_benchmarks(width, height, args.repeats).items():
+            record(name, timings)
+
+    size = f"{OFFSCREEN_FLOORS}x{OFFSCREEN_MONSTERS}"
+    if any(args.filter in f"offscreen/{size}/{kind}" for kind in ("lod", "full")):
+        for kind, timings in benchmark_offscreen(args.repeats).items():
+            record(f"offscreen/{size}/{kind}", timings)
+
+    for generation_type in (1, 3):
+        for width, height in GENERATION_SIZES:
+            name = f"generate/type{generation_type}/{width}x{height}"
+            if args.filter not in name:
+                continue
+            # The biggest size takes a few seconds per level, so don't repeat it
+            repeats = args.repeats if width * height < 1_000_000 else 1
+            record(name, benchmark_generation(width, height, repeats, generation_type))
+
+    for width, height in GENERATION_SIZES[:2]:
+        if args.filter not in f"storage/{width}x{height}":
+            continue
+        storage = benchmark_level_storage(width, height, args.repeats)
+        print(f"level storage {width}x{height}: {storage['packed_bytes']} bytes packed "
+              f"({storage['pickled_bytes']} pickled), save {storage['pack_seconds']:0.4f}s, "
+              f"load {storage['unpack_seconds']:0.4f}s")
+        results[f"storage/pack/{width}x{height}"] = {"best": storage["pack_seconds"], "runs": args.repeats}
+        results[f"storage/unpack/{width}x{height}"] = {"best": storage["unpack_seconds"], "runs": args.repeats}
+
+    for width, height in GENERATION_SIZES[:2]:
+        if args.filter not in f"save/{width}x{height}":
+            continue
+        save = benchmark_save_game(width, height, args.repeats)
+        print(f"save game {width}x{height}: {save['save_bytes']} bytes ({save['pickled_bytes']} pickled), "
+              f"snapshot {save['snapshot_seconds']:0.4f}s, full save {save['full_save_seconds']:0.4f}s, "
+              f"save after a step {save['step_save_seconds']:0.4f}s ({save['step_bytes_written']} bytes), "
+              f"load {save['load_seconds']:0.4f}s")
+        for key in ("snapshot", "full_save", "step_save", "load"):
+            results[f"save/{key}/{width}x{height}"] = {"best": save[f"{key}_seconds"], "runs": args.repeats}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"version": RESULTS_VERSION, "python": platform.python_version(),
+                       "platform": platform.platform(), "time": time.time(), "repeats": args.repeats,
+                       "results": results}, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold * 100:0.0f}%:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold * 100:0.0f}% against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+import logging
+import os
+import shutil
+import tempfile
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from globalEnums import TermColor, Point
+from levelData import LevelData, Tile
+from levelGeneration import tile_data_from_grid
+
+# An effectively unbounded overworld, split into square chunks that are generated from the seed as they're touched
+# Only the most recently used chunks are kept as Tiles. The rest are either thrown away (if nothing about them
+# has changed, they can just be regenerated) or spilled to disk as a small compressed grid
+CHUNK_SIZE = 32
+WORLD_CHUNKS = 2 ** 16  # Chunks along each side of the world. The world's origin is in the corner, so start central
+MAX_HOT_CHUNKS = 64
+
+OVERWORLD_GRASS = 0
+OVERWORLD_TREE = 1
+OVERWORLD_WATER = 2
+OVERWORLD_MOUNTAIN = 3
+OVERWORLD_TEMPLATES: list[Tile] = [
+    Tile(world_x=0, world_y=0, floor_char=".", is_blocking_move=False, is_blocking_LOS=False,
+         is_visible=False, visible_color=TermColor.GREEN, fow_color=TermColor.DARK_GREEN,
+         has_been_visible=False, movement_weight=1, is_in_LOS=False),
+    Tile(world_x=0, world_y=0, floor_char="T", is_blocking_move=False, is_blocking_LOS=True,
+         is_visible=False, visible_color=TermColor.DARK_GREEN, fow_color=TermColor.DARK_OLIVE,
+         has_been_visible=False, movement_weight=2, is_in_LOS=False),
+    Tile(world_x=0, world_y=0, floor_char="~", is_blocking_move=True, is_blocking_LOS=False,
+         is_visible=False, visible_color=TermColor.BLUE, fow_color=TermColor.DARK_BLUE,
+         has_been_visible=False, movement_weight=1, is_in_LOS=False),
+    Tile(world_x=0, world_y=0, floor_char="^", is_blocking_move=True, is_blocking_LOS=True,
+         is_visible=False, visible_color=TermColor.LIGHT_GREY, fow_color=TermColor.MID_GREY,
+         has_been_visible=False, movement_weight=1, is_in_LOS=False),
+]
+_TEMPLATE_INDEX_BY_CHAR = {t.floor_char: i for i, t in enumerate(OVERWORLD_TEMPLATES)}
+
+
+def _lattice_values(ix: np.ndarray, iy: np.ndarray, seed: int) -> np.ndarray:
+    """Hashes integer lattice coords into repeatable pseudo-random values in [0, 1)"""
+    # splitmix64-style mixing. uint64 arithmetic wraps, which is exactly what we want here
+    h = ix.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    h ^= iy.astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)
+    h ^= np.uint64(seed % (2 ** 64))
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xFF51AFD7ED558CCD)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xC4CEB9FE1A85EC53)
+    h ^= h >> np.uint64(33)
+    return (h >> np.uint64(11)).astype(np.float64) / float(2 ** 53)
+
+
+def value_noise(xs: np.ndarray, ys: np.ndarray, seed: int, scale: float, octaves: int = 3) -> np.ndarray:
+    """Smooth noise in roughly [0, 1) for every (xs, ys) world coord
+        Each point only depends on its coords and the seed, so neighbouring chunks line up at their edges"""
+    xs, ys = np.broadcast_arrays(xs, ys)
+    total = np.zeros(xs.shape)
+    amplitude, amplitude_sum = 1.0, 0.0
+    for octave in range(octaves):
+        fx, fy = xs / scale, ys / scale
+        x0, y0 = np.floor(fx).astype(np.int64), np.floor(fy).astype(np.int64)
+        tx, ty = fx - x0, fy - y0
+        tx, ty = tx * tx * (3 - 2 * tx), ty * ty * (3 - 2 * ty)  # smoothstep, so the lattice doesn't show
+
+        octave_seed = seed + octave * 1013
+        v00 = _lattice_values(x0, y0, octave_seed)
+        v10 = _lattice_values(x0 + 1, y0, octave_seed)
+        v01 = _lattice_values(x0, y0 + 1, octave_seed)
+        v11 = _lattice_values(x0 + 1, y0 + 1, octave_seed)
+        top = v00 + (v10 - v00) * tx
+        bottom = v01 + (v11 - v01) * tx
+        total = total + amplitude * (top + (bottom - top) * ty)
+
+        amplitude_sum += amplitude
+        amplitude *= 0.5
+        scale /= 2
+    return total / amplitude_sum
+
+
+def generate_chunk_grid(seed: int, chunk_x: int, chunk_y: int, chunk_size: int) -> np.ndarray:
+    """Generates the template-index grid (indexed [x, y]) for one chunk of the overworld"""
+    xs = (chunk_x * chunk_size + np.arange(chunk_size))[:, np.newaxis]
+    ys = (chunk_y * chunk_size + np.arange(chunk_size))[np.newaxis, :]
+    elevation = value_noise(xs, ys, seed, scale=48.0)
+    moisture = value_noise(xs, ys, seed + 7_777, scale=24.0)
+
+    grid = np.full((chunk_size, chunk_size), OVERWORLD_GRASS, dtype=np.uint8)
+    grid[moisture > 0.62] = OVERWORLD_TREE
+    grid[elevation < 0.30] = OVERWORLD_WATER
+    grid[elevation > 0.72] = OVERWORLD_MOUNTAIN
+    return grid
+
+
+class ChunkTiles:
+    """Stands in for the dict[Point, Tile] that LevelData.tiles normally is, generating chunks as they're touched
+        Supports tiles[p], p in tiles and len(tiles). Iterating only covers the chunks that are currently loaded"""
+
+    def __init__(self, seed: int, width: int, height: int, chunk_size: int = CHUNK_SIZE,
+                 max_hot_chunks: int = MAX_HOT_CHUNKS, spill_dir: str | None = None):
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.max_hot_chunks = max_hot_chunks
+        self.spill_dir = spill_dir  # Created on first spill if not given
+        self._owns_spill_dir = False  # Whether spill_dir was made here (and so gets removed by clear)
+        self._hot_chunks: OrderedDict[tuple[int, int], dict[Point, Tile]] = OrderedDict()
+        self._spilled: set[tuple[int, int]] = set()
+        # Counters, to see how hard the cache is working
+        self.chunks_generated = 0
+        self.chunks_spilled = 0
+        self.chunks_reloaded = 0
+
+    def __getitem__(self, p: Point) -> Tile:
+        if not (0 <= p[0] < self.width and 0 <= p[1] < self.height):
+            raise KeyError(p)
+        return self.get_chunk(p[0] // self.chunk_size, p[1] // self.chunk_size)[p]
+
+    def __contains__(self, p) -> bool:
+        return 0 <= p[0] < self.width and 0 <= p[1] < self.height
+
+    def __len__(self) -> int:
+        return self.width * self.height
+
+    def __iter__(self):
+        for chunk in list(self._hot_chunks.values()):
+            yield from chunk
+
+    def get_chunk(self, chunk_x: int, chunk_y: int) -> dict[Point, Tile]:
+        """Returns the Tiles of a chunk, loading or generating it if it isn't hot"""
+        key = (chunk_x, chunk_y)
+        chunk = self._hot_chunks.get(key)
+        if chunk is not None:
+            self._hot_chunks.move_to_end(key)
+            return chunk
+
+        if key in self._spilled:
+            chunk = self._reload_chunk(key)
+        else:
+            grid = generate_chunk_grid(self.seed, chunk_x, chunk_y, self.chunk_size)
+            chunk = tile_data_from_grid(grid, OVERWORLD_TEMPLATES, self._chunk_origin(key))
+            self.chunks_generated += 1
+
+        self._hot_chunks[key] = chunk
+        while len(self._hot_chunks) > self.max_hot_chunks:
+            self._evict(*self._hot_chunks.popitem(last=False))
+        return chunk
+
+    @property
+    def hot_chunk_count(self) -> int:
+        return len(self._hot_chunks)
+
+    def clear(self):
+        """Forgets every chunk, deleting any spilled files (and spill_dir, if it was made here)"""
+        for key in self._spilled:
+            os.remove(self._spill_path(key))
+        if self._owns_spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+            self._owns_spill_dir = False
+        self._spilled.clear()
+        self._hot_chunks.clear()
+
+    def _chunk_origin(self, key: tuple[int, int]) -> Point:
+        return Point(key[0] * self.chunk_size, key[1] * self.chunk_size)
+
+    def _spill_path(self, key: tuple[int, int]) -> str:
+        return os.path.join(self.spill_dir, f"chunk_{key[0]}_{key[1]}.bin")
+
+    def _evict(self, key: tuple[int, int], chunk: dict[Point, Tile]):
+        """Drops a chunk from memory, spilling it to disk if the player has changed anything about it"""
+        seen = [tile.has_been_visible for tile in chunk.values()]
+        if not any(seen) and key not in self._spilled:
+            # Identical to what the seed generates, so there's nothing worth keeping
+            return
+
+        grid = np.array([_TEMPLATE_INDEX_BY_CHAR[tile.floor_char] for tile in chunk.values()], dtype=np.uint8)
+        packed = zlib.compress(grid.tobytes() + np.packbits(np.array(seen, dtype=bool)).tobytes())
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="imla_chunks_")
+            self._owns_spill_dir = True
+            logging.debug(f"Spilling overworld chunks to {self.spill_dir}")
+        with open(self._spill_path(key), "wb") as f:
+            f.write(packed)
+        self._spilled.add(key)
+        self.chunks_spilled += 1
+
+    def _reload_chunk(self, key: tuple[int, int]) -> dict[Point, Tile]:
+        with open(self._spill_path(key), "rb") as f:
+            raw = zlib.decompress(f.read())
+        cells = self.chunk_size * self.chunk_size
+        # Chunks are built (and so iterated) in [x, y] order, which is the order they were written in
+        grid = np.frombuffer(raw, dtype=np.uint8, count=cells).reshape((self.chunk_size, self.chunk_size))
+        seen = np.unpackbits(np.frombuffer(raw, dtype=np.uint8, offset=cells), count=cells).astype(bool)
+        chunk = tile_data_from_grid(grid, OVERWORLD_TEMPLATES, self._chunk_origin(key))
+        for tile, was_seen in zip(chunk.values(), seen.tolist()):
+            tile.has_been_visible = was_seen
+        self.chunks_reloaded += 1
+        return chunk
+
+
+class ChunkedLevelData(LevelData):
+    """A LevelData for an overworld too big to hold in memory. Tiles are generated in chunks from seed on demand,
+        so memory use depends on what's near the player rather than how big the world is"""
+
+    def __init__(self, seed: int, chunk_size: int = CHUNK_SIZE, world_chunks: int = WORLD_CHUNKS,
+                 max_hot_chunks: int = MAX_HOT_CHUNKS, spill_dir: str | None = None):
+        size = chunk_size * world_chunks
+        tiles = ChunkTiles(seed=seed, width=size, height=size, chunk_size=chunk_size,
+                           max_hot_chunks=max_hot_chunks, spill_dir=spill_dir)
+        super().__init__(tile_data=tiles, height=size, width=size, player_start_pos=Point(size // 2, size // 2),
+                         monsters=[], floor_items=[], floor_effects=[], interactables=[], vfx=[])
+        self.player_start_pos = self.find_open_point_near(self.player_start_pos)
+
+    def close(self):
+        self.tiles.clear()
+
+    def fov_row_limit(self, sight_range: int) -> int:
+        # Scanning the whole world isn't an option. Going a couple of rows past sight_range means tiles that were
+        # visible last turn still get re-checked (and cleared) after the player takes a step
+        return min(sight_range + 2, super().fov_row_limit(sight_range))
+
+    def find_open_point_near(self, p: Point, max_radius: int = 256) -> Point:
+        """Returns the closest tile to p (searching in growing squares) that doesn't block movement"""
+        for radius in range(max_radius):
+            for dx in range(-radius, radius + 1):
+                for dy in range(-radius, radius + 1):
+                    if max(abs(dx), abs(dy)) != radius:
+                        continue
+                    candidate = Point(p.x + dx, p.y + dy)
+                    if candidate in self.tiles and not self.tiles[candidate].is_blocking_move:
+                        return candidate
+        return p
@@ -0,0 +1,101 @@
+import logging
+
+from levelData import LevelData
+from levelPipeline import LevelPipeline
+from levelStorage import LevelStore
+from offscreenSim import OffscreenSimulator
+from screenDrawing import TopMessage
+
+
+class Dungeon:
+    """Keeps track of which floor the player is on, and hands them between floors when they take the stairs"""
+
+    def __init__(self, pipeline: LevelPipeline, level_store: LevelStore | None = None,
+                 offscreen: OffscreenSimulator | None = None):
+        self.pipeline = pipeline
+        self.depth = 0
+        self.current_level: LevelData | None = None
+        self.turns = 0  # Player turns taken so far, across every floor
+        # Floors the player has left, by depth
+        self.visited_levels = level_store if level_store is not None else LevelStore()
+        # Keeps the floors in visited_levels going while the player is elsewhere
+        self.offscreen = offscreen if offscreen is not None else OffscreenSimulator(seed=pipeline.base_seed)
+
+    def start(self, depth: int = 0) -> LevelData:
+        """Loads the first floor. The caller still needs to put a player on it"""
+        self.depth = depth
+        self.current_level = self._load_level(depth)
+        return self.current_level
+
+    def change_level(self, delta: int) -> bool:
+        """Moves the player delta floors (1 is down a floor, -1 is up). Returns False if there's nothing there"""
+        new_depth = self.depth + delta
+        if new_depth < 0:
+            return False
+
+        player = self.current_level.player
+        self.current_level.player = None
+        self.visited_levels.put(self.depth, self.current_level)
+        self.offscreen.left(self.depth, self.turns)
+
+        new_level = self._load_level(new_depth)
+        # Arrive on whichever stairs lead back to where we came from
+        arrival_pos = new_level.stairs_up_pos if delta > 0 else new_level.stairs_down_pos
+        player.pos = arrival_pos if arrival_pos is not None else new_level.player_start_pos
+        new_level.player = player
+
+        logging.debug(f"Player moved from floor {self.depth} to floor {new_depth}")
+        self.depth = new_depth
+        self.current_level = new_level
+        return True
+
+    def end_turn(self):
+        """Called once the player's turn (and the monsters' turns after it) are done"""
+        self.turns += 1
+        self.offscreen.end_turn(self.visited_levels, self.turns)
+
+    def close(self):
+        """Drops every floor, stored or current, along with anything they keep on disk"""
+        self.visited_levels.clear()
+        if self.current_level is not None:
+            self.current_level.close()
+
+    def _load_level(self, depth: int) -> LevelData:
+        if depth in self.visited_levels:
+            level_data = self.visited_levels.take(depth)
+            self.offscreen.catch_up(depth, level_data, self.turns)
+        else:
+            level_data = self.pipeline.take_level(depth)
+        # Get the floor(s) below started while the player is busy with this one
+        self.pipeline.prefetch_below(depth)
+        return level_data
+
+
+class DungeonManager:
+
+    _dungeon = None
+
+    @staticmethod
+    def set_dungeon(dungeon: Dungeon):
+        DungeonManager._dungeon = dungeon
+
+    @staticmethod
+    def get_dungeon() -> Dungeon:
+        return DungeonManager._dungeon
+
+
+def take_stairs(level_data: LevelData, delta: int) -> bool:
+    """Takes the stairs under the player (down if delta is 1, up if it's -1)
+        Returns True if the player changed floors"""
+    stairs_pos = level_data.stairs_down_pos if delta > 0 else level_data.stairs_up_pos
+    if level_data.player.pos != stairs_pos:
+        TopMessage.add_message(f"There are no stairs {'down' if delta > 0 else 'up'} here.")
+        return False
+
+    dungeon = DungeonManager.get_dungeon()
+    if dungeon is None or not dungeon.change_level(delta):
+        TopMessage.add_message("These stairs don't lead anywhere yet.")
+        return False
+
+    TopMessage.add_message(f"You {'descend' if delta > 0 else 'climb'} to floor {dungeon.depth + 1}.")
+    return True
@@ -4,11 +4,11 @@ from dataclasses import dataclass, field
 from typing import Callable, Protocol
 
 from globalEnums import TermColor, DamageType, ItemType, Point, ImlaConstants
-from levelData import LevelData, are_points_in_LOS, a_star_search, reconstruct_path, are_points_within_distance
+from levelData import LevelData, are_points_in_LOS, are_points_within_distance
+from imlaLogging import Trace, ai_log
+from projectiles import Impact, Projectile, fire_volley
 from screenDrawing import TopMessage
 
-logging.basicConfig(filename='Imladebug.log', filemode='w', level=logging.DEBUG)
-
 
 class Targetable(Protocol):
     name: str
@@ -57,10 +57,25 @@ class Player:
         TopMessage.add_message(f"{self.name} attacks {target.name}!")
         return target.take_damage(self.attack_power * 2, DamageType.PHYSICAL, level_data)
 
-    def default_ranged_attack(self, target: Targetable, level_data: LevelData):
+    def default_ranged_attack(self, target_pos: Point, level_data: LevelData) -> Impact:
+        """Fires at target_pos. The shot hits whatever it meets first on the way there, if anything"""
         # Later down the line, this will rely on having a certain weapon equipped/ammo/mana?/etc.
-        TopMessage.add_message(f"{self.name} attacks {target.name} from range!")
-        return target.take_damage(self.attack_power, DamageType.PHYSICAL, level_data)
+        TopMessage.add_message(f"{self.name} fires!")
+        impact = fire_volley(level_data, [Projectile(owner=self, origin=self.pos, target=target_pos,
+                                                     damage=self.attack_power)])[0]
+        if impact.hit is None:
+            TopMessage.add_message("The shot hits nothing.")
+        return impact
+
+
+def create_player(pos: Point, name: str = "PlayerName") -> Player:
+    """Returns a fresh level 1 player standing at pos"""
+    # This should likely also pull from an XML file or some such
+    player_armor = {DamageType.PHYSICAL: 0, DamageType.FIRE: 0, DamageType.LIGHTNING: 0, DamageType.COLD: 0,
+                    DamageType.CORROSIVE: 0}
+    return Player(name=name, pos=pos, display_char="@", display_color=TermColor.WHITE,
+                  health_max=10.0, health=10, armor=player_armor, attack_power=5,
+                  xp=0, next_level_xp=10, inventory=[])
 
 
 @dataclass()
@@ -100,6 +115,7 @@ class Monster:
     blocks_LOS: bool = False
     speed: int = 12
     action_points: int = 0
+    faction: str = "monsters"  # Monsters of a faction share what they know (see LevelData.pack)
 
     def update(self, level_data: LevelData):
         self.monster_update(self, level_data)
@@ -124,7 +140,8 @@ class Monster:
 
     def move_to(self, new_pos: Point):
         """Updates position, but does not check validity of new_pos"""
-        logging.debug(f"{self.name} is moving to {new_pos = } from {self.pos}")
+        if Trace.ai:
+            ai_log.debug(f"{self.name} is moving to {new_pos = } from {self.pos}")
         self.pos = new_pos
 
     def look_at(self) -> str:
@@ -152,31 +169,104 @@ def melee_monster_update(self: Monster, level_data: LevelData):
         player = level_data.player
         if abs(self.pos.x - player.pos.x) <= 1 and abs(self.pos.y - player.pos.y) <= 1:
             # If player is in melee range
-            logging.debug(f"Monster is adjacent to player, attacking!")
+            if Trace.ai:
+                ai_log.debug(f"Monster is adjacent to player, attacking!")
             raw_damage = random.randint(self.attack_power - 1, self.attack_power + 1)
             damage_done = self.attack(player, raw_damage, DamageType.PHYSICAL, level_data)
-            logging.debug(f"{self.name} attacked the player for {damage_done} damage!")
+            if Trace.ai:
+                ai_log.debug(f"{self.name} attacked the player for {damage_done} damage!")
         else:
             # Player is not in melee range, so check if they are in LOS
-            if level_data.tiles[self.pos].is_in_LOS and are_points_within_distance(player.pos, self.pos, self.sight_range):
-                # Player is in LOS, so store path and path towards them
-                logging.debug(f"Monster at {self.pos} can see player at {player.pos}")
-                came_from, cost_so_far = a_star_search(level_data=level_data, start_pos=self.pos, goal_pos=player.pos)
-                self.stored_path = reconstruct_path(came_from=came_from, start_point=self.pos, goal_point=player.pos)
-                self.move_to(self.stored_path.pop(0))
-            else:
-                # Player is not in LOS, check if monster has a path already (ie. previously saw player)
-                logging.debug(f"Monster at {self.pos} cannot see player at {player.pos}, {hasattr(self, 'stored_path')}")
-                if hasattr(self, 'stored_path') and len(self.stored_path) > 0:
-                    self.move_to(self.stored_path.pop(0))
+            look_for_player(self, level_data)
+            close_in(self, level_data)
+
+
+def look_for_player(self: Monster, level_data: LevelData) -> bool:
+    """Returns True if the player is in sight, in which case the rest of the pack is told where they are"""
+    player = level_data.player
+    pack = level_data.pack(self.faction)
+    if level_data.tiles[self.pos].is_in_LOS and are_points_within_distance(player.pos, self.pos, self.sight_range):
+        if Trace.ai:
+            ai_log.debug(f"Monster at {self.pos} can see player at {player.pos}")
+        pack.report_sighting(player.pos, level_data.turns)
+        return True
+    if Trace.ai:
+        ai_log.debug(f"Monster at {self.pos} cannot see player at {player.pos}, pack last saw them at "
+                     f"{pack.last_seen_pos} on turn {pack.last_seen_turn}")
+    return False
+
+
+def close_in(self: Monster, level_data: LevelData):
+    """Takes a step towards the player, by whatever the pack knows about where they are"""
+    pack = level_data.pack(self.faction)
+    next_pos = None
+    if pack.last_seen_turn == level_data.turns:
+        # Someone in the pack can see the player, so close in on them together
+        next_pos = pack.next_step(level_data, self.pos)
+    elif pack.remembers_player(level_data.turns):
+        # Out of sight, so follow their scent. Failing that, head for wherever the pack last saw them
+        next_pos = follow_scent(self, level_data)
+        if next_pos is None:
+            next_pos = pack.next_step(level_data, self.pos)
+    if next_pos is not None:
+        level_data.move_occupant(self.pos, next_pos)
+        self.move_to(next_pos)
+
+
+def follow_scent(self: Monster, level_data: LevelData) -> Point | None:
+    """Returns the free neighbour with the strongest player scent, if it's stronger than here"""
+    if level_data.scent is None:
+        return None
+    return level_data.scent.uphill_step(self.pos, level_data.occupied_tiles())
 
 
 def ranged_monster_update(self: Monster, level_data: LevelData):
-    pass
+    """Shoots at the player whenever it has a clear shot, and otherwise closes in with its pack
+        Shots are queued on level_data.projectiles and land together once every monster has had its turn"""
+    self.action_points += self.speed
+    while self.action_points >= ImlaConstants.BASE_SPEED:
+        self.action_points -= ImlaConstants.BASE_SPEED
+        if look_for_player(self, level_data):
+            shot = clear_shot(self, level_data)
+            if shot is not None:
+                if Trace.ai:
+                    ai_log.debug(f"{self.name} at {self.pos} shoots at the player at {shot.target}")
+                TopMessage.add_message(f"{self.name} shoots at {level_data.player.name}!")
+                level_data.projectiles.append(shot)
+                continue
+        close_in(self, level_data)
+
+
+def clear_shot(self: Monster, level_data: LevelData) -> Projectile | None:
+    """A shot at the player, if it would reach them without hitting a wall or anyone else on the way"""
+    player = level_data.player
+    shot = Projectile(owner=self, origin=self.pos, target=player.pos, damage=0, max_range=self.sight_range,
+                      display_color=self.display_color)
+    if not shot.path or shot.path[-1] != player.pos:
+        return None
+    tiles = level_data.tiles
+    # Everyone's position this turn, kept up to date as they move
+    crowd = level_data.occupied_tiles()
+    if any(tiles[p].is_blocking_LOS or p in crowd for p in shot.path[:-1]):
+        return None
+    shot.damage = random.randint(self.attack_power - 1, self.attack_power + 1)
+    return shot
 
 
 def hunter_monster_update(self: Monster, level_data: LevelData):
-    pass
+    """Tracks the player by scent alone, whether or not it can see them, and attacks once it catches up"""
+    self.action_points += self.speed
+    while self.action_points >= ImlaConstants.BASE_SPEED:
+        self.action_points -= ImlaConstants.BASE_SPEED
+        player = level_data.player
+        if abs(self.pos.x - player.pos.x) <= 1 and abs(self.pos.y - player.pos.y) <= 1:
+            raw_damage = random.randint(self.attack_power - 1, self.attack_power + 1)
+            self.attack(player, raw_damage, DamageType.PHYSICAL, level_data)
+            continue
+        next_pos = follow_scent(self, level_data)
+        if next_pos is not None:
+            level_data.move_occupant(self.pos, next_pos)
+            self.move_to(next_pos)
 
 
 @dataclass()
@@ -227,6 +317,11 @@ def chest_on_open(self: Interactable, level_data: LevelData):
     pass
 
 
+# Every update function an entity can hold, by name, so saved entities can refer to them by name
+ENTITY_UPDATES: dict[str, Callable] = {f.__name__: f for f in (melee_monster_update, ranged_monster_update,
+                                                              hunter_monster_update, fire_burn_update, chest_on_open)}
+
+
 def damage_after_mitigation(raw_amount: float, armor: int) -> float:
     # Damage multiplier = 1 - (0.06 * total armor) / (1 + 0.06 * abs(total armor))
     multiplier = 1 - (0.06 * armor) / (1 + 0.06 * abs(armor))
@@ -0,0 +1,138 @@
+import numpy as np
+
+from globalEnums import Point, TermColor
+from levelData import LevelData
+from screenDrawing import Camera, bottom_status_fields, color_escape, top_message_line
+
+# A whole screen as a flat, row-major array of glyph indices, so two frames can be compared cell by cell and only the
+# cells that changed get sent. Glyphs (a char plus its color) are numbered by a GlyphTable, which can be shared by
+# every screen being drawn
+BLANK_GLYPH = 0
+# Every frame ends by parking the cursor in the top-left, which also tells a client where one frame ends
+FRAME_END = "\x1b[H"
+
+
+class GlyphTable:
+    """Numbers every (char, color) pair drawn, and keeps the terminal output for each. color None is the default color
+        Only ever grows, so an index means the same glyph for as long as the table is around"""
+
+    def __init__(self, term):
+        self.term = term
+        self.glyphs: list[tuple[str, TermColor | None]] = []
+        self.escapes: list[str] = []  # The color part of each glyph's output. The char goes after it
+        self._indices: dict[tuple[str, TermColor | None], int] = {}
+        self._moves: dict[int, str] = {}  # term.move_xy is slow enough to show up, so those get cached too
+        self.index(" ", None)
+
+    def __len__(self) -> int:
+        return len(self.glyphs)
+
+    def index(self, char: str, color: TermColor | None) -> int:
+        key = (char, color)
+        index = self._indices.get(key)
+        if index is None:
+            index = self._indices[key] = len(self.glyphs)
+            self.glyphs.append(key)
+            self.escapes.append(self.term.normal if color is None else color_escape(self.term, color))
+        return index
+
+    def move(self, col: int, row: int) -> str:
+        key = row * 65536 + col
+        move = self._moves.get(key)
+        if move is None:
+            move = self._moves[key] = self.term.move_xy(col, row)
+        return move
+
+
+def put_text(cells: list[int], width: int, row: int, col: int, text: str, glyphs: GlyphTable,
+             color: TermColor | None = None) -> int:
+    """Writes text into cells starting at (col, row), cut off at the edge of the screen. Returns the column after it"""
+    base = row * width
+    for char in text[:max(0, width - col)]:
+        cells[base + col] = glyphs.index(char, color)
+        col += 1
+    return col
+
+
+def compose_frame_cells(level_data: LevelData, camera: Camera, message: str, width: int, height: int,
+                        glyphs: GlyphTable) -> np.ndarray:
+    """Returns the screen main() would draw - top message, camera view and bottom status - as glyph indices
+        Draws in the same order as compose_camera, so later draws land on top"""
+    cells = [BLANK_GLYPH] * (width * height)
+    index = glyphs.index
+    cam_x, cam_y = camera.cam_origin_x, camera.cam_origin_y
+    cam_width = min(camera.cam_width, width - camera.term_origin_x)
+    cam_height = min(camera.cam_height, height - camera.term_origin_y)
+
+    tiles = level_data.tiles
+    for row in range(cam_height):
+        base = (row + camera.term_origin_y) * width + camera.term_origin_x
+        for col in range(cam_width):
+            try:
+                tile = tiles[Point(cam_x + col, cam_y + row)]
+            except KeyError:
+                continue
+            if tile.is_visible:
+                cells[base + col] = index(tile.floor_char, tile.visible_color)
+            elif tile.has_been_visible:
+                cells[base + col] = index(tile.floor_char, tile.fow_color)
+
+    def put(pos: Point, char: str, color: TermColor):
+        col, row = pos.x - cam_x, pos.y - cam_y
+        if 0 <= col < cam_width and 0 <= row < cam_height:
+            cells[(row + camera.term_origin_y) * width + camera.term_origin_x + col] = index(char, color)
+
+    for entity_list in (level_data.floor_items, level_data.interactables, level_data.monsters,
+                        level_data.floor_effects, level_data.vfx):
+        for entity in entity_list:
+            if entity.is_visible and tiles[entity.pos].is_visible:
+                put(entity.pos, entity.display_char, entity.display_color)
+    player = level_data.player
+    put(player.pos, player.display_char, player.display_color)
+
+    put_text(cells, width, 0, 0, top_message_line(message, width - 3), glyphs)
+    formatted_health, formatted_pos = bottom_status_fields(level_data)
+    col = put_text(cells, width, height - 2, 0, "Health: ", glyphs)
+    put_text(cells, width, height - 2, col, formatted_health, glyphs, TermColor.RED)
+    put_text(cells, width, height - 1, 0, f"Player loc: {formatted_pos}", glyphs, TermColor.MAGENTA)
+    return np.array(cells, dtype=np.uint32)
+
+
+class FrameDiffer:
+    """Remembers the last frame sent to one screen, to work out which cells the next frame changes"""
+
+    def __init__(self):
+        self.previous: np.ndarray | None = None
+
+    def changed_cells(self, cells: np.ndarray) -> np.ndarray:
+        """Indices of the cells that differ from the last frame (all of them, the first time)"""
+        if self.previous is None or self.previous.shape != cells.shape:
+            changed = np.arange(len(cells))
+        else:
+            changed = np.flatnonzero(cells != self.previous)
+        self.previous = cells
+        return changed
+
+    def reset(self):
+        """Forgets the last frame, so the next one is sent in full"""
+        self.previous = None
+
+
+def render_cells(cells: np.ndarray, changed: np.ndarray, width: int, glyphs: GlyphTable) -> str:
+    """Returns the terminal output that redraws the changed cells, ending with FRAME_END
+        Runs of neighbouring cells on a row share one cursor move, and runs of one color share one color escape"""
+    out = []
+    next_cell = -1
+    current_escape = None
+    for cell in changed.tolist():
+        if cell != next_cell or cell % width == 0:
+            out.append(glyphs.move(cell % width, cell // width))
+        glyph = int(cells[cell])
+        escape = glyphs.escapes[glyph]
+        if escape != current_escape:
+            out.append(escape)
+            current_escape = escape
+        out.append(glyphs.glyphs[glyph][0])
+        next_cell = cell + 1
+    out.append(glyphs.term.normal + FRAME_END)
+    return "".join(out)
@@ -0,0 +1,322 @@
+# Hosts many games at once over telnet-style connections, one session per connection, all in one process
+# Run with e.g.: python gameServer.py --port 4000   (then: telnet localhost 4000)
+#            or: python gameServer.py --unix /tmp/imla.sock
+# Load test it with serverLoadTest.py
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from autoTravel import TravelManager
+from dungeon import Dungeon, DungeonManager
+from entity import create_player
+from frameDiff import FrameDiffer, GlyphTable, compose_frame_cells, render_cells
+from gameTurn import ThreatWatch, run_keys
+from headlessRunner import CountingSink, headless_terminal
+from imlaLogging import LoggingManager
+from keymap import DEFAULT_BINDINGS, Keymap
+from levelGeneration import DEFAULT_LVLARGS
+from levelPipeline import SharedLevelPipeline
+from profiler import ROLLING_WINDOW
+from screenDrawing import Camera, TopMessage, WindowManager
+from shadowCasting import refresh_visibility
+from spectatorStream import SpectatorHub
+
+SESSION_WIDTH, SESSION_HEIGHT = 80, 24  # What a telnet client starts out as
+LISTEN_BACKLOG = 1024  # asyncio's default of 100 turns away a burst of connections, like a load test starting up
+# Commands that wait on the console keyboard (the targeting cursor), change things for the whole process (the debug
+# keys), or run many turns in one go without yielding (auto-explore, which would stall every other session) can't run
+# inside a session, so sessions don't bind them
+SESSION_BLOCKED_COMMANDS = ({"ranged_attack", "travel", "explore", "minimap", "overview"}
+                            | {f"debug_{i}" for i in range(1, 10)})
+SESSION_BINDINGS = {command_id: keys for command_id, keys in DEFAULT_BINDINGS.items()
+                    if command_id not in SESSION_BLOCKED_COMMANDS}
+
+# Telnet. The server offers to echo and to suppress go-ahead, which puts clients into character-at-a-time mode
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+TELNET_ECHO, TELNET_SUPPRESS_GO_AHEAD = 1, 3
+TELNET_NEGOTIATION = bytes([IAC, WILL, TELNET_ECHO, IAC, WILL, TELNET_SUPPRESS_GO_AHEAD])
+# Input escape sequences -> the blessed key names the keymap binds
+ESCAPE_SEQUENCES = {
+    "\x1b[A": "KEY_UP", "\x1b[B": "KEY_DOWN", "\x1b[C": "KEY_RIGHT", "\x1b[D": "KEY_LEFT",
+    "\x1bOA": "KEY_UP", "\x1bOB": "KEY_DOWN", "\x1bOC": "KEY_RIGHT", "\x1bOD": "KEY_LEFT",
+    "\x1bOP": "KEY_F1", "\x1bOQ": "KEY_F2", "\x1bOR": "KEY_F3", "\x1bOS": "KEY_F4", "\x1b[15~": "KEY_F5",
+    "\x1b[17~": "KEY_F6", "\x1b[18~": "KEY_F7", "\x1b[19~": "KEY_F8", "\x1b[20~": "KEY_F9",
+}
+CONTROL_KEYS = {"\r": "KEY_ENTER", "\n": "KEY_ENTER", "\t": "KEY_TAB", "\x1b": "KEY_ESCAPE"}
+
+
+class TelnetInput:
+    """Turns the bytes a telnet client sends into key names, dropping telnet negotiation along the way
+        Anything cut off partway through a negotiation is held until the rest of it arrives"""
+
+    def __init__(self):
+        self._pending = b""
+
+    def feed(self, data: bytes) -> list[str]:
+        data = self._pending + data
+        self._pending = b""
+        text = bytearray()
+        i = 0
+        while i < len(data):
+            if data[i] != IAC:
+                text.append(data[i])
+                i += 1
+                continue
+            if i + 1 >= len(data):
+                self._pending = data[i:]
+                break
+            command = data[i + 1]
+            if command == IAC:
+                text.append(IAC)
+                i += 2
+            elif command in (DO, DONT, WILL, WONT):
+                if i + 2 >= len(data):
+                    self._pending = data[i:]
+                    break
+                i += 3
+            elif command == SB:
+                end = data.find(bytes([IAC, SE]), i)
+                if end < 0:
+                    self._pending = data[i:]
+                    break
+                i = end + 2
+            else:
+                i += 2
+        return _key_names(text.decode("utf-8", errors="ignore"))
+
+
+def _key_names(text: str) -> list[str]:
+    keys = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "\x1b":
+            sequence = next((s for s in ESCAPE_SEQUENCES if text.startswith(s, i)), char)
+            keys.append(ESCAPE_SEQUENCES.get(sequence, "KEY_ESCAPE"))
+            i += len(sequence)
+            continue
+        i += 1
+        if char == "\r" and i < len(text) and text[i] in "\n\0":
+            i += 1  # Telnet sends Enter as \r\n or \r\0
+        if char == "\0":
+            continue
+        keys.append(CONTROL_KEYS.get(char, char))
+    return keys
+
+
+class GameSession:
+    """One player's game: their own dungeon, camera, keymap and messages, drawn as frame diffs"""
+
+    def __init__(self, session_id: int, server: "GameServer"):
+        self.session_id = session_id
+        self.server = server
+        self.width, self.height = server.width, server.height
+        self.dungeon = Dungeon(server.pipeline)
+        self.camera = Camera(cam_origin_x=0, cam_origin_y=1, cam_width=self.width, cam_height=self.height - 3,
+                             term_origin_x=0, term_origin_y=1, term=server.term)
+        self.keymap = Keymap(SESSION_BINDINGS)
+        self.threat_watch = ThreatWatch()
+        self.differ = FrameDiffer()
+        self.message_buffer = ""
+        self.travel_plan = None
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        # Spectators watch a session on the channel numbered after it
+        self.spectator_channel = server.spectators.open_channel(session_id) if server.spectators is not None else None
+
+        with self.active():
+            level_data = self.dungeon.start()
+            level_data.player = create_player(level_data.player_start_pos)
+
+    @contextmanager
+    def active(self):
+        """Points the game's static managers (dungeon, camera, messages, travel) at this session while it runs
+            Sessions take turns on the one event loop thread, and a turn never awaits, so they can't overlap"""
+        DungeonManager.set_dungeon(self.dungeon)
+        WindowManager.set_main_camera(self.camera)
+        TopMessage.set_terminal(None)  # Messages end up in the frame, not printed
+        TopMessage.message_buffer = self.message_buffer
+        TravelManager.set_plan(self.travel_plan)
+        try:
+            yield
+        finally:
+            self.message_buffer = TopMessage.message_buffer
+            TopMessage.message_buffer = ""
+            self.travel_plan = TravelManager.get_plan()
+            TravelManager.set_plan(None)
+
+    def press(self, keys: list[str]) -> bool:
+        """Runs the turns for keys. Returns False if the player quit"""
+        with self.active():
+            return run_keys(keys, self.keymap, self.dungeon, self.server.term, self.threat_watch)
+
+    def render_frame(self) -> str:
+        """Returns the terminal output that brings the client's screen up to date - everything the first time,
+            just the changed cells after that"""
+        level_data = self.dungeon.current_level
+        player = level_data.player
+        refresh_visibility(player.pos.x, player.pos.y, player.sight_range, level_data)
+        self.camera.center_camera_on_player(level_data)
+        cells = compose_frame_cells(level_data, self.camera, self.message_buffer, self.width, self.height,
+                                    self.server.glyphs)
+        self.message_buffer = ""
+        level_data.vfx.clear()
+        if self.spectator_channel is not None:
+            self.spectator_channel.publish(cells, self.width, self.height)
+
+        frame = render_cells(cells, self.differ.changed_cells(cells), self.width, self.server.glyphs)
+        if self.frames_sent == 0:
+            frame = self.server.term.hide_cursor + frame
+        self.frames_sent += 1
+        self.bytes_sent += len(frame)
+        return frame
+
+    def close(self):
+        if self.spectator_channel is not None:
+            self.server.spectators.close_channel(self.session_id)
+        self.dungeon.close()
+
+
+class GameServer:
+    """Runs a GameSession for every connection on one asyncio event loop
+        Everything read-only is shared between sessions: the terminal used for escape codes, the glyph table,
+        and the floors themselves (generated once by a SharedLevelPipeline, then copied out to each session)
+        With spectate=True every session can also be watched, through a SpectatorHub started by serve()"""
+
+    def __init__(self, seed: int, lvlargs: dict | None = None, width: int = SESSION_WIDTH,
+                 height: int = SESSION_HEIGHT, spectate: bool = False):
+        self.width, self.height = width, height
+        self.term = headless_terminal(CountingSink())
+        self.glyphs = GlyphTable(self.term)
+        self.spectators = SpectatorHub(self.glyphs) if spectate else None
+        self.pipeline = SharedLevelPipeline(lvlargs=lvlargs if lvlargs is not None else DEFAULT_LVLARGS,
+                                            base_seed=seed)
+        self.sessions: dict[int, GameSession] = {}
+        self.sessions_served = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.press_seconds: deque[float] = deque(maxlen=ROLLING_WINDOW)  # Turns plus drawing, per batch of input
+        self._next_session_id = 0
+
+    def open_session(self) -> GameSession:
+        session = GameSession(self._next_session_id, self)
+        self.sessions[session.session_id] = session
+        self._next_session_id += 1
+        self.sessions_served += 1
+        return session
+
+    def close_session(self, session: GameSession):
+        if session.session_id not in self.sessions:
+            return  # Already closed by shutdown()
+        self.frames_sent += session.frames_sent
+        self.bytes_sent += session.bytes_sent
+        session.close()
+        del self.sessions[session.session_id]
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = self.open_session()
+        logging.debug(f"Session {session.session_id} connected ({len(self.sessions)} open)")
+        telnet_input = TelnetInput()
+        try:
+            writer.write(TELNET_NEGOTIATION + session.render_frame().encode())
+            await writer.drain()
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                keys = telnet_input.feed(data)
+                if not keys:
+                    continue
+                # Whatever arrived together gets run together and drawn once, like --coalesce-input
+                tic = time.perf_counter()
+                running = session.press(keys)
+                frame = session.render_frame() if running else ""
+                self.press_seconds.append(time.perf_counter() - tic)
+                if not running:
+                    break
+                writer.write(frame.encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.close_session(session)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            logging.debug(f"Session {session.session_id} closed after {session.frames_sent} frames "
+                          f"({session.bytes_sent} bytes)")
+
+    async def start(self, host: str = "127.0.0.1", port: int | None = None,
+                    unix_path: str | None = None) -> asyncio.AbstractServer:
+        """Starts listening on a UNIX socket if unix_path is given, else on host:port"""
+        if unix_path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path=unix_path, backlog=LISTEN_BACKLOG)
+        return await asyncio.start_server(self.handle_connection, host=host, port=port, backlog=LISTEN_BACKLOG)
+
+    def stats(self) -> str:
+        frames = self.frames_sent + sum(s.frames_sent for s in self.sessions.values())
+        sent = self.bytes_sent + sum(s.bytes_sent for s in self.sessions.values())
+        times = sorted(self.press_seconds)
+        timing = (f", input handled in {statistics.median(times) * 1000:0.2f}ms median / "
+                  f"{times[int(len(times) * 0.95)] * 1000:0.2f}ms p95" if times else "")
+        spectating = ""
+        if self.spectators is not None:
+            streams = self.spectators.all_stats()
+            spectating = (f", {streams.spectators} spectators sent {streams.bytes_sent} bytes, "
+                          f"{streams.encoded_bytes / max(streams.frames, 1):0.0f} bytes per spectator frame")
+        return (f"{self.sessions_served} sessions served ({len(self.sessions)} open), {frames} frames, "
+                f"{sent / max(frames, 1):0.0f} bytes per frame, {len(self.glyphs)} glyphs, "
+                f"{self.pipeline.packed_bytes / 1024:0.1f}KB of shared floors{timing}{spectating}")
+
+    def shutdown(self):
+        for session in list(self.sessions.values()):
+            self.close_session(session)
+        self.pipeline.shutdown()
+
+
+async def serve(server: GameServer, host: str, port: int | None, unix_path: str | None,
+                spectate_port: int | None = None, spectate_unix: str | None = None):
+    if server.spectators is not None:
+        await server.spectators.start(host, spectate_port, spectate_unix)
+    listener = await server.start(host, port, unix_path)
+    logging.info(f"Serving on {unix_path if unix_path is not None else f'{host}:{port}'}")
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hosts ImlaRL games over telnet-style connections")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=4000, help="TCP port to listen on")
+    parser.add_argument("--unix", metavar="PATH", default=None, help="listen on a UNIX socket at PATH instead")
+    parser.add_argument("--seed", type=int, default=None, help="dungeon seed every session plays (default: random)")
+    parser.add_argument("--width", type=int, default=SESSION_WIDTH, help="screen width sessions are drawn at")
+    parser.add_argument("--height", type=int, default=SESSION_HEIGHT, help="screen height sessions are drawn at")
+    parser.add_argument("--spectate-port", type=int, default=None, metavar="PORT",
+                        help="let spectatorStream.py watch any session (by its number) on this TCP port")
+    parser.add_argument("--spectate-unix", metavar="PATH", default=None,
+                        help="let spectatorStream.py watch any session on a UNIX socket at PATH")
+    args = parser.parse_args()
+
+    LoggingManager.setup_logging()
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    spectate = args.spectate_port is not None or args.spectate_unix is not None
+    server = GameServer(seed, width=args.width, height=args.height, spectate=spectate)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix, args.spectate_port, args.spectate_unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(server.stats())
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
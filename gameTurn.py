@@ -0,0 +1,133 @@
+import logging
+from collections import deque
+
+from autoTravel import CONTINUE_TRAVEL, TravelManager
+from dungeon import Dungeon
+from inputHandling import execute_command
+from keymap import Keymap
+from levelData import LevelData
+from profiler import Profiler, SPAN_AI, SPAN_FOV
+from projectiles import resolve_pending_projectiles
+from scentMap import lay_player_scent
+from shadowCasting import refresh_visibility
+
+# Upper bound on how many queued keys get read in one go, so a stuck key can't keep the screen from ever redrawing
+MAX_DRAINED_KEYS = 64
+# Commands that read keys of their own from the terminal (the targeting cursor), so anything queued after them is theirs
+SELF_READING_COMMANDS = {"ranged_attack", "travel"}
+
+
+def drain_keys(term, limit: int = MAX_DRAINED_KEYS) -> list:
+    """Returns every key that's already waiting (up to limit) without blocking"""
+    keys = []
+    while len(keys) < limit:
+        key = term.inkey(timeout=0)
+        if not key:
+            break
+        keys.append(key)
+    return keys
+
+
+def end_player_turn(level_data: LevelData):
+    """Everything that happens once the player's turn is done"""
+    with Profiler.span(SPAN_AI):
+        lay_player_scent(level_data)
+        for m in level_data.monsters:
+            m.update(level_data)
+        # After the loop, since a volley can kill monsters (and so change level_data.monsters)
+        resolve_pending_projectiles(level_data)
+    level_data.turns += 1
+    # Other update bits will go here as well. Floor effects ticking/etc.
+
+
+def visible_monster_ids(level_data: LevelData) -> set[int]:
+    return {id(m) for m in level_data.monsters if level_data.tiles[m.pos].is_visible}
+
+
+class ThreatWatch:
+    """Notices when queued-up input shouldn't keep running - a new monster coming into view or the player getting hurt
+        Call watch() before running the input, then check() after each turn"""
+
+    def __init__(self):
+        self.level_data = None
+        self.visible_monsters: set[int] = set()
+        self.player_health = 0.0
+
+    def watch(self, level_data: LevelData):
+        self.level_data = level_data
+        self.visible_monsters = visible_monster_ids(level_data)
+        self.player_health = level_data.player.health
+
+    def check(self, level_data: LevelData) -> bool:
+        """Returns True if something worth stopping for happened since the last watch/check. Needs fresh FOV"""
+        if level_data is not self.level_data:
+            # New floor, so anything in view is new
+            self.level_data = level_data
+            self.visible_monsters = set()
+
+        visible = visible_monster_ids(level_data)
+        spotted = visible - self.visible_monsters
+        hurt = level_data.player.health < self.player_health
+        self.visible_monsters = visible
+        self.player_health = level_data.player.health
+        if spotted or hurt:
+            logging.debug(f"Stopping queued input: {len(spotted)} monster(s) came into view, player hurt: {hurt}")
+            return True
+        return False
+
+
+def run_keys(keys: list, keymap: Keymap, dungeon: Dungeon, term, threat_watch: ThreatWatch | None = None) -> bool:
+    """Runs the turns for a batch of keys (and any repeat counts they finish) without drawing anything in between
+        If threat_watch is given, a threat drops the rest of the batch and whatever else is queued
+        Explore/travel carry on here step by step until they finish. They always stop for threats, or any keypress
+        The batch is cut at a command that reads its own keys, and the rest of it put back on term for that command
+        Returns False if one of the commands was quit"""
+    pending_keys = deque(keys)
+    commands = deque()
+    # Travel needs watching even if the caller doesn't want queued keys interrupted
+    travel_watch = threat_watch if threat_watch is not None else ThreatWatch()
+    travel_watch.watch(dungeon.current_level)
+
+    while commands or pending_keys:
+        if not commands:
+            commands.extend(keymap.feed(pending_keys.popleft()))
+            continue
+
+        command = commands.popleft()
+        if command.name == "quit":
+            return False
+        if command.name in SELF_READING_COMMANDS and pending_keys:
+            term.ungetch("".join(pending_keys))
+            pending_keys.clear()
+
+        level_data = dungeon.current_level
+        player_turn_done = execute_command(command, level_data, term)
+        if not player_turn_done:
+            continue
+
+        # The player may have taken the stairs
+        level_data = dungeon.current_level
+        end_player_turn(level_data)
+        dungeon.end_turn()
+        travelling = TravelManager.get_plan() is not None
+
+        if commands or pending_keys or travelling:
+            # The next turn (and the threat check) need to see what this one changed. The last turn's FOV
+            # gets done by the caller before drawing
+            player = level_data.player
+            with Profiler.span(SPAN_FOV):
+                refresh_visibility(player.pos.x, player.pos.y, player.sight_range, level_data)
+            threatened = travel_watch.check(level_data)
+            if travelling and (threatened or drain_keys(term, limit=1)):
+                TravelManager.stop()
+                travelling = False
+            if threatened and threat_watch is not None:
+                commands.clear()
+                pending_keys.clear()
+                keymap.reset()
+                drain_keys(term)
+
+        if travelling:
+            commands.appendleft(CONTINUE_TRAVEL)
+
+    return True
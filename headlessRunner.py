@@ -0,0 +1,139 @@
+# Runs the game without a console - seeded, with scripted (or random) keys - for benchmarks and diagnostics
+# Run with e.g.: python headlessRunner.py --seed 3 --turns 500 --memory --leak-check 200
+import argparse
+import io
+import logging
+import random
+import time
+
+import blessed
+
+from dungeon import Dungeon, DungeonManager
+from entity import create_player
+from gameTurn import ThreatWatch, run_keys
+from keymap import DEFAULT_BINDINGS, Keymap
+from levelData import LevelData
+from levelGeneration import DEFAULT_LVLARGS
+from levelPipeline import LevelPipeline
+from memoryReport import diff_snapshots, format_report, start_tracing, take_snapshot
+from screenDrawing import Camera, TopMessage, WindowManager, update_bottom_status
+from shadowCasting import refresh_visibility
+
+HEADLESS_WIDTH, HEADLESS_HEIGHT = 120, 30
+RANDOM_WALK_KEYS = ["1", "2", "3", "4", "6", "7", "8", "9", "5"]
+
+
+class CountingSink(io.TextIOBase):
+    """A stream that throws away everything written to it, keeping count of how much that was"""
+
+    def __init__(self):
+        super().__init__()
+        self.chars_written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        self.chars_written += len(s)
+        return len(s)
+
+
+def headless_terminal(stream=None) -> blessed.Terminal:
+    """A 256-color terminal that writes into stream (a StringIO if not given), so drawing works without a console"""
+    return blessed.Terminal(kind="xterm-256color", stream=stream if stream is not None else io.StringIO(),
+                            force_styling=True)
+
+
+class HeadlessGame:
+    """A whole game - dungeon, player, camera - drawing into a CountingSink instead of a console"""
+
+    def __init__(self, seed: int, lvlargs: dict | None = None, keymap: Keymap | None = None,
+                 interrupt_on_threat: bool = False, wrap_term=None):
+        self.sink = CountingSink()
+        self.term = headless_terminal(self.sink)
+        if wrap_term is not None:
+            # e.g. replayLog.ReplayInput, which answers inkey from a recording
+            self.term = wrap_term(self.term)
+        self.camera = Camera(cam_origin_x=0, cam_origin_y=1, cam_width=HEADLESS_WIDTH, cam_height=HEADLESS_HEIGHT - 3,
+                             term_origin_x=0, term_origin_y=1, term=self.term)
+        WindowManager.set_main_camera(self.camera)
+        TopMessage.set_terminal(self.term)
+
+        self.pipeline = LevelPipeline(lvlargs=lvlargs if lvlargs is not None else DEFAULT_LVLARGS, base_seed=seed)
+        self.dungeon = Dungeon(self.pipeline)
+        DungeonManager.set_dungeon(self.dungeon)
+        level_data = self.dungeon.start()
+        self.player = create_player(level_data.player_start_pos)
+        level_data.player = self.player
+        self.keymap = keymap if keymap is not None else Keymap(DEFAULT_BINDINGS)
+        self.threat_watch = ThreatWatch() if interrupt_on_threat else None
+        self.turns = 0
+        self.draw_frame()
+
+    @property
+    def level_data(self) -> LevelData:
+        return self.dungeon.current_level
+
+    def draw_frame(self):
+        """What the main loop does between inputs"""
+        level_data = self.level_data
+        refresh_visibility(self.player.pos.x, self.player.pos.y, self.player.sight_range, level_data)
+        self.camera.center_camera_on_player(level_data)
+        self.camera.draw_camera(level_data)
+        update_bottom_status(self.term, level_data)
+        TopMessage.flush_message()
+
+    def press(self, keys: list) -> bool:
+        """Runs keys as if they'd all been queued up at once, then draws. Returns False if they quit"""
+        running = run_keys(keys, self.keymap, self.dungeon, self.term, self.threat_watch)
+        self.turns += 1
+        self.draw_frame()
+        return running
+
+    def close(self):
+        self.pipeline.shutdown()
+        self.dungeon.close()
+
+
+def random_walk(seed: int, count: int) -> list[str]:
+    rng = random.Random(seed)
+    return [rng.choice(RANDOM_WALK_KEYS) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a seeded game without a console")
+    parser.add_argument("--seed", type=int, default=0, help="dungeon seed")
+    parser.add_argument("--turns", type=int, default=200, help="keypresses to run (a random walk)")
+    parser.add_argument("--keys", default=None, help="keys to press instead of a random walk, e.g. 666n10.")
+    parser.add_argument("--memory", action="store_true", help="report memory use by category at the end")
+    parser.add_argument("--leak-check", type=int, default=0, metavar="N",
+                        help="diff memory (with tracemalloc) between after the first key and N keys later")
+    args = parser.parse_args()
+
+    keys = list(args.keys) if args.keys is not None else random_walk(args.seed, args.turns)
+    if args.leak_check:
+        start_tracing()
+    game = HeadlessGame(args.seed)
+    leak_start = None
+
+    tic = time.perf_counter()
+    for i, key in enumerate(keys):
+        if not game.press([key]):
+            break
+        if args.leak_check:
+            if i == 0:
+                leak_start = take_snapshot(game.level_data, f"key {i + 1}")
+            elif i == args.leak_check:
+                print("\n".join(diff_snapshots(leak_start, take_snapshot(game.level_data, f"key {i + 1}"))))
+    elapsed = time.perf_counter() - tic
+
+    print(f"Ran {game.turns} keypresses in {elapsed:0.2f}s ({elapsed / max(game.turns, 1) * 1000:0.2f}ms each), "
+          f"{game.sink.chars_written} chars drawn. Player at {game.player.pos}, health {game.player.health}")
+    if args.memory:
+        print("\n".join(format_report(take_snapshot(game.level_data, f"key {game.turns}"))))
+    game.close()
+
+
+if __name__ == '__main__':
+    logging.disable(logging.DEBUG)
+    main()
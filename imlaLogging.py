@@ -0,0 +1,103 @@
+# Logging is set up once, by main, through setup_logging. Modules just use logging.debug/etc. as normal
+# Records are handed to a queue and written out by a listener thread, so the game loop never waits on the log file
+# Hot-path logging goes through the trace loggers below instead, behind a Trace flag check:
+#   if Trace.ai:
+#       ai_log.debug(f"...")
+# so the f-string isn't even built unless that category is switched on
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+
+LOG_FILE = 'Imladebug.log'
+TRACE_LOGGER_PREFIX = "imla.trace"
+RATE_LIMIT_PER_SECOND = 50  # Per trace category. The rest are dropped (and counted)
+
+ai_log = logging.getLogger(f"{TRACE_LOGGER_PREFIX}.ai")
+pathing_log = logging.getLogger(f"{TRACE_LOGGER_PREFIX}.pathing")
+drawing_log = logging.getLogger(f"{TRACE_LOGGER_PREFIX}.drawing")
+
+
+class Trace:
+    """Static class of on/off flags for the noisy, per-turn log categories. All off by default"""
+    ai: bool = False
+    pathing: bool = False
+    drawing: bool = False
+
+    CATEGORIES = ("ai", "pathing", "drawing")
+
+    @staticmethod
+    def set_all(enabled: bool):
+        for category in Trace.CATEGORIES:
+            setattr(Trace, category, enabled)
+
+    @staticmethod
+    def toggle_all() -> bool:
+        """Turns every category on if any are off, otherwise turns them all off. Returns the new state"""
+        enabled = not all(getattr(Trace, category) for category in Trace.CATEGORIES)
+        Trace.set_all(enabled)
+        logging.info(f"Trace logging {'enabled' if enabled else 'disabled'}")
+        return enabled
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most per_second records a second from each trace logger, and notes how many it dropped"""
+
+    def __init__(self, per_second: int = RATE_LIMIT_PER_SECOND):
+        super().__init__()
+        self.per_second = per_second
+        self._windows: dict[str, list] = {}  # logger name -> [window start, records let through, records dropped]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not record.name.startswith(TRACE_LOGGER_PREFIX):
+            return True
+        now = time.monotonic()
+        window = self._windows.get(record.name)
+        if window is None or now - window[0] >= 1.0:
+            if window is not None and window[2] > 0:
+                # Tack the count from the last window onto the first record of this one
+                record.msg = f"({window[2]} {record.name} records dropped by rate limiting) {record.msg}"
+            window = self._windows[record.name] = [now, 0, 0]
+        if window[1] >= self.per_second:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+
+class LoggingManager:
+
+    _listener = None
+
+    @staticmethod
+    def setup_logging(filename: str = LOG_FILE, level: int = logging.DEBUG,
+                      rate_limit: int = RATE_LIMIT_PER_SECOND) -> logging.handlers.QueueListener:
+        """Points the root logger at a queue, with a listener thread writing it out to filename"""
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(RateLimitFilter(rate_limit))
+
+        file_handler = logging.FileHandler(filename, mode='w')
+        file_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        LoggingManager._listener = logging.handlers.QueueListener(log_queue, file_handler)
+        LoggingManager._listener.start()
+        # Also covers exiting on an exception, so whatever led up to it still makes it into the file
+        atexit.register(LoggingManager.shutdown_logging)
+        return LoggingManager._listener
+
+    @staticmethod
+    def shutdown_logging():
+        """Writes out anything still queued and stops the listener thread"""
+        if LoggingManager._listener is not None:
+            LoggingManager._listener.stop()
+            for handler in LoggingManager._listener.handlers:
+                handler.close()
+            LoggingManager._listener = None
@@ -1,10 +1,21 @@
 import logging
 
+from animation import Animations, burst_animation
+from autoTravel import TravelManager, TravelPlan
+from dungeon import take_stairs
 from globalEnums import Point, TermColor
+from imlaLogging import Trace
+from keymap import Command, KeymapManager, key_name
 from levelData import LevelData
-from screenDrawing import TopMessage, draw_line, draw_cursor, WindowManager, line_as_points
+from memoryReport import MemoryTracker
+from minimap import MinimapView, level_minimap
+from profiler import Profiler
+from projectiles import PROJECTILE_RANGE
+from scentMap import ScentOverlay
+from screenDrawing import TopMessage, draw_line, WindowManager
+from targeting import TargetingCache, line_overlay
 
-logging.basicConfig(filename='Imladebug.log', filemode='w', level=logging.DEBUG)
+TRAVEL_RANGE = 60  # How far from the player the travel cursor can go
 
 
 def move_or_attack(pos: Point, level_data: LevelData):
@@ -19,245 +30,325 @@ def move_or_attack(pos: Point, level_data: LevelData):
 
 
 def handle_input(key, level_data: LevelData, term) -> bool:
-    """Returns a bool indicating if the player's turn is done and time should advance (monster update/etc.)"""
+    """Returns a bool indicating if the player's turn is done and time should advance (monster update/etc.)
+        Runs whatever key is bound to (see keymap). Repeat counts aren't expanded here - use Keymap.feed for that"""
+    command = KeymapManager.get_keymap().lookup(key)
+    if command is None:
+        logging.debug(f"Undefined key {key_name(key)} pressed")
+        return False
+    return execute_command(command, level_data, term)
+
+
+def execute_command(command: Command, level_data: LevelData, term) -> bool:
+    """Runs a single command for the player
+        Returns a bool indicating if the player's turn is done and time should advance (monster update/etc.)"""
     # I feel like we'll need to add some level of flags to this at some point to deal with menus/etc.
-    if key.is_sequence:
-        key = key.name
+    handler = COMMAND_HANDLERS.get(command.name)
+    if handler is None:
+        logging.debug(f"No handler for command {command.name}")
+        return False
+    return handler(command, level_data, term)
+
 
+def _move_command(command: Command, level_data: LevelData, term) -> bool:
+    """Move/attack in the command's direction"""
     player = level_data.player
+    move_or_attack_pos = Point(player.pos.x + command.direction.x, player.pos.y + command.direction.y)
+    move_or_attack(move_or_attack_pos, level_data)
+    return True
 
-    if key == 'KEY_UP' or key == '8':
-        """Move/attack up"""
-        move_or_attack_pos = Point(player.pos.x + 0, player.pos.y - 1)
-        move_or_attack(move_or_attack_pos, level_data)
-        return True
 
-    elif key == 'KEY_DOWN' or key == '2':
-        """Move/attack down"""
-        move_or_attack_pos = Point(player.pos.x + 0, player.pos.y + 1)
-        move_or_attack(move_or_attack_pos, level_data)
-        return True
+def _wait_command(command: Command, level_data: LevelData, term) -> bool:
+    """Player wait"""
+    return True
 
-    elif key == 'KEY_LEFT' or key == '4':
-        """Move/attack left"""
-        move_or_attack_pos = Point(player.pos.x - 1, player.pos.y + 0)
-        move_or_attack(move_or_attack_pos, level_data)
-        return True
 
-    elif key == 'KEY_RIGHT' or key == '6':
-        """Move/attack right"""
-        move_or_attack_pos = Point(player.pos.x + 1, player.pos.y + 0)
-        move_or_attack(move_or_attack_pos, level_data)
-        return True
+def _descend_command(command: Command, level_data: LevelData, term) -> bool:
+    """Going down stairs"""
+    return take_stairs(level_data, 1)
 
-    elif key == '1':
-        """Move/attack down-left"""
-        move_or_attack_pos = Point(player.pos.x - 1, player.pos.y + 1)
-        move_or_attack(move_or_attack_pos, level_data)
-        return True
 
-    elif key == '3':
-        """Move/attack down-right"""
-        move_or_attack_pos = Point(player.pos.x + 1, player.pos.y + 1)
-        move_or_attack(move_or_attack_pos, level_data)
-        return True
+def _ascend_command(command: Command, level_data: LevelData, term) -> bool:
+    """Going up stairs"""
+    return take_stairs(level_data, -1)
 
-    elif key == '7':
-        """Move/attack up-left"""
-        move_or_attack_pos = Point(player.pos.x - 1, player.pos.y - 1)
-        move_or_attack(move_or_attack_pos, level_data)
-        return True
 
-    elif key == '9':
-        """Move/attack up-right"""
-        move_or_attack_pos = Point(player.pos.x + 1, player.pos.y - 1)
-        move_or_attack(move_or_attack_pos, level_data)
-        return True
+def _help_command(command: Command, level_data: LevelData, term) -> bool:
+    """Opens a help menu"""
+    return False
 
-    elif key == '5':
-        """Player wait"""
-        return True
 
-    elif key == '>':
-        """Going down stairs"""
-        return False
+def _targeted_attack_command(command: Command, level_data: LevelData, term) -> bool:
+    """Begins a targeted attack"""
+    return False
 
-    elif key == '<':
-        """Going up stairs"""
-        return False
 
-    elif key == '?':
-        """Opens a help menu"""
+def _ranged_attack_command(command: Command, level_data: LevelData, term) -> bool:
+    """Begins a ranged attack"""
+    target_pos = begin_targeting(term, level_data, PROJECTILE_RANGE, True)
+    if target_pos is None or target_pos == level_data.player.pos:
+        # Canceled out of the targeting (or aimed at their own feet)
         return False
+    else:
+        # Fire at target_pos. The shot stops at whatever's in the way first
+        level_data.player.default_ranged_attack(target_pos, level_data)
+        return True
 
-    elif key == "a" or key == "A":
-        """Begins a targeted attack"""
-        return False
 
-    elif key == "f" or key == "F":
-        """Begins a ranged attack"""
-        target_pos = begin_targeting(term, level_data, 10, True)
-        if target_pos is None:
-            # Canceled out of the targeting
-            return False
-        else:
-            # Attempt to ranged attack the target in target_pos (if any)
-            return True
+def _journal_command(command: Command, level_data: LevelData, term) -> bool:
+    """Opens the journal/log"""
+    return False
 
-    elif key == "j" or key == "J":
-        """Opens the journal/log"""
-        return False
 
-    elif key == " ":
-        """Dunno what this'll be used for yet. Maybe an alternate confirmation for attacks?"""
-        return False
+def _minimap_command(command: Command, level_data: LevelData, term) -> bool:
+    """Shows/hides the minimap in the corner"""
+    MinimapView.toggle_panel()
+    return False
 
-    elif key == "KEY_ENTER":
-        """Confirms dialogues/selects in menus"""
-        return False
 
-    elif key == "KEY_ESCAPE":
-        """Closes/cancels active menu? Maybe opens a main menu if nothing else open?"""
+def _overview_command(command: Command, level_data: LevelData, term) -> bool:
+    """Switches between the normal view and the whole level shrunk down to fit the screen"""
+    if level_minimap(level_data) is None:
+        TopMessage.add_message("There's no overview of this level.")
         return False
+    MinimapView.toggle_overview()
+    return False
 
-    elif key == 'KEY_F1':
-        logging.debug("F1 pressed!")
-        TopMessage.add_message("Top message here! Reporting for duty!")
 
-        # set_message(_term=term,
-          #           message=f"{term.white_on_black}White on black {term.bright_black_on_black} Bright black on black{term.normal}")
+def _explore_command(command: Command, level_data: LevelData, term) -> bool:
+    """Starts walking towards the nearest unexplored area. gameTurn.run_keys keeps it going"""
+    plan = TravelPlan(level_data)
+    if not plan.has_route():
+        TopMessage.add_message("There's nowhere left to explore.")
         return False
+    TravelManager.set_plan(plan)
+    return _continue_travel_command(command, level_data, term)
 
-    elif key == 'KEY_F2':
-        logging.debug("F2 pressed!")
-        TopMessage.add_message("This is a very long test message so long in fact that it will be longer")
-        TopMessage.add_message("than the screen width, which seems very very long indeed. Let's see how this")
-        TopMessage.add_message("turns out for our messaging system!")
 
+def _travel_command(command: Command, level_data: LevelData, term) -> bool:
+    """Picks a spot with the targeting cursor and starts walking there. gameTurn.run_keys keeps it going"""
+    target_pos = begin_targeting(term, level_data, TRAVEL_RANGE, False, "Travel where? Space to confirm, ESC to cancel.")
+    if target_pos is None:
         return False
-
-    elif key == 'KEY_F3':
-        logging.debug("F3 pressed!")
-        """
-        player = level_data.get_player()
-        for e in level_data.entities:
-            if e.etype == EntityType.MONSTER:
-                logging.debug("--Starting dijkstra search--")
-                came_from, cost_so_far = dijkstra_search(level_data, e.x, e.y, player.x, player.y)
-                logging.debug(f"{came_from = }")
-                logging.debug(f"{cost_so_far = }")
-                logging.debug(f"Cost to reach player: {cost_so_far[(player.x, player.y)]}")
-                path = reconstruct_path(came_from, e.x, e.y, player.x, player.y)
-                logging.debug(f"Path from orc to player: {path}")
-
-                logging.debug("--Starting AStar search--")
-                came_from, cost_so_far = a_star_search(level_data, e.x, e.y, player.x, player.y)
-                logging.debug(f"{came_from = }")
-                logging.debug(f"{cost_so_far = }")
-                logging.debug(f"Cost to reach player: {cost_so_far[(player.x, player.y)]}")
-                path = reconstruct_path(came_from, e.x, e.y, player.x, player.y)
-                logging.debug(f"Path from orc to player: {path}")
-        """
+    if target_pos not in level_data.tiles or not level_data.tiles[target_pos].has_been_visible \
+            or level_data.tiles[target_pos].is_blocking_move:
+        TopMessage.add_message("You don't know a way there.")
         return False
 
-    elif key == 'KEY_F4':
-        logging.debug("F4 pressed!")
-        draw_line(level_data=level_data, p1=level_data.player.pos, p2=Point(40, 15), char='x', end_char='X', color=TermColor.RED)
+    plan = TravelPlan(level_data, target_pos)
+    if not plan.has_route():
+        TopMessage.add_message("You don't know a way there.")
         return False
+    TravelManager.set_plan(plan)
+    return _continue_travel_command(command, level_data, term)
 
-    elif key == 'KEY_F5':
-        logging.debug("F5 pressed!")
-        return False
 
-    elif key == 'KEY_F6':
-        logging.debug("F6 pressed!")
+def _continue_travel_command(command: Command, level_data: LevelData, term) -> bool:
+    """Takes the next step of the active explore/travel, ending it once there's nowhere to step"""
+    plan = TravelManager.get_plan()
+    if plan is None or plan.level_data is not level_data:
+        TravelManager.stop()
         return False
 
-    elif key == 'KEY_F7':
-        logging.debug("F7 pressed!")
+    step = plan.next_step()
+    # Walking into something is never what the player meant, so stop rather than attack
+    if step is None or any(monster.pos == step for monster in level_data.monsters):
+        TravelManager.stop()
         return False
 
-    elif key == 'KEY_F8':
-        logging.debug("F8 pressed!")
+    player = level_data.player
+    player.move_to(step, level_data)
+    if player.pos != step:
+        TravelManager.stop()
         return False
+    plan.steps_taken += 1
+    return True
 
-    elif key == 'KEY_F9':
-        logging.debug("F9 pressed!")
-        return False
 
-    else:
-        logging.debug(f"Undefined key {key} pressed")
-        return False
+def _confirm_command(command: Command, level_data: LevelData, term) -> bool:
+    """Confirms dialogues/selects in menus"""
+    return False
 
 
-def begin_targeting(term, level_data: LevelData, max_range: int, should_draw_line: bool) -> Point | None:
-    TopMessage.add_message("Targeting ranged attack. Space to confirm, ESC to cancel.")
+def _cancel_command(command: Command, level_data: LevelData, term) -> bool:
+    """Closes/cancels active menu? Maybe opens a main menu if nothing else open?"""
+    return False
+
+
+def _debug_1_command(command: Command, level_data: LevelData, term) -> bool:
+    logging.debug("F1 pressed!")
+    TopMessage.add_message("Top message here! Reporting for duty!")
+
+    # set_message(_term=term,
+      #           message=f"{term.white_on_black}White on black {term.bright_black_on_black} Bright black on black{term.normal}")
+    return False
+
+
+def _debug_2_command(command: Command, level_data: LevelData, term) -> bool:
+    logging.debug("F2 pressed!")
+    TopMessage.add_message("This is a very long test message so long in fact that it will be longer")
+    TopMessage.add_message("than the screen width, which seems very very long indeed. Let's see how this")
+    TopMessage.add_message("turns out for our messaging system!")
+
+    return False
+
+
+def _debug_3_command(command: Command, level_data: LevelData, term) -> bool:
+    logging.debug("F3 pressed!")
+    """
+    player = level_data.get_player()
+    for e in level_data.entities:
+        if e.etype == EntityType.MONSTER:
+            logging.debug("--Starting dijkstra search--")
+            came_from, cost_so_far = dijkstra_search(level_data, e.x, e.y, player.x, player.y)
+            logging.debug(f"{came_from = }")
+            logging.debug(f"{cost_so_far = }")
+            logging.debug(f"Cost to reach player: {cost_so_far[(player.x, player.y)]}")
+            path = reconstruct_path(came_from, e.x, e.y, player.x, player.y)
+            logging.debug(f"Path from orc to player: {path}")
+
+            logging.debug("--Starting AStar search--")
+            came_from, cost_so_far = a_star_search(level_data, e.x, e.y, player.x, player.y)
+            logging.debug(f"{came_from = }")
+            logging.debug(f"{cost_so_far = }")
+            logging.debug(f"Cost to reach player: {cost_so_far[(player.x, player.y)]}")
+            path = reconstruct_path(came_from, e.x, e.y, player.x, player.y)
+            logging.debug(f"Path from orc to player: {path}")
+    """
+    return False
+
+
+def _debug_4_command(command: Command, level_data: LevelData, term) -> bool:
+    logging.debug("F4 pressed!")
+    draw_line(level_data=level_data, p1=level_data.player.pos, p2=Point(40, 15), char='x', end_char='X', color=TermColor.RED)
+    return False
+
+
+def _debug_5_command(command: Command, level_data: LevelData, term) -> bool:
+    logging.debug("F5 pressed!")
+    # Shows/hides the per-frame timing breakdown
+    Profiler.toggle_overlay()
+    return False
+
+
+def _debug_6_command(command: Command, level_data: LevelData, term) -> bool:
+    logging.debug("F6 pressed!")
+    # Switches the noisy per-turn trace logging (see imlaLogging) on/off
+    enabled = Trace.toggle_all()
+    TopMessage.add_message(f"Trace logging {'on' if enabled else 'off'}.")
+    return False
+
+
+def _debug_7_command(command: Command, level_data: LevelData, term) -> bool:
+    logging.debug("F7 pressed!")
+    # Memory use by category, written to the log. Pressing it again also diffs against the last press
+    lines = MemoryTracker.report(level_data)
+    TopMessage.add_message(f"{lines[0]}. Details in the log.")
+    return False
+
+
+def _debug_8_command(command: Command, level_data: LevelData, term) -> bool:
+    logging.debug("F8 pressed!")
+    # Shows/hides the player's scent trail, colored by strength
+    enabled = ScentOverlay.toggle()
+    TopMessage.add_message(f"Scent overlay {'on' if enabled else 'off'}.")
+    return False
+
+
+def _debug_9_command(command: Command, level_data: LevelData, term) -> bool:
+    logging.debug("F9 pressed!")
+    # Plays a test burst around the player (if animations are on)
+    Animations.add(burst_animation(level_data.player.pos, 5, TermColor.ORANGE))
+    return False
+
+
+# Command.name -> handler(command, level_data, term) -> bool (True if the player's turn is done)
+COMMAND_HANDLERS = {
+    "move": _move_command,
+    "wait": _wait_command,
+    "descend": _descend_command,
+    "ascend": _ascend_command,
+    "help": _help_command,
+    "targeted_attack": _targeted_attack_command,
+    "ranged_attack": _ranged_attack_command,
+    "journal": _journal_command,
+    "minimap": _minimap_command,
+    "overview": _overview_command,
+    "explore": _explore_command,
+    "travel": _travel_command,
+    "continue_travel": _continue_travel_command,
+    "confirm": _confirm_command,
+    "cancel": _cancel_command,
+    "debug_1": _debug_1_command,
+    "debug_2": _debug_2_command,
+    "debug_3": _debug_3_command,
+    "debug_4": _debug_4_command,
+    "debug_5": _debug_5_command,
+    "debug_6": _debug_6_command,
+    "debug_7": _debug_7_command,
+    "debug_8": _debug_8_command,
+    "debug_9": _debug_9_command,
+}
+
+
+def begin_targeting(term, level_data: LevelData, max_range: int, should_draw_line: bool,
+                    prompt: str = "Targeting ranged attack. Space to confirm, ESC to cancel.") -> Point | None:
+    """Lets the player move a cursor around (Tab jumps between visible monsters) and returns where they confirmed,
+        or None if they canceled"""
+    TopMessage.add_message(prompt)
     TopMessage.flush_message()
 
     player_pos = level_data.player.pos
     cursor_pos = level_data.player.pos
+    # Lines only need working out up front if they're going to be drawn, the cursor alone just needs its own
+    targeting_cache = TargetingCache(level_data, player_pos, max_range, precompute_lines=should_draw_line)
+    camera = WindowManager.get_main_camera()
 
     valid_color = TermColor.LIME
     invalid_color = TermColor.RED
 
-    while True:
-        line_points = line_as_points(player_pos, cursor_pos)
-        draw_color = valid_color
-        for i in range(1, len(line_points)):
-            if level_data.tiles[line_points[i]].is_blocking_LOS:
-                draw_color = invalid_color
+    # Draw everything once, then only the cells the line/cursor leaves or lands on
+    camera.draw_camera(level_data)
+    drawn_cells: set[Point] = set()
 
+    while True:
+        draw_color = valid_color if targeting_cache.is_line_clear(cursor_pos) else invalid_color
         if should_draw_line:
-            draw_line(level_data, level_data.player.pos, cursor_pos, '.', 'X', draw_color)
+            overlay = line_overlay(targeting_cache.line_to(cursor_pos), '.', 'X', draw_color)
         else:
-            draw_cursor(level_data, cursor_pos, 'X', draw_color)
+            overlay = line_overlay([cursor_pos], '.', 'X', draw_color)
 
-        # Draw the screen
-        WindowManager.get_main_camera().draw_camera(level_data)
+        camera.draw_cells(level_data, drawn_cells | overlay.keys(), overlay)
+        drawn_cells = set(overlay)
 
         # wait for a key input
-        key = term.inkey()
-        if key.is_sequence:
-            key = key.name
+        command = KeymapManager.get_keymap().lookup(term.inkey())
+        if command is None:
+            continue
 
         # esc exits returning None
-        if key == "KEY_ESCAPE":
-            return None
+        if command.name == "cancel":
+            cursor_pos = None
+            break
 
         # space/enter returns point
-        if key == "KEY_ENTER" or key == " ":
+        if command.name == "confirm":
             break
 
-        # numpad/nums move cursor_pos
-        new_cursor_pos = None
-        if key == 'KEY_UP' or key == '8':
-            """UP"""
-            new_cursor_pos = Point(cursor_pos.x + 0, cursor_pos.y - 1)
-        elif key == 'KEY_DOWN' or key == '2':
-            """DOWN"""
-            new_cursor_pos = Point(cursor_pos.x + 0, cursor_pos.y + 1)
-        elif key == 'KEY_LEFT' or key == '4':
-            """LEFT"""
-            new_cursor_pos = Point(cursor_pos.x - 1, cursor_pos.y + 0)
-        elif key == 'KEY_RIGHT' or key == '6':
-            """RIGHT"""
-            new_cursor_pos = Point(cursor_pos.x + 1, cursor_pos.y + 0)
-        elif key == '1':
-            """down-left"""
-            new_cursor_pos = Point(cursor_pos.x - 1, cursor_pos.y + 1)
-        elif key == '3':
-            """down-right"""
-            new_cursor_pos = Point(cursor_pos.x + 1, cursor_pos.y + 1)
-        elif key == '7':
-            """up-left"""
-            new_cursor_pos = Point(cursor_pos.x - 1, cursor_pos.y - 1)
-        elif key == '9':
-            """up-right"""
-            new_cursor_pos = Point(cursor_pos.x + 1, cursor_pos.y - 1)
-        if new_cursor_pos is not None and abs(new_cursor_pos.x - player_pos.x) <= max_range and abs(new_cursor_pos.y - player_pos.y) <= max_range:
-            cursor_pos = new_cursor_pos
+        # tab jumps to the next-nearest visible monster
+        if command.name == "next_target":
+            next_target = targeting_cache.next_target()
+            if next_target is not None:
+                cursor_pos = next_target
 
-    # Need to check if this is actually valid still
-    return cursor_pos
+        # movement keys move cursor_pos
+        if command.name == "move":
+            new_cursor_pos = Point(cursor_pos.x + command.direction.x, cursor_pos.y + command.direction.y)
+            if targeting_cache.is_in_range(new_cursor_pos):
+                cursor_pos = new_cursor_pos
 
+    # Clear the line/cursor back off the screen
+    camera.draw_cells(level_data, drawn_cells)
 
+    # Need to check if this is actually valid still
+    return cursor_pos
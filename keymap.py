@@ -0,0 +1,193 @@
+import configparser
+import logging
+from dataclasses import dataclass
+
+from globalEnums import Point
+
+
+@dataclass(frozen=True)
+class Command:
+    """Something a key can be bound to. name picks what handles it, and movement commands carry their direction"""
+    name: str
+    direction: Point | None = None
+
+
+# Every command a key can be bound to, by the id used in bindings
+COMMANDS: dict[str, Command] = {
+    "move_up": Command("move", Point(0, -1)),
+    "move_down": Command("move", Point(0, 1)),
+    "move_left": Command("move", Point(-1, 0)),
+    "move_right": Command("move", Point(1, 0)),
+    "move_up_left": Command("move", Point(-1, -1)),
+    "move_up_right": Command("move", Point(1, -1)),
+    "move_down_left": Command("move", Point(-1, 1)),
+    "move_down_right": Command("move", Point(1, 1)),
+    "wait": Command("wait"),
+    "descend": Command("descend"),
+    "ascend": Command("ascend"),
+    "help": Command("help"),
+    "targeted_attack": Command("targeted_attack"),
+    "ranged_attack": Command("ranged_attack"),
+    "journal": Command("journal"),
+    "minimap": Command("minimap"),
+    "overview": Command("overview"),
+    "explore": Command("explore"),
+    "travel": Command("travel"),
+    "confirm": Command("confirm"),
+    "cancel": Command("cancel"),
+    "next_target": Command("next_target"),
+    "count": Command("count"),
+    "quit": Command("quit"),
+    "debug_1": Command("debug_1"),
+    "debug_2": Command("debug_2"),
+    "debug_3": Command("debug_3"),
+    "debug_4": Command("debug_4"),
+    "debug_5": Command("debug_5"),
+    "debug_6": Command("debug_6"),
+    "debug_7": Command("debug_7"),
+    "debug_8": Command("debug_8"),
+    "debug_9": Command("debug_9"),
+}
+
+# command id -> keys. Keys are blessed key names (KEY_UP, KEY_F1, ...) or the character itself. SPACE is " "
+DEFAULT_BINDINGS: dict[str, list[str]] = {
+    "move_up": ["KEY_UP", "8"],
+    "move_down": ["KEY_DOWN", "2"],
+    "move_left": ["KEY_LEFT", "4"],
+    "move_right": ["KEY_RIGHT", "6"],
+    "move_up_left": ["7"],
+    "move_up_right": ["9"],
+    "move_down_left": ["1"],
+    "move_down_right": ["3"],
+    "wait": ["5", "."],
+    "descend": [">"],
+    "ascend": ["<"],
+    "help": ["?"],
+    "targeted_attack": ["a", "A"],
+    "ranged_attack": ["f", "F"],
+    "journal": ["j", "J"],
+    "minimap": ["m"],
+    "overview": ["M"],
+    "explore": ["o"],
+    "travel": ["t"],
+    "confirm": ["KEY_ENTER", "SPACE"],
+    "cancel": ["KEY_ESCAPE"],
+    "next_target": ["KEY_TAB"],
+    "count": ["n"],
+    "quit": ["Q"],
+    "debug_1": ["KEY_F1"],
+    "debug_2": ["KEY_F2"],
+    "debug_3": ["KEY_F3"],
+    "debug_4": ["KEY_F4"],
+    "debug_5": ["KEY_F5"],
+    "debug_6": ["KEY_F6"],
+    "debug_7": ["KEY_F7"],
+    "debug_8": ["KEY_F8"],
+    "debug_9": ["KEY_F9"],
+}
+
+_KEY_ALIASES = {"SPACE": " "}
+MAX_REPEAT_COUNT = 1000
+
+
+def key_name(key) -> str:
+    """Returns the name a key is bound by - the blessed name for sequences (arrows/F-keys/etc.), else the character"""
+    if getattr(key, "is_sequence", False):
+        return key.name
+    return str(key)
+
+
+class Keymap:
+    """Turns keypresses into Commands with a dict lookup, including repeat counts
+        A count is typed as the count key, then digits, then the command, e.g. "n10." waits 10 turns.
+        Since the digits are also movement keys, pressing the count key again ends the count,
+        so "n10n5" also waits 10 turns"""
+
+    def __init__(self, bindings: dict[str, list[str]]):
+        self.bindings = bindings
+        self.keys: dict[str, Command] = {}
+        for command_id, keys in bindings.items():
+            command = COMMANDS[command_id]
+            for key in keys:
+                self.keys[_KEY_ALIASES.get(key, key)] = command
+        self._count: str | None = None  # Digits typed so far, or None if no count is being typed
+        self._count_closed = False
+
+    def lookup(self, key) -> Command | None:
+        """Returns the Command bound to key (a blessed Keystroke or key name), or None if it's unbound"""
+        return self.keys.get(key_name(key))
+
+    def feed(self, key) -> list[Command]:
+        """Takes the next keypress and returns the Commands it completes - usually one, several for a repeat count,
+            and none while a count is still being typed or for unbound keys"""
+        name = key_name(key)
+        command = self.keys.get(name)
+
+        if self._count is None:
+            if command is not None and command.name == "count":
+                self._count = ""
+                self._count_closed = False
+                return []
+            if command is None:
+                logging.debug(f"Undefined key {name} pressed")
+                return []
+            return [command]
+
+        # We're partway through typing a count
+        if not self._count_closed and name.isdigit() and len(name) == 1:
+            self._count += name
+            return []
+        if command is not None and command.name == "count":
+            self._count_closed = True
+            return []
+
+        count = min(int(self._count or "1"), MAX_REPEAT_COUNT)
+        self._count = None
+        if command is None or command.name == "cancel":
+            return []
+        return [command] * count
+
+    def reset(self):
+        """Drops any count that's partway through being typed"""
+        self._count = None
+        self._count_closed = False
+
+    @property
+    def pending_count(self) -> str | None:
+        """The digits of a count that's still being typed, or None"""
+        return self._count
+
+
+def load_keymap(path: str | None) -> Keymap:
+    """Loads a Keymap from an ini file, falling back to DEFAULT_BINDINGS for any command it doesn't mention
+        The file has a [bindings] section of command_id = space-separated keys, e.g.
+            [bindings]
+            move_up = KEY_UP 8 k
+            wait = 5 . s"""
+    bindings = {command_id: list(keys) for command_id, keys in DEFAULT_BINDINGS.items()}
+    if path is not None:
+        config = configparser.ConfigParser(interpolation=None, comment_prefixes=("#",), inline_comment_prefixes=None)
+        config.optionxform = str  # Key names are case-sensitive ("a" and "A" can be different commands)
+        if config.read(path):
+            for command_id, keys in config["bindings"].items() if config.has_section("bindings") else []:
+                if command_id not in COMMANDS:
+                    logging.debug(f"Ignoring binding for unknown command {command_id} in {path}")
+                    continue
+                bindings[command_id] = keys.split()
+            logging.debug(f"Loaded key bindings from {path}")
+    return Keymap(bindings)
+
+
+class KeymapManager:
+
+    _keymap = None
+
+    @staticmethod
+    def set_keymap(keymap: Keymap):
+        KeymapManager._keymap = keymap
+
+    @staticmethod
+    def get_keymap() -> Keymap:
+        if KeymapManager._keymap is None:
+            KeymapManager._keymap = Keymap(DEFAULT_BINDINGS)
+        return KeymapManager._keymap
@@ -6,17 +6,17 @@ import random
 import logging
 from typing import List, Protocol
 
-from skimage.draw import line as draw_line
+from lineDrawing import line as draw_line
 
 from globalEnums import TermColor, Entity, Point, Updatable
+from imlaLogging import Trace, pathing_log
+from profiler import profiled, SPAN_PATHFINDING
 
-logging.basicConfig(filename='Imladebug.log', filemode='w', level=logging.DEBUG)
 
 
 
 
-
-@dataclass()
+@dataclass(slots=True)
 class Tile:
     world_x: int
     world_y: int
@@ -34,7 +34,8 @@ class Tile:
 class LevelData:
     def __init__(self, tile_data: dict[Point, Tile], height: int, width: int, player_start_pos: Point,
                  monsters: List[Entity | Updatable], floor_items: List[Entity], floor_effects: List[Entity | Updatable],
-                 interactables: List[Entity], vfx: List[Entity]):
+                 interactables: List[Entity], vfx: List[Entity],
+                 stairs_up_pos: Point | None = None, stairs_down_pos: Point | None = None):
         self.tiles = tile_data
         self.width = width
         self.height = height
@@ -44,12 +45,50 @@ class LevelData:
         self.floor_effects = floor_effects
         self.interactables = interactables
         self.vfx = vfx
+        self.stairs_up_pos = stairs_up_pos
+        self.stairs_down_pos = stairs_down_pos
         self.player = None
+        self.turns = 0  # Turns played on this floor, which is what monsters time their memories by
+        self.packs: dict[str, PackBlackboard] = {}
+        self.scent = None  # A scentMap.ScentMap, made the first time the player leaves any
+        self.minimap = None  # A minimap.Minimap, made the first time one is shown
+        self.projectiles = []  # projectiles.Projectile fired by monsters this turn, resolved together once they're done
+        # Where every monster (and the player) is standing, worked out once a turn and kept up as monsters move
+        self.occupied: set[Point] = set()
+        self.occupied_turn = -1
+
+    def pack(self, faction: str) -> "PackBlackboard":
+        """Returns the blackboard faction's monsters on this floor share, starting a blank one if needed"""
+        blackboard = self.packs.get(faction)
+        if blackboard is None:
+            blackboard = self.packs[faction] = PackBlackboard(faction)
+        return blackboard
+
+    def occupied_tiles(self) -> set[Point]:
+        """The tiles monsters can't step onto this turn, whichever pack (if any) they're in"""
+        if self.occupied_turn != self.turns:
+            self.occupied = {m.pos for m in self.monsters}
+            self.occupied.add(self.player.pos)
+            self.occupied_turn = self.turns
+        return self.occupied
+
+    def move_occupant(self, old_pos: Point, new_pos: Point):
+        """Keeps occupied_tiles up to date when a monster steps from old_pos to new_pos"""
+        self.occupied.discard(old_pos)
+        self.occupied.add(new_pos)
+
+    def close(self):
+        """Frees anything the floor keeps outside of memory, once it's being dropped. Nothing, for a fixed floor"""
 
     def is_point_in_range(self, point: Point) -> bool:
         """Returns true if point is greater than 0,0 but within bounds of width/height"""
         return 0 <= point.x < self.width and 0 <= point.y < self.height
 
+    def fov_row_limit(self, sight_range: int) -> int:
+        """Returns how many rows out from the viewer shadow casting should scan (exclusive)
+            The whole map is scanned, so is_in_LOS stays accurate for monsters that can see further than the player"""
+        return max(self.width, self.height) - 1
+
     def get_neighbors(self, p: Point) -> list[Point] | None:
         """Returns a list of tuples of neighbors to tile (px,py) that are valid tiles and
             that are not is_blocking_move
@@ -57,7 +96,8 @@ class LevelData:
             Maybe add a bool to add that feature?"""
         # logging.debug(f"getting neighbors for {p = }")
         if not self.is_point_in_range(p) or p not in self.tiles:
-            logging.debug(f"{self.is_point_in_range(p)}, {p in self.tiles}")
+            if Trace.pathing:
+                pathing_log.debug(f"get_neighbors of {p}: {self.is_point_in_range(p)}, {p in self.tiles}")
             return None
 
         neighbors = [Point(p.x - 1, p.y + 1), Point(p.x + 1, p.y + 1), Point(p.x + 1, p.y - 1), Point(p.x - 1, p.y - 1),
@@ -87,6 +127,55 @@ class LevelData:
             self.tiles[point].has_been_visible = new_vis
 
 
+PACK_MEMORY_TURNS = 40  # How long a pack keeps hunting for the player after the last of them lost sight of them
+PACK_FIELD_MAX_COST = 40  # The furthest out from the player's last known position a pack's path field goes
+PACK_CROWD_COST = 4  # Extra path cost of going through a tile another monster stands on. A detour shorter than this
+                     # beats waiting behind a packmate
+
+
+@dataclass
+class PackBlackboard:
+    """What one faction's monsters on a floor know about the player, so it's worked out once instead of per monster
+        Whichever member sees the player notes where and when. Everyone else reads that, and steps down a path field
+        (a dijkstra_map) towards it. The field is worked out once per pack per turn, and only reaches as far as the
+        pack's members, since a pack is usually close together
+        Tiles packmates stand on cost extra to path through, so members go around each other instead of queueing -
+        which spreads the pack out to surround (or flank) the player. Anyone else standing in the way blocks the path"""
+    faction: str
+    last_seen_pos: Point | None = None
+    last_seen_turn: int = -1
+    path_field: dict[Point, float] = field(default_factory=dict)
+    path_field_turn: int = -1
+
+    def report_sighting(self, pos: Point, turn: int):
+        self.last_seen_pos = pos
+        self.last_seen_turn = turn
+
+    def remembers_player(self, turn: int) -> bool:
+        return self.last_seen_pos is not None and turn - self.last_seen_turn <= PACK_MEMORY_TURNS
+
+    def next_step(self, level_data: LevelData, pos: Point) -> Point | None:
+        """Returns where a member at pos should step to close in on the player, or None to stay put"""
+        occupied = level_data.occupied_tiles()
+        if self.path_field_turn != level_data.turns:
+            members = {m.pos for m in level_data.monsters if m.faction == self.faction}
+            others = occupied - members - {level_data.player.pos, self.last_seen_pos}
+            self.path_field = dijkstra_map(level_data, [self.last_seen_pos], max_cost=PACK_FIELD_MAX_COST,
+                                           until_reached=members, extra_costs=dict.fromkeys(members, PACK_CROWD_COST),
+                                           blocked=others)
+            self.path_field_turn = level_data.turns
+
+        here = self.path_field.get(pos)
+        if here is None:
+            return None
+        best_pos, best_cost = None, here
+        for next_pos in level_data.get_neighbors(pos):
+            cost = self.path_field.get(next_pos)
+            if cost is not None and cost < best_cost and next_pos not in occupied:
+                best_pos, best_cost = next_pos, cost
+        return best_pos
+
+
 """
 def breadth_first_search(level_data: LevelData, start_x: int, start_y: int, goal_x: int, goal_y: int):
     frontier = deque()
@@ -110,6 +199,7 @@ def breadth_first_search(level_data: LevelData, start_x: int, start_y: int, goal
 """
 
 
+@profiled(SPAN_PATHFINDING)
 def dijkstra_search(level_data: LevelData, start_pos: Point, goal_pos: Point):
     frontier: List[(float, Point)] = []
     heapq.heappush(frontier, (0, start_pos))
@@ -124,7 +214,7 @@ def dijkstra_search(level_data: LevelData, start_pos: Point, goal_pos: Point):
         if current == goal_pos:
             break
 
-        for next_pos in level_data.get_neighbors(*current):
+        for next_pos in level_data.get_neighbors(current):
             new_cost = cost_so_far[current] + level_data.get_weight(current, next_pos)
             if next_pos not in cost_so_far or new_cost < cost_so_far[next_pos]:
                 cost_so_far[next_pos] = new_cost
@@ -135,10 +225,71 @@ def dijkstra_search(level_data: LevelData, start_pos: Point, goal_pos: Point):
     return came_from, cost_so_far
 
 
+@profiled(SPAN_PATHFINDING)
+def dijkstra_map(level_data: LevelData, goals: list[Point], max_cost: float | None = None,
+                 until_reached: set[Point] | None = None, extra_costs: dict[Point, float] | None = None,
+                 blocked: set[Point] | None = None, known_only: bool = False) -> dict[Point, float]:
+    """Returns the cost of getting from every reachable point to whichever of goals is closest
+        One search covers every goal, and following the costs downhill (see dijkstra_map_step) leads to the nearest one
+        from anywhere, so a map can be reused for as many steps as it stays accurate
+        max_cost stops the search early, which is needed on levels too big to search all of
+        until_reached also stops it early, once every point in it has its final cost. Downhill from those points is
+        still exact, but the search's outer edge is left with costs that may be too high
+        extra_costs adds to the cost of moving through a point, e.g. to make paths go around other monsters
+        blocked points get a cost but aren't searched past, so no path goes through them
+        known_only leaves out every tile the player hasn't seen (bar the one they're standing on, which FOV never
+        marks), so paths only go where the player knows about"""
+    frontier: list[(float, Point)] = [(0, goal) for goal in goals]
+    heapq.heapify(frontier)
+    cost_so_far: dict[Point, float] = {goal: 0 for goal in goals}
+    unreached = set(until_reached) if until_reached is not None else None
+
+    while not len(frontier) == 0:
+        cost, current = heapq.heappop(frontier)
+        if cost > cost_so_far[current]:
+            # Already reached more cheaply since this was pushed
+            continue
+        if max_cost is not None and cost > max_cost:
+            break
+        if unreached is not None:
+            unreached.discard(current)
+            if not unreached:
+                break
+        if blocked is not None and current in blocked:
+            continue
+
+        for next_pos in level_data.get_neighbors(current):
+            if known_only and not level_data.tiles[next_pos].has_been_visible and next_pos != level_data.player.pos:
+                continue
+            # The search runs outwards from the goals, so the move being costed is next_pos -> current
+            new_cost = cost + level_data.get_weight(next_pos, current)
+            if extra_costs is not None:
+                new_cost += extra_costs.get(current, 0)
+            if next_pos not in cost_so_far or new_cost < cost_so_far[next_pos]:
+                cost_so_far[next_pos] = new_cost
+                heapq.heappush(frontier, (new_cost, next_pos))
+
+    return cost_so_far
+
+
+def dijkstra_map_step(level_data: LevelData, costs: dict[Point, float], pos: Point) -> Point | None:
+    """Returns the neighbor of pos that's furthest downhill on a dijkstra_map, or None if pos is already at the bottom
+        (or isn't on the map at all)"""
+    if pos not in costs:
+        return None
+    best_pos, best_cost = None, costs[pos]
+    for next_pos in level_data.get_neighbors(pos):
+        next_cost = costs.get(next_pos)
+        if next_cost is not None and next_cost < best_cost:
+            best_pos, best_cost = next_pos, next_cost
+    return best_pos
+
+
 def a_star_heuristic(p1: Point, p2: Point):
     return abs(p1.x - p2.x) + abs(p1.y - p2.y)
 
 
+@profiled(SPAN_PATHFINDING)
 def a_star_search(level_data: LevelData, start_pos: Point, goal_pos: Point) -> \
         tuple[dict[Point, Point | None], dict[Point, float]]:
     # TODO: perhaps add a return flag here if a valid path was not found
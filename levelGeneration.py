@@ -1,15 +1,43 @@
+import gc
 import logging
 from dataclasses import dataclass
 import random
+import time
 
-from entity import Monster, FloorItem, melee_monster_update
+import numpy as np
+
+from entity import Monster, FloorItem, melee_monster_update, ranged_monster_update
 from globalEnums import TermColor, DamageType, ItemType, Point
 from levelData import LevelData, Tile
 
-logging.basicConfig(filename='Imladebug.log', filemode='w', level=logging.DEBUG)
-
 # https://pypi.org/project/perlin-noise/
 
+# The kwargs main() generates its floors with
+DEFAULT_LVLARGS = {"generation_type": 1, "height": 40, "width": 140,
+                   "num_rooms": 20, "room_size": 9, "room_size_mod": 3}
+BLUEPRINT_GENERATION_TYPES = (1, 3)  # The generation types generate_level_blueprint can make a blueprint for
+CAVE_ATTEMPTS = 10  # Caves tried before giving up on fitting the stairs and a monster, on maps too small for them
+
+# Generation works on grids of template indices (uint8, indexed [x, y]) that are turned into Tiles at the very end
+TEMPLATE_WALL = 0
+TEMPLATE_FLOOR = 1
+TEMPLATE_STAIRS_DOWN = 2
+TEMPLATE_STAIRS_UP = 3
+TILE_TEMPLATES: list[Tile] = [
+    Tile(world_x=0, world_y=0, floor_char="#", is_blocking_move=True, is_blocking_LOS=True,
+         is_visible=False, visible_color=TermColor.LIGHT_GREY, fow_color=TermColor.MID_GREY,
+         has_been_visible=False, movement_weight=1, is_in_LOS=False),
+    Tile(world_x=0, world_y=0, floor_char=".", is_blocking_move=False, is_blocking_LOS=False,
+         is_visible=False, visible_color=TermColor.MID_GREY, fow_color=TermColor.DARK_GREY,
+         has_been_visible=False, movement_weight=1, is_in_LOS=False),
+    Tile(world_x=0, world_y=0, floor_char=">", is_blocking_move=False, is_blocking_LOS=False,
+         is_visible=False, visible_color=TermColor.WHITE, fow_color=TermColor.LIGHT_GREY,
+         has_been_visible=False, movement_weight=1, is_in_LOS=False),
+    Tile(world_x=0, world_y=0, floor_char="<", is_blocking_move=False, is_blocking_LOS=False,
+         is_visible=False, visible_color=TermColor.WHITE, fow_color=TermColor.LIGHT_GREY,
+         has_been_visible=False, movement_weight=1, is_in_LOS=False),
+]
+
 
 @dataclass(frozen=True)
 class Room:
@@ -33,10 +61,11 @@ class Room:
                         return True
         return False
 
-    def get_random_point(self) -> Point:
-        """Returns a random point within this room"""
-        x = random.randint(self.p1.x + 1, self.p2.x - 1)
-        y = random.randint(self.p1.y + 1, self.p2.y - 1)
+    def get_random_point(self, rng: random.Random | None = None) -> Point:
+        """Returns a random point within this room, drawn from rng (or the global random module)"""
+        rng = rng or random
+        x = rng.randint(self.p1.x + 1, self.p2.x - 1)
+        y = rng.randint(self.p1.y + 1, self.p2.y - 1)
         return Point(x, y)
 
 
@@ -45,26 +74,88 @@ def is_point_in_rect(p: Point, room: Room) -> bool:
     return room.p1.x <= p.x <= room.p2.x and room.p1.y <= p.y <= room.p2.y
 
 
-def generate_blank_tile_data(width: int, height: int, template_tile: Tile) -> dict[Point, Tile]:
-    """Generates a dict of Tiles copying the non-location data of the template_tile"""
+def generate_blank_grid(width: int, height: int, template_index: int) -> np.ndarray:
+    """Generates a grid of template indices (indexed [x, y]) with every cell set to template_index"""
+    return np.full((width, height), template_index, dtype=np.uint8)
+
+
+def tile_data_from_grid(grid: np.ndarray, templates: list[Tile], origin: Point = Point(0, 0)) -> dict[Point, Tile]:
+    """Converts a grid of template indices into the dict of Tiles used by LevelData
+        This is the only place generation builds Tile objects, so it happens once per level
+        origin is the world position of grid[0, 0], for grids that are only part of a level"""
     tile_data: dict[Point, Tile] = {}
-    for i in range(0, width):
-        for j in range(0, height):
-            p = Point(i, j)
-            t = Tile(world_x=i, world_y=j, floor_char=template_tile.floor_char,
-                     is_blocking_move=template_tile.is_blocking_move, is_blocking_LOS=template_tile.is_blocking_LOS,
-                     is_visible=template_tile.is_visible, visible_color=template_tile.visible_color,
-                     fow_color=template_tile.fow_color, has_been_visible=template_tile.has_been_visible,
-                     movement_weight=template_tile.movement_weight, is_in_LOS=template_tile.is_in_LOS)
-            tile_data[p] = t
+    # Unpack the templates once so the inner loop is just a positional constructor call
+    fields = [(t.floor_char, t.is_blocking_move, t.is_blocking_LOS, t.is_visible, t.is_in_LOS, t.visible_color,
+               t.fow_color, t.has_been_visible, t.movement_weight) for t in templates]
+    new_point = tuple.__new__  # Skips the (surprisingly slow) namedtuple __new__ wrapper
+
+    # Millions of fresh (acyclic) objects keep triggering the cycle collector, which more than doubles the time
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for x, column in enumerate(grid.tolist(), start=origin.x):
+            for y, template_index in enumerate(column, start=origin.y):
+                tile_data[new_point(Point, (x, y))] = Tile(x, y, *fields[template_index])
+    finally:
+        if gc_was_enabled:
+            gc.enable()
 
     return tile_data
 
 
+@dataclass()
+class LevelBlueprint:
+    """Everything generation decides about a level, before any Tiles are built
+        grid holds indices into TILE_TEMPLATES, indexed [x, y]"""
+    grid: np.ndarray
+    player_start_pos: Point
+    stairs_up_pos: Point
+    stairs_down_pos: Point
+    monsters: list[Monster]
+    rooms: list[Room]
+
+    def to_level_data(self) -> LevelData:
+        """Converts the blueprint into a playable LevelData"""
+        width, height = self.grid.shape
+        return LevelData(tile_data=tile_data_from_grid(self.grid, TILE_TEMPLATES), width=width, height=height,
+                         player_start_pos=self.player_start_pos,
+                         monsters=self.monsters, floor_items=[], floor_effects=[], interactables=[], vfx=[],
+                         stairs_up_pos=self.stairs_up_pos, stairs_down_pos=self.stairs_down_pos)
+
+
 def generate_level(**kwargs) -> LevelData:
-    """Generates/returns level data based on given kwargs"""
+    """Generates/returns level data based on given kwargs
+        An optional "seed" kwarg makes generation deterministic - the same kwargs and seed give the same level"""
+    tic = time.perf_counter()
+    if kwargs["generation_type"] == 2:
+        # args: generation_type, seed, (optional) chunk_size, max_hot_chunks, spill_dir
+        # An endless overworld, generated a chunk at a time as the player gets near it
+        logging.debug("level gen type 2 - chunked overworld")
+        from chunkedLevel import ChunkedLevelData  # Imported here, since chunkedLevel builds on this module
+
+        seed = kwargs.get("seed")
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        chunk_kwargs = {k: kwargs[k] for k in ("chunk_size", "max_hot_chunks", "spill_dir") if k in kwargs}
+        return ChunkedLevelData(seed=seed, **chunk_kwargs)
+
+    # Every other generation type works out a blueprint, which is then converted into Tiles in one step
+    blueprint = generate_level_blueprint(**kwargs)
+    if blueprint is None:
+        return None
+    level_data = blueprint.to_level_data()
+    toc = time.perf_counter()
+    logging.debug(f"Level generation (type {kwargs['generation_type']}, {level_data.width}x{level_data.height}) "
+                  f"completed after {toc - tic:0.4f} seconds")
+    return level_data
+
+
+def generate_level_blueprint(**kwargs) -> LevelBlueprint | None:
+    """Generates the blueprint for a (fixed size) level based on given kwargs. See generate_level"""
 
     logging.debug(f"Beginning level generation with kwargs: {kwargs}")
+    # Generation draws from its own Random so a seeded level doesn't depend on anything else touching random
+    rng = random.Random(kwargs.get("seed"))
     if kwargs["generation_type"] == 0:
         """
         # args: generation_type, height, width
@@ -86,7 +177,7 @@ def generate_level(**kwargs) -> LevelData:
         return level_data
         """
     elif kwargs["generation_type"] == 1:
-        # args: generation_type, height, width, room_density, room_size, room_size_mod
+        # args: generation_type, height, width, room_density, room_size, room_size_mod, (optional) seed
         logging.debug("level gen type 1 - rewritten")
         map_height = kwargs["height"]
         map_width = kwargs["width"]
@@ -98,6 +189,10 @@ def generate_level(**kwargs) -> LevelData:
         rooms_attempted = 0  # For now we're just going to naively attempt to make 2 x the num rooms
         logging.debug(f"Numrooms: {num_rooms}")
 
+        # We'll start by filling the world with walls, and then carve out the rooms/hallways
+        # Rooms are carved straight into the grid as they're accepted, so the grid doubles as the intersection check
+        grid = generate_blank_grid(width=map_width, height=map_height, template_index=TEMPLATE_WALL)
+
         while rooms_attempted <= num_rooms * 2:
             # logging.debug(f"Rooms attempted: {rooms_attempted} out of {num_rooms * 2}")
             # logging.debug(f"Rooms done: {len(rooms)}")
@@ -105,132 +200,182 @@ def generate_level(**kwargs) -> LevelData:
                 # If we've reached enough rooms, then stop generating
                 break
 
-            gen_room = generate_room(map_height, map_width, room_size, room_size_mod)
+            gen_room = generate_room(map_height, map_width, room_size, room_size_mod, rng)
             rooms_attempted += 1
 
             # Now we check to see if this will intersect with any existing rooms
-            if gen_room.is_room_intersecting_other(other_rooms=rooms, buffer=1):
+            if is_room_intersecting_grid(gen_room, grid, buffer=1):
                 # Room is invalid, discard
                 continue
             else:
                 rooms.append(gen_room)
-
-        # Now that we have a list of rooms, actually generate the level data
-        # We'll start by filling the world with walls, and then carve out the rooms/hallways
-        # Todo: maybe store these tile templates somewhere?
-        template_wall_tile = Tile(world_x=0, world_y=0, floor_char="#", is_blocking_move=True, is_blocking_LOS=True,
-                                  is_visible=False, visible_color=TermColor.LIGHT_GREY, fow_color=TermColor.MID_GREY,
-                                  has_been_visible=False, movement_weight=1, is_in_LOS=False)
-
-        tile_data = generate_blank_tile_data(width=map_width, height=map_height, template_tile=template_wall_tile)
-
-        # Next we'll carve out the rooms
-        template_floor_tile = Tile(world_x=0, world_y=0, floor_char=".", is_blocking_move=False, is_blocking_LOS=False,
-                                   is_visible=False, visible_color=TermColor.MID_GREY, fow_color=TermColor.DARK_GREY,
-                                   has_been_visible=False, movement_weight=1, is_in_LOS=False)
-
-        for room in rooms:
-            fill_room_with_template(room, template_floor_tile, tile_data)
+                fill_room_with_template(gen_room, TEMPLATE_FLOOR, grid)
 
         # Next we'll carve out hallways
         for i in range(len(rooms) - 1):
             # We'll do this by picking a point in the current room, and a point in the next room
             # And connecting them with a single-bend hallway
-            starting_point = rooms[i].get_random_point()
-            ending_point = rooms[i+1].get_random_point()
+            starting_point = rooms[i].get_random_point(rng)
+            ending_point = rooms[i+1].get_random_point(rng)
 
-            fill_hallway(starting_point, ending_point, template_floor_tile, tile_data)
+            fill_hallway(starting_point, ending_point, TEMPLATE_FLOOR, grid)
 
         # Choose a valid staring spot for the player
         # We'll do this by picking a random room, and then picking a spot in that room
-        player_room_num = random.randint(0, len(rooms) - 1)
-        player_start_point = rooms[player_room_num].get_random_point()
+        player_room_num = rng.randint(0, len(rooms) - 1)
+        player_start_point = rooms[player_room_num].get_random_point(rng)
 
         # Populate the rooms with stuff!
         monsters = []
-        floor_items = []
-        floor_effects = []
-        interactables = []
-        vfx = []
 
         # For now, let's put a single orc in a room
-        monster_room = random.randint(0, len(rooms) - 1)
-        monster_start_point = rooms[monster_room].get_random_point()
-
-        # Todo: figure out how to structure these into some separate file
-        #  or, for bonus points, load stat-lines in from XML
-        monster_armor = {DamageType.PHYSICAL: 0, DamageType.FIRE: 0, DamageType.LIGHTNING: 0, DamageType.COLD: 0,
-                         DamageType.CORROSIVE: 0}
-        monster_drop = FloorItem(name="gold", pos=(None, None), display_char="$", display_color=TermColor.GOLD,
-                                 is_visible=True, blocks_LOS=False, item_type=ItemType.GOLD, item_amount=10)
-        monster = Monster(name="Orc", pos=monster_start_point,
-                          display_char="o", display_color=TermColor.GREEN,
-                          health_max=5.0, health=5.0, armor=monster_armor, attack_power=2, sight_range=8,
-                          monster_update=melee_monster_update, on_death_drop=monster_drop)
-        monsters.append(monster)
-
-        level_data = LevelData(tile_data=tile_data, width=map_width, height=map_height,
-                               player_start_pos=player_start_point,
-                               monsters=monsters, floor_items=floor_items, floor_effects=floor_effects,
-                               interactables=interactables, vfx=vfx)
-
-        return level_data
+        monster_room = rng.randint(0, len(rooms) - 1)
+        monster_start_point = rooms[monster_room].get_random_point(rng)
+
+        monsters.append(generate_orc(monster_start_point))
+
+        # The player arrives on the up stairs, and the down stairs go in a different room (if there is one)
+        stairs_down_room = rng.randint(0, len(rooms) - 1)
+        if len(rooms) > 1:
+            while stairs_down_room == player_room_num:
+                stairs_down_room = rng.randint(0, len(rooms) - 1)
+        stairs_down_point = rooms[stairs_down_room].get_random_point(rng)
+        while stairs_down_point == player_start_point:
+            stairs_down_point = rooms[stairs_down_room].get_random_point(rng)
+        grid[player_start_point] = TEMPLATE_STAIRS_UP
+        grid[stairs_down_point] = TEMPLATE_STAIRS_DOWN
+
+        return LevelBlueprint(grid=grid, player_start_pos=player_start_point, stairs_up_pos=player_start_point,
+                              stairs_down_pos=stairs_down_point, monsters=monsters, rooms=rooms)
+    elif kwargs["generation_type"] == 3:
+        # args: generation_type, height, width, (optional) fill_probability, smoothing_steps, seed
+        logging.debug("level gen type 3 - cellular automata caves")
+        map_height = kwargs["height"]
+        map_width = kwargs["width"]
+        # The python-side rng seeds the numpy one, so a seeded cave is just as repeatable
+        np_rng = np.random.default_rng(rng.randrange(2 ** 63))
+
+        # Needs 3 floor cells inside the solid border. A tiny map can smooth down to less, so try again if it does
+        for _ in range(CAVE_ATTEMPTS):
+            is_wall = generate_cave_walls(map_width, map_height, kwargs.get("fill_probability", 0.45),
+                                          kwargs.get("smoothing_steps", 5), np_rng)
+            floor_points = np.argwhere(~is_wall)  # [[x, y], ...] of every floor cell, all of which are connected
+            if len(floor_points) >= 3:
+                break
+        else:
+            raise ValueError(f"A {map_width}x{map_height} map is too small for a cave with room for the stairs and "
+                             f"a monster (3 floor cells) - make it bigger")
+
+        grid = np.where(is_wall, TEMPLATE_WALL, TEMPLATE_FLOOR).astype(np.uint8)
+        # Player (on the up stairs), down stairs and the orc all go on distinct floor cells
+        player_start_point, stairs_down_point, monster_start_point = \
+            (Point(int(x), int(y)) for x, y in floor_points[np_rng.choice(len(floor_points), 3, replace=False)])
+        grid[player_start_point] = TEMPLATE_STAIRS_UP
+        grid[stairs_down_point] = TEMPLATE_STAIRS_DOWN
+
+        return LevelBlueprint(grid=grid, player_start_pos=player_start_point, stairs_up_pos=player_start_point,
+                              stairs_down_pos=stairs_down_point, monsters=[generate_orc(monster_start_point)],
+                              rooms=[])
     else:
         return None
 
 
-def fill_hallway(starting_point, ending_point, template_floor_tile, tile_data):
-    """Fills the tiles in tile_data in two hallways connecting the starting and ending points
-        with tiles that mimic the template"""
-
-    # This should maybe be split further into a "fill_line" method
+def generate_cave_walls(width: int, height: int, fill_probability: float, smoothing_steps: int,
+                        np_rng: np.random.Generator) -> np.ndarray:
+    """Returns a bool grid (indexed [x, y], True for wall) of smoothed random noise
+        Only the largest connected cave is left open, so every floor cell can reach every other one"""
+    is_wall = np_rng.random((width, height)) < fill_probability
+
+    for _ in range(smoothing_steps):
+        # Count the walls around every cell at once, treating off-map as wall so the caves close up at the edges
+        padded = np.pad(is_wall, 1, constant_values=True).astype(np.uint8)
+        neighbors = sum(padded[1 + dx:width + 1 + dx, 1 + dy:height + 1 + dy]
+                        for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx != 0 or dy != 0)
+        # 5+ walls around makes a wall, 3 or fewer makes a floor, and exactly 4 leaves the cell alone
+        is_wall = (neighbors >= 5) | ((neighbors == 4) & is_wall)
+
+    # Keep the border solid, then fill in every cave that isn't connected to the biggest one
+    is_wall[0, :] = is_wall[-1, :] = True
+    is_wall[:, 0] = is_wall[:, -1] = True
+    from scipy.ndimage import label  # Heavy import, and only caves need it
+    # Movement goes diagonally too, so diagonal neighbors count as connected
+    labels, num_caves = label(~is_wall, structure=np.ones((3, 3), dtype=bool))
+    if num_caves == 0:
+        # Nothing survived the smoothing, so open up the middle of the map rather than fail
+        is_wall[1:-1, 1:-1] = True
+        is_wall[max(1, width // 2 - 1):min(width - 1, width // 2 + 2),
+                max(1, height // 2 - 1):min(height - 1, height // 2 + 2)] = False
+        return is_wall
+    cave_sizes = np.bincount(labels.ravel())
+    cave_sizes[0] = 0  # Label 0 is the walls
+    return labels != np.argmax(cave_sizes)
+
+
+def generate_monster(name: str, pos: Point) -> Monster:
+    """Returns a fresh monster of the given kind (by name) standing at pos"""
+    return MONSTER_GENERATORS[name](pos)
+
+
+def generate_orc(pos: Point) -> Monster:
+    """Returns a fresh orc standing at pos"""
+    # Todo: figure out how to structure these into some separate file
+    #  or, for bonus points, load stat-lines in from XML
+    monster_armor = {DamageType.PHYSICAL: 0, DamageType.FIRE: 0, DamageType.LIGHTNING: 0, DamageType.COLD: 0,
+                     DamageType.CORROSIVE: 0}
+    monster_drop = FloorItem(name="gold", pos=(None, None), display_char="$", display_color=TermColor.GOLD,
+                             is_visible=True, blocks_LOS=False, item_type=ItemType.GOLD, item_amount=10)
+    return Monster(name="Orc", pos=pos,
+                   display_char="o", display_color=TermColor.GREEN,
+                   health_max=5.0, health=5.0, armor=monster_armor, attack_power=2, sight_range=8,
+                   monster_update=melee_monster_update, on_death_drop=monster_drop, faction="orcs")
+
+
+def generate_orc_archer(pos: Point) -> Monster:
+    """Returns a fresh orc archer standing at pos. It shoots from as far as it can see, and runs with the orcs"""
+    monster_armor = {DamageType.PHYSICAL: 0, DamageType.FIRE: 0, DamageType.LIGHTNING: 0, DamageType.COLD: 0,
+                     DamageType.CORROSIVE: 0}
+    monster_drop = FloorItem(name="gold", pos=(None, None), display_char="$", display_color=TermColor.GOLD,
+                             is_visible=True, blocks_LOS=False, item_type=ItemType.GOLD, item_amount=10)
+    return Monster(name="Orc archer", pos=pos,
+                   display_char="o", display_color=TermColor.OLIVE,
+                   health_max=4.0, health=4.0, armor=monster_armor, attack_power=2, sight_range=8,
+                   monster_update=ranged_monster_update, on_death_drop=monster_drop, faction="orcs")
+
+
+# Monster kinds by name, for anything that needs to rebuild a monster from a record
+MONSTER_GENERATORS = {"Orc": generate_orc, "Orc archer": generate_orc_archer}
+
+
+def fill_hallway(starting_point: Point, ending_point: Point, template_index: int, grid: np.ndarray):
+    """Fills the cells of grid in two hallways connecting the starting and ending points with template_index"""
     # Horizontal leg first
-    for x in range(min(starting_point.x, ending_point.x), max(starting_point.x, ending_point.x) + 1):
-        new_tile = Tile(world_x=x, world_y=starting_point.y, floor_char=template_floor_tile.floor_char,
-                        is_blocking_move=template_floor_tile.is_blocking_move,
-                        is_blocking_LOS=template_floor_tile.is_blocking_LOS,
-                        is_visible=template_floor_tile.is_visible,
-                        visible_color=template_floor_tile.visible_color,
-                        fow_color=template_floor_tile.fow_color,
-                        has_been_visible=template_floor_tile.has_been_visible,
-                        movement_weight=template_floor_tile.movement_weight,
-                        is_in_LOS=template_floor_tile.is_in_LOS)
-        tile_data[Point(x, starting_point.y)] = new_tile
+    min_x, max_x = min(starting_point.x, ending_point.x), max(starting_point.x, ending_point.x)
+    grid[min_x:max_x + 1, starting_point.y] = template_index
     # Then the vertical leg
-    for y in range(min(starting_point.y, ending_point.y), max(starting_point.y, ending_point.y) + 1):
-        new_tile = Tile(world_x=ending_point.x, world_y=y, floor_char=template_floor_tile.floor_char,
-                        is_blocking_move=template_floor_tile.is_blocking_move,
-                        is_blocking_LOS=template_floor_tile.is_blocking_LOS,
-                        is_visible=template_floor_tile.is_visible,
-                        visible_color=template_floor_tile.visible_color,
-                        fow_color=template_floor_tile.fow_color,
-                        has_been_visible=template_floor_tile.has_been_visible,
-                        movement_weight=template_floor_tile.movement_weight,
-                        is_in_LOS=template_floor_tile.is_in_LOS)
-        tile_data[Point(ending_point.x, y)] = new_tile
-
-
-def fill_room_with_template(room, template_tile, tile_data):
-    """Fills the tiles in tile_data in the area of room with tiles that mimic the template"""
-    for room_x in range(room.p1.x, room.p2.x + 1):
-        for room_y in range(room.p1.y, room.p2.y + 1):
-            new_tile = Tile(world_x=room_x, world_y=room_y, floor_char=template_tile.floor_char,
-                            is_blocking_move=template_tile.is_blocking_move,
-                            is_blocking_LOS=template_tile.is_blocking_LOS,
-                            is_visible=template_tile.is_visible,
-                            visible_color=template_tile.visible_color,
-                            fow_color=template_tile.fow_color,
-                            has_been_visible=template_tile.has_been_visible,
-                            movement_weight=template_tile.movement_weight,
-                            is_in_LOS=template_tile.is_in_LOS)
-            tile_data[Point(room_x, room_y)] = new_tile
-
-
-def generate_room(map_height, map_width, room_size, room_size_mod):
+    min_y, max_y = min(starting_point.y, ending_point.y), max(starting_point.y, ending_point.y)
+    grid[ending_point.x, min_y:max_y + 1] = template_index
+
+
+def fill_room_with_template(room: Room, template_index: int, grid: np.ndarray):
+    """Fills the cells of grid in the area of room with template_index"""
+    grid[room.p1.x:room.p2.x + 1, room.p1.y:room.p2.y + 1] = template_index
+
+
+def is_room_intersecting_grid(room: Room, grid: np.ndarray, buffer: int = 0) -> bool:
+    """Returns if any cell within room (grown by buffer) has already been carved out of the walls
+        While only rooms have been carved this matches Room.is_room_intersecting_other,
+        but it doesn't slow down as more rooms are added"""
+    x1, y1 = max(room.p1.x - buffer, 0), max(room.p1.y - buffer, 0)
+    return bool((grid[x1:room.p2.x + buffer + 1, y1:room.p2.y + buffer + 1] != TEMPLATE_WALL).any())
+
+
+def generate_room(map_height, map_width, room_size, room_size_mod, rng: random.Random | None = None):
     """Generates a room of the given size +/- size_mod, that will fit in the given map size"""
-    room_width = random.randint(room_size - room_size_mod, room_size + room_size_mod)
-    room_height = random.randint(room_size - room_size_mod, room_size + room_size_mod)
-    room_x = random.randint(1, map_width - 2 - room_width)  # randint is inclusive on both
-    room_y = random.randint(1, map_height - 2 - room_height)  # move in by one so it doesn't touch edge of map
+    rng = rng or random
+    room_width = rng.randint(room_size - room_size_mod, room_size + room_size_mod)
+    room_height = rng.randint(room_size - room_size_mod, room_size + room_size_mod)
+    room_x = rng.randint(1, map_width - 2 - room_width)  # randint is inclusive on both
+    room_y = rng.randint(1, map_height - 2 - room_height)  # move in by one so it doesn't touch edge of map
 
     return Room(Point(room_x, room_y), Point(room_x + room_width - 1, room_y + room_height - 1))
+
@@ -0,0 +1,104 @@
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from levelData import LevelData
+from levelGeneration import generate_level
+from levelStorage import pack_level, unpack_level
+
+
+def level_seed(base_seed: int, depth: int) -> int:
+    """Returns the generation seed for the floor at depth in a dungeon started from base_seed"""
+    # Any fixed mixing works, as long as every process derives the same seed for the same floor
+    return (base_seed * 1_000_003 + depth * 7_919) % (2 ** 63)
+
+
+def generate_packed_level(lvlargs: dict, seed: int) -> bytes:
+    """Generates a level and returns it packed. This is what runs in the worker processes"""
+    return pack_level(generate_level(**lvlargs, seed=seed))
+
+
+class LevelPipeline:
+    """Generates upcoming floors in a worker process ahead of the player needing them
+        Floors come back packed (see levelStorage), so handing them over between processes is cheap,
+        and since every floor has a fixed seed, a pre-generated floor matches one generated on demand"""
+
+    def __init__(self, lvlargs: dict, base_seed: int, lookahead: int = 1, max_workers: int = 1, mp_context=None):
+        self.lvlargs = lvlargs
+        self.base_seed = base_seed
+        self.lookahead = lookahead  # How many floors past the current one to keep generating
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context)
+        self._pending: dict[int, Future] = {}
+
+    def seed_for_depth(self, depth: int) -> int:
+        return level_seed(self.base_seed, depth)
+
+    def prefetch(self, depths: list[int]):
+        """Starts generating each floor in depths in the background, skipping any already started
+            Does nothing for the chunked overworld (generation_type 2), which can't be packed to be handed back, and
+            only generates chunks as they're needed anyway"""
+        if self.lvlargs["generation_type"] == 2:
+            return
+        for depth in depths:
+            if depth not in self._pending:
+                logging.debug(f"Pre-generating floor {depth}")
+                self._pending[depth] = self._executor.submit(generate_packed_level, self.lvlargs,
+                                                             self.seed_for_depth(depth))
+
+    def prefetch_below(self, depth: int):
+        """Starts generating the next lookahead floors below depth"""
+        self.prefetch(list(range(depth + 1, depth + 1 + self.lookahead)))
+
+    def is_ready(self, depth: int) -> bool:
+        return depth in self._pending and self._pending[depth].done()
+
+    def take_level(self, depth: int) -> LevelData:
+        """Returns the floor at depth, waiting on (or generating it here, if it was never started) as needed
+            Each floor is handed out once - after that it's up to the caller to keep hold of it"""
+        future = self._pending.pop(depth, None)
+        if future is None:
+            logging.debug(f"Floor {depth} was not pre-generated, generating it now")
+            # Nothing to hand between processes, so skip packing it. Same floor either way
+            return generate_level(**self.lvlargs, seed=self.seed_for_depth(depth))
+        if not future.done():
+            logging.debug(f"Floor {depth} is still generating, waiting on it")
+        return unpack_level(future.result())
+
+    def shutdown(self):
+        """Stops the worker processes, dropping any floors that haven't been started yet"""
+        # Waits for a floor that's partway through generating. Not waiting leaves the executor's wakeup pipe closed
+        # under its exit handler, which then errors at interpreter exit
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._pending.clear()
+
+
+class SharedLevelPipeline(LevelPipeline):
+    """A LevelPipeline for several players in the same dungeon, which hands each floor out as often as it's asked for
+        Each floor is only generated once and then kept packed. Every take unpacks a fresh copy for the taker
+        Workers come from a forkserver rather than being forked from this process, since a server forking a worker
+        would hand it every open connection, and the client wouldn't see a connection close until the worker did"""
+
+    def __init__(self, lvlargs: dict, base_seed: int, lookahead: int = 1, max_workers: int = 1):
+        if lvlargs["generation_type"] == 2:
+            raise ValueError("The chunked overworld (generation_type 2) can't be packed, so it can't be shared")
+        super().__init__(lvlargs, base_seed, lookahead, max_workers, multiprocessing.get_context("forkserver"))
+        self._packed: dict[int, bytes] = {}
+
+    def prefetch(self, depths: list[int]):
+        super().prefetch([depth for depth in depths if depth not in self._packed])
+
+    def take_level(self, depth: int) -> LevelData:
+        blob = self._packed.get(depth)
+        if blob is None:
+            future = self._pending.pop(depth, None)
+            if future is None:
+                logging.debug(f"Floor {depth} was not pre-generated, generating it now")
+                blob = generate_packed_level(self.lvlargs, self.seed_for_depth(depth))
+            else:
+                blob = future.result()
+            self._packed[depth] = blob
+        return unpack_level(blob)
+
+    @property
+    def packed_bytes(self) -> int:
+        return sum(len(blob) for blob in self._packed.values())
@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from globalEnums import TermColor, Point
+from levelData import LevelData, Tile
+from levelGeneration import tile_data_from_grid
+
+# Packed levels are a zlib-compressed blob of:
+#   header struct (magic, version, length of the JSON header)
+#   JSON header - size, tile palette, stairs/start positions and the byte length of each section
+#   palette-index grid (uint8, indexed [x, y]), then bit-packed is_visible/is_in_LOS/has_been_visible grids
+#   pickled entity lists (monsters, floor_items, floor_effects, interactables), then the floor's packs and turn count
+# The player isn't part of a level, so it's never packed
+PACKED_LEVEL_MAGIC = b"IMLV"
+PACKED_LEVEL_VERSION = 2
+_HEADER_STRUCT = struct.Struct("<4sHI")
+
+
+def tile_kind(tile: Tile) -> tuple:
+    """The parts of a Tile that don't depend on where it is or what the player has seen"""
+    return (tile.floor_char, tile.is_blocking_move, tile.is_blocking_LOS, tile.visible_color.name,
+            tile.fow_color.name, tile.movement_weight)
+
+
+def tile_templates(palette: list) -> list[Tile]:
+    """Turns a palette of tile_kind()s (as stored, so lists rather than tuples) back into template Tiles"""
+    return [Tile(world_x=0, world_y=0, floor_char=char, is_blocking_move=blocks_move,
+                 is_blocking_LOS=blocks_los, is_visible=False, is_in_LOS=False,
+                 visible_color=TermColor[visible_color], fow_color=TermColor[fow_color],
+                 has_been_visible=False, movement_weight=weight)
+            for char, blocks_move, blocks_los, visible_color, fow_color, weight in palette]
+
+
+def optional_point(p: Point | None) -> list | None:
+    return None if p is None else [p.x, p.y]
+
+
+def load_optional_point(p: list | None) -> Point | None:
+    return None if p is None else Point(*p)
+
+
+def pack_level(level_data: LevelData) -> bytes:
+    """Serializes level_data (minus the player and vfx) into a compact binary blob"""
+    # The chunked overworld is about 2^21 tiles a side, so walking it tile by tile would never finish
+    if not isinstance(level_data.tiles, dict):
+        raise TypeError("Only floors with a fixed set of tiles can be packed (not the chunked overworld)")
+    width, height = level_data.width, level_data.height
+    palette: dict[tuple, int] = {}
+    kinds, visible, in_los, seen = [], [], [], []
+
+    # Walk the tiles in [x, y] order, building plain lists and only handing them to numpy at the end
+    tiles = level_data.tiles
+    for x in range(width):
+        for y in range(height):
+            tile = tiles[Point(x, y)]
+            kinds.append(palette.setdefault(tile_kind(tile), len(palette)))
+            visible.append(tile.is_visible)
+            in_los.append(tile.is_in_LOS)
+            seen.append(tile.has_been_visible)
+    if len(palette) > 256:
+        raise ValueError(f"Level has {len(palette)} distinct tile kinds, but packing supports at most 256")
+
+    grid_bytes = np.array(kinds, dtype=np.uint8).tobytes()
+    flag_bytes = np.packbits(np.array([visible, in_los, seen], dtype=bool)).tobytes()
+    entity_bytes = pickle.dumps((level_data.monsters, level_data.floor_items, level_data.floor_effects,
+                                 level_data.interactables, level_data.packs, level_data.turns),
+                                protocol=pickle.HIGHEST_PROTOCOL)
+
+    header = {"width": width, "height": height, "palette": list(palette.keys()),
+              "player_start_pos": optional_point(level_data.player_start_pos),
+              "stairs_up_pos": optional_point(level_data.stairs_up_pos),
+              "stairs_down_pos": optional_point(level_data.stairs_down_pos),
+              "sections": [len(grid_bytes), len(flag_bytes), len(entity_bytes)]}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+
+    return zlib.compress(_HEADER_STRUCT.pack(PACKED_LEVEL_MAGIC, PACKED_LEVEL_VERSION, len(header_bytes)) +
+                         header_bytes + grid_bytes + flag_bytes + entity_bytes)
+
+
+def unpack_level(blob: bytes) -> LevelData:
+    """Rebuilds the LevelData packed by pack_level. The player is left as None"""
+    raw = zlib.decompress(blob)
+    magic, version, header_len = _HEADER_STRUCT.unpack_from(raw)
+    if magic != PACKED_LEVEL_MAGIC or version != PACKED_LEVEL_VERSION:
+        raise ValueError(f"Not a packed level (magic {magic!r}, version {version})")
+
+    offset = _HEADER_STRUCT.size
+    header = json.loads(raw[offset:offset + header_len])
+    offset += header_len
+    width, height = header["width"], header["height"]
+    grid_len, flag_len, entity_len = header["sections"]
+
+    grid = np.frombuffer(raw, dtype=np.uint8, count=grid_len, offset=offset).reshape((width, height))
+    offset += grid_len
+    flags = np.unpackbits(np.frombuffer(raw, dtype=np.uint8, count=flag_len, offset=offset),
+                          count=3 * width * height).reshape((3, width, height)).astype(bool)
+    offset += flag_len
+    monsters, floor_items, floor_effects, interactables, packs, turns = pickle.loads(raw[offset:offset + entity_len])
+
+    tile_data = tile_data_from_grid(grid, tile_templates(header["palette"]))
+
+    # Most tiles have no flags set, so patch up the ones that do rather than baking flags into the templates
+    for x, y in zip(*np.nonzero(flags[0])):
+        tile_data[Point(int(x), int(y))].is_visible = True
+    for x, y in zip(*np.nonzero(flags[1])):
+        tile_data[Point(int(x), int(y))].is_in_LOS = True
+    for x, y in zip(*np.nonzero(flags[2])):
+        tile_data[Point(int(x), int(y))].has_been_visible = True
+
+    level_data = LevelData(tile_data=tile_data, width=width, height=height,
+                           player_start_pos=load_optional_point(header["player_start_pos"]),
+                           monsters=monsters, floor_items=floor_items, floor_effects=floor_effects,
+                           interactables=interactables, vfx=[],
+                           stairs_up_pos=load_optional_point(header["stairs_up_pos"]),
+                           stairs_down_pos=load_optional_point(header["stairs_down_pos"]))
+    level_data.packs = packs
+    level_data.turns = turns
+    return level_data
+
+
+class LevelStore:
+    """Holds the floors the player isn't currently on
+        The most recently stored floors stay in memory as LevelData, older ones are packed and paged out to cache_dir"""
+
+    def __init__(self, cache_dir: str | None = None, max_in_memory: int = 3):
+        self.cache_dir = cache_dir  # Created on first page-out if not given
+        self._owns_cache_dir = False  # Whether cache_dir was made here (and so gets removed by clear)
+        self.max_in_memory = max_in_memory
+        self._in_memory: OrderedDict[int, LevelData] = OrderedDict()
+        self._on_disk: set[int] = set()
+        # Bumped every time a floor is put, so anything caching a stored floor can tell if it's been replaced since
+        self._versions: dict[int, int] = {}
+        self._next_version = 0
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._in_memory or key in self._on_disk
+
+    def put(self, key: int, level_data: LevelData):
+        """Stores a floor, paging the least recently stored floor out to disk if there are too many in memory"""
+        self._in_memory[key] = level_data
+        self._in_memory.move_to_end(key)
+        self._versions[key] = self._next_version
+        self._next_version += 1
+        while len(self._in_memory) > self.max_in_memory:
+            # The chunked overworld can't be packed (and spills its own chunks to disk), so it stays in memory
+            oldest = next((k for k, floor in self._in_memory.items() if isinstance(floor.tiles, dict)), None)
+            if oldest is None:
+                break
+            self._page_out(oldest, self._in_memory.pop(oldest))
+
+    def take(self, key: int) -> LevelData | None:
+        """Removes and returns a stored floor (loading it from disk if needed), or None if it isn't stored"""
+        if key in self._in_memory:
+            return self._in_memory.pop(key)
+        if key not in self._on_disk:
+            return None
+
+        path = self._path(key)
+        with open(path, "rb") as f:
+            level_data = unpack_level(f.read())
+        os.remove(path)
+        self._on_disk.remove(key)
+        return level_data
+
+    def peek(self, key: int) -> LevelData | None:
+        """Returns a stored floor without removing it (reading a paged-out floor back in), or None if it isn't stored
+            A paged-out floor comes back as a fresh copy, so changes to it aren't kept"""
+        if key in self._in_memory:
+            return self._in_memory[key]
+        if key not in self._on_disk:
+            return None
+        with open(self._path(key), "rb") as f:
+            return unpack_level(f.read())
+
+    def in_memory(self) -> list[tuple[int, LevelData]]:
+        """(key, floor) for every stored floor that hasn't been paged out"""
+        return list(self._in_memory.items())
+
+    def touch(self, key: int):
+        """Marks a stored floor as changed in place (without being put again), so caches of it know to refresh"""
+        if key in self:
+            self._versions[key] = self._next_version
+            self._next_version += 1
+
+    def keys(self) -> list[int]:
+        """The keys of every stored floor, in memory or on disk"""
+        return sorted(set(self._in_memory) | self._on_disk)
+
+    def version(self, key: int) -> int | None:
+        """Changes whenever the floor at key is put again. None if it isn't stored"""
+        return self._versions.get(key) if key in self else None
+
+    def clear(self):
+        """Forgets every stored floor, deleting any paged-out files (and cache_dir, if the store made it)"""
+        for key in self._on_disk:
+            os.remove(self._path(key))
+        for level_data in self._in_memory.values():
+            level_data.close()
+        if self._owns_cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            self.cache_dir = None
+            self._owns_cache_dir = False
+        self._on_disk.clear()
+        self._in_memory.clear()
+        self._versions.clear()
+
+    def _path(self, key: int) -> str:
+        return os.path.join(self.cache_dir, f"floor_{key}.lvl")
+
+    def _page_out(self, key: int, level_data: LevelData):
+        if self.cache_dir is None:
+            self.cache_dir = tempfile.mkdtemp(prefix="imla_levels_")
+            self._owns_cache_dir = True
+            logging.debug(f"Paging levels out to {self.cache_dir}")
+        with open(self._path(key), "wb") as f:
+            f.write(pack_level(level_data))
+        self._on_disk.add(key)
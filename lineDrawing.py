@@ -0,0 +1,36 @@
+# Line rasterizing, done here rather than pulling in scikit-image (and SciPy with it) at startup just for lines
+
+
+def line(r0: int, c0: int, r1: int, c1: int) -> tuple[list[int], list[int]]:
+    """Returns the row and column indices of the cells on the line from (r0, c0) to (r1, c1), both ends included
+        Same Bresenham walk (and so exactly the same cells) as skimage.draw.line, which this replaced"""
+    r0, c0, r1, c1 = int(r0), int(c0), int(r1), int(c1)
+    dr = abs(r1 - r0)
+    dc = abs(c1 - c0)
+    sr = 1 if r1 - r0 > 0 else -1
+    sc = 1 if c1 - c0 > 0 else -1
+    steep = dr > dc
+    # Always walk along the longer axis
+    r, c = (c0, r0) if steep else (r0, c0)
+    if steep:
+        dc, dr = dr, dc
+        sc, sr = sr, sc
+    d = 2 * dr - dc
+
+    rr = [0] * (dc + 1)
+    cc = [0] * (dc + 1)
+    for i in range(dc):
+        if steep:
+            rr[i] = c
+            cc[i] = r
+        else:
+            rr[i] = r
+            cc[i] = c
+        while d >= 0:
+            r += sr
+            d -= 2 * dc
+        c += sc
+        d += 2 * dr
+    rr[dc] = r1
+    cc[dc] = c1
+    return rr, cc
@@ -1,6 +1,6 @@
 # cd PycharmProjects/ImlaRL
 # assume a console window of 120 x 30
-# Packages installed for this: blessed, skimage
+# Packages installed for this: blessed, numpy (and scipy, for cave levels)
 
 # https://pypi.org/project/perlin-noise/
 """
@@ -16,33 +16,91 @@ print(f"{foo:.2f}")
 
 """
 # from typing import List, Tuple
-# import time
+import sys
+
+from startupProfile import StartupProfile
+
+if "--startup-profile" in sys.argv:
+    # This has to happen before the imports below, so that they get timed
+    StartupProfile.install()
+
+import argparse
+import time
 from typing import TypeVar, Protocol, List, Dict, Tuple, Iterator
 
 import blessed
 import logging
+import random
 # import math
 # from dataclasses import dataclass, field
-from skimage.draw import line
 
-from entity import Player
+from animation import ANIMATION_FPS, Animations, play_animations
+from dungeon import Dungeon, DungeonManager
+from entity import Player, create_player
+from frameDiff import GlyphTable, compose_frame_cells
 from globalEnums import DamageType, Point, Entity
-from inputHandling import handle_input
+from gameTurn import ThreatWatch, drain_keys, run_keys
+from imlaLogging import LoggingManager, Trace
+from keymap import KeymapManager, load_keymap
 from levelData import TermColor, LevelData, dijkstra_search, \
     reconstruct_path, a_star_search
-from levelGeneration import generate_level
-from screenDrawing import draw_camera, update_bottom_status, TopMessage, center_camera_on_player, Camera, WindowManager
+from levelGeneration import DEFAULT_LVLARGS
+from levelPipeline import LevelPipeline
+from minimap import MinimapView, draw_minimap_panel, draw_overview
+from profiler import Profiler, SPAN_ANIMATION, SPAN_FOV, SPAN_INPUT_WAIT
+from replayLog import RecordingInput, ReplayLog, state_hash
+from saveGame import Autosaver, load_game, restore_dungeon, save_exists
+from scentMap import ScentOverlay, scent_overlay
+from screenDrawing import draw_camera, update_bottom_status, TopMessage, center_camera_on_player, Camera, WindowManager, \
+    draw_profiler_overlay
 from shadowCasting import refresh_visibility
+from spectatorStream import SpectatorHub
 
-logging.basicConfig(filename='Imladebug.log', filemode='w', level=logging.DEBUG)
+StartupProfile.mark("imports")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="ImlaRL")
+    parser.add_argument("--coalesce-input", action=argparse.BooleanOptionalAction, default=True,
+                        help="run every queued keypress before redrawing, instead of drawing a frame for each one")
+    parser.add_argument("--interrupt-on-threat", action=argparse.BooleanOptionalAction, default=True,
+                        help="drop queued keypresses when a monster comes into view or the player takes damage")
+    parser.add_argument("--trace", action="store_true",
+                        help="start with the per-turn trace logging on (F6 toggles it in game)")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="time each import and startup phase, and print a report on exit")
+    parser.add_argument("--profile-json", metavar="PATH", default=None,
+                        help="on exit, write per-phase frame timings (p50/p95/max) to PATH as JSON")
+    parser.add_argument("--save-dir", metavar="PATH", default="save",
+                        help="directory the game is saved to (on quitting, and every so often while playing)")
+    parser.add_argument("--load", action="store_true", help="carry on from the game saved in --save-dir")
+    parser.add_argument("--autosave", action=argparse.BooleanOptionalAction, default=True,
+                        help="save in the background every so often (the game is saved on quitting either way)")
+    parser.add_argument("--record", metavar="PATH", default=None,
+                        help="record the seeds and every key pressed to PATH, for replayLog.py to replay")
+    parser.add_argument("--spectate-port", type=int, default=None, metavar="PORT",
+                        help="let others watch the game with spectatorStream.py, on this TCP port")
+    parser.add_argument("--spectate-unix", metavar="PATH", default=None,
+                        help="let others watch the game with spectatorStream.py, on a UNIX socket at PATH")
+    parser.add_argument("--animation-fps", type=int, default=ANIMATION_FPS, metavar="FPS",
+                        help="frame rate to play projectiles and other effects at (any key skips them). 0 turns them "
+                             "off, leaving a one-frame trail instead")
+    args = parser.parse_args()
+    if args.record is not None and args.load:
+        parser.error("--record can only record a new game, not one loaded with --load")
+
+    LoggingManager.setup_logging()
+    Trace.set_all(args.trace)
+    Animations.enabled = args.animation_fps > 0
+    Animations.fps = max(args.animation_fps, 1)
+    StartupProfile.mark("arguments and logging")
+
     term = blessed.Terminal()
     print(f"height:{term.height} width:{term.width}")
     print(f"Colors:{term.number_of_colors}")
 
     logging.debug("Program beginning. Terminal initialized.")
+    StartupProfile.mark("terminal")
 
     camera_width = term.width
     camera_height = term.height - 3
@@ -54,47 +112,103 @@ def main():
 
     WindowManager.set_main_camera(main_cam)
 
+    # Every floor is generated from a seed derived from this one, so a run can be reproduced from it
+    loaded_game = None
+    if args.load:
+        if not save_exists(args.save_dir):
+            parser.error(f"there's no saved game in {args.save_dir}")
+        loaded_game = load_game(args.save_dir)
+        load_message = (f"Loaded the game saved in {args.save_dir} in {loaded_game.seconds * 1000:0.1f}ms "
+                        f"({loaded_game.save_size / 1024:0.1f}KB)")
+        logging.info(load_message)
+        lvlargs = loaded_game.lvlargs
+        dungeon_seed = loaded_game.seed
+    else:
+        lvlargs = DEFAULT_LVLARGS
+        dungeon_seed = random.randrange(2 ** 32)
+    logging.debug(f"Dungeon seed: {dungeon_seed}")
+    level_pipeline = LevelPipeline(lvlargs=lvlargs, base_seed=dungeon_seed)
+    dungeon = restore_dungeon(loaded_game, level_pipeline) if loaded_game is not None else Dungeon(level_pipeline)
+    DungeonManager.set_dungeon(dungeon)
+    autosaver = Autosaver(args.save_dir) if args.autosave else None
+
+    # Key bindings can be overridden in keybindings.ini (see keymap.load_keymap). Without one, the defaults are used
+    keymap = load_keymap("keybindings.ini")
+    KeymapManager.set_keymap(keymap)
+
+    # Everything random during play (damage rolls and so on) comes from the random module, so seeding it makes a
+    # run reproducible from its seeds and keys
+    rng_seed = random.randrange(2 ** 32)
+    random.seed(rng_seed)
+    replay_log = None
+    if args.record is not None:
+        replay_log = ReplayLog(dungeon_seed=dungeon_seed, rng_seed=rng_seed, lvlargs=lvlargs,
+                               bindings=keymap.bindings, coalesce_input=args.coalesce_input,
+                               interrupt_on_threat=args.interrupt_on_threat)
+
+    # Everything that reads keys goes through input_term, so a recording sees every key the game does
+    input_term = RecordingInput(term, replay_log) if replay_log is not None else term
+
+    # Spectators get the same screen, composed as glyph indices, encoded once and sent to all of them
+    spectator_hub = spectator_channel = None
+    if args.spectate_port is not None or args.spectate_unix is not None:
+        spectator_hub = SpectatorHub(GlyphTable(term))
+        spectator_hub.start_in_thread(port=args.spectate_port, unix_path=args.spectate_unix)
+        spectator_channel = spectator_hub.open_channel(0)
+
     with term.fullscreen(), term.hidden_cursor(), term.cbreak():
         # Fun note! hidden_cursor needs to come after fullscreen
         print(term.home + term.clear, end='')
         TopMessage.set_terminal(term)
 
-        # tic = time.perf_counter()
-        lvlargs = {"generation_type": 1, "height": 40, "width": 140,
-                   "num_rooms": 20, "room_size": 9, "room_size_mod": 3}
-        level_data = generate_level(**lvlargs)
-        # toc = time.perf_counter()
-        # logging.debug(f"Level generation completed after {toc-tic:0.4f} seconds")
+        if loaded_game is not None:
+            level_data = dungeon.current_level
+            player = level_data.player
+            TopMessage.add_message(load_message)
+            StartupProfile.mark("loading the save")
+        else:
+            tic = time.perf_counter()
+            level_data = dungeon.start()
+            toc = time.perf_counter()
+            logging.debug(f"Level generation completed after {toc-tic:0.4f} seconds")
+            StartupProfile.mark("first level")
 
-        # Generate fresh player entity
-        # This should likely also pull from an XML file or some such
-        player_armor = {DamageType.PHYSICAL: 0, DamageType.FIRE: 0, DamageType.LIGHTNING: 0, DamageType.COLD: 0,
-                        DamageType.CORROSIVE: 0}
-        player = Player(name="PlayerName", pos=level_data.player_start_pos,
-                        display_char="@", display_color=TermColor.WHITE,
-                        health_max=10.0, health=10, armor=player_armor, attack_power=5,
-                        xp=0, next_level_xp=10, inventory=[])
+            # Generate fresh player entity
+            player = create_player(level_data.player_start_pos)
 
-        level_data.player = player
+            level_data.player = player
 
         # level_data.set_visibility_of_all(True)
 
+        threat_watch = ThreatWatch() if args.interrupt_on_threat else None
+
         # logging.debug(f"Color Enum red: {TermColor.RED} {TermColor.RED.value}")
 
         while True:
+            Profiler.end_frame()
+            # The player may have taken the stairs last turn
+            level_data = dungeon.current_level
+
             # Recalc visibility
-            # tic = time.perf_counter()
-            refresh_visibility(player.pos.x, player.pos.y, player.sight_range, level_data)
-            # toc = time.perf_counter()
-            # logging.debug(f"Visibility refresh completed after {toc - tic:0.4f} seconds")
+            with Profiler.span(SPAN_FOV):
+                refresh_visibility(player.pos.x, player.pos.y, player.sight_range, level_data)
 
             # Resize camera (in-case window size has changed)
             main_cam.resize_camera()
             # Center camera on player (as best as possible)
             main_cam.center_camera_on_player(level_data)
 
-            # Draw camera contents
-            main_cam.draw_camera(level_data)
+            # Draw camera contents, or the whole level shrunk down in its place
+            if MinimapView.overview_visible and draw_overview(term, main_cam, level_data):
+                level_data.vfx.clear()
+                Animations.take()
+            else:
+                main_cam.draw_camera(level_data)
+                if ScentOverlay.visible:
+                    overlay = scent_overlay(level_data)
+                    main_cam.draw_cells(level_data, overlay.keys(), overlay)
+                if MinimapView.panel_visible:
+                    draw_minimap_panel(term, main_cam, level_data)
             """draw_camera(term=term, cam_origin_x=camera_x, cam_origin_y=camera_y, cam_width=camera_width,
                         cam_height=camera_height,
                         term_origin_x=camera_window_origin_x, term_origin_y=camera_window_origin_y,
@@ -102,24 +216,65 @@ def main():
 
             # Update bottom status and push messages to top message line
             update_bottom_status(term, level_data)
+            message = TopMessage.message_buffer
             TopMessage.flush_message()
+            if spectator_channel is not None:
+                cells = compose_frame_cells(level_data, main_cam, message, term.width, term.height,
+                                            spectator_hub.glyphs)
+                spectator_channel.publish(cells, term.width, term.height)
+            if Profiler.overlay_visible:
+                draw_profiler_overlay(term)
+            if Animations.pending:
+                # Straight from the terminal rather than input_term, so a recording doesn't see the frame waits. A key
+                # that skips the animation is put back, and gets recorded when it's read below
+                with Profiler.span(SPAN_ANIMATION):
+                    play_animations(term, main_cam, level_data)
+                if MinimapView.panel_visible:
+                    # The last frame's cleanup may have drawn over it
+                    draw_minimap_panel(term, main_cam, level_data)
+            if StartupProfile.active and not StartupProfile.phases[-1][0] == "first frame":
+                StartupProfile.mark("first frame")
+                StartupProfile.uninstall()
 
-            # Wait for an input
-            key_input = term.inkey()
-            if key_input == 'Q':
+            # Wait for an input. If more keys piled up while we were drawing (a held-down arrow key, on a slow
+            # terminal), run them all now and only draw where they end up
+            with Profiler.span(SPAN_INPUT_WAIT):
+                keys = [input_term.inkey()]
+            if args.coalesce_input:
+                keys.extend(drain_keys(input_term))
+            running = run_keys(keys, keymap, dungeon, input_term, threat_watch)
+            if replay_log is not None:
+                replay_log.state_hashes.append(state_hash(dungeon))
+            if not running:
                 break
-            else:
-                player_turn_done = handle_input(key_input, level_data, term)
-                # set_message(_term=term, message="Message is set!")
-                # player.x += 1
-                # player.y += 1
-
-            if player_turn_done:
-                for m in level_data.monsters:
-                    m.update(level_data)
-                # Other update bits will go here as well. Floor effects ticking/etc.
+            if autosaver is not None:
+                # Between turns, so the snapshot is consistent. The writing happens on the autosave thread
+                autosaver.maybe_save(dungeon)
 
+    if replay_log is not None:
+        replay_log.save(args.record)
+    if spectator_hub is not None:
+        spectator_hub.stop()
+    # Quitting always saves. Without autosaving there's no saver running yet, so one is started just for this
+    if autosaver is None:
+        autosaver = Autosaver(args.save_dir)
+    save_stats = autosaver.save_now(dungeon)
+    autosaver.close()
+    level_pipeline.shutdown()
+    if args.profile_json is not None:
+        Profiler.end_frame()
+        Profiler.export_json(args.profile_json)
+    logging.info(f"Off-screen simulation: {dungeon.offscreen.stats.summary()}")
+    dungeon.close()
+    if save_stats is not None:
+        print(f"Saved to {args.save_dir} in {save_stats.seconds * 1000:0.1f}ms ({save_stats.save_size / 1024:0.1f}KB)")
+    if spectator_channel is not None:
+        print(f"Spectator stream: {spectator_channel.stats.summary()}")
     print("Exiting program...")
+    if args.startup_profile:
+        report = StartupProfile.report()
+        logging.info(report)
+        print(report)
 
 
 if __name__ == '__main__':
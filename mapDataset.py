@@ -0,0 +1,154 @@
+# Bulk level generation into a single dataset file, so pathing/FOV benchmarks and tests can load thousands of
+# reproducible layouts by index instead of regenerating them
+# Run with e.g.: python mapDataset.py maps.imlamaps --seeds 0:1000 --lvlarg generation_type=3
+import argparse
+import json
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from globalEnums import Point
+from levelData import LevelData
+from levelGeneration import (BLUEPRINT_GENERATION_TYPES, DEFAULT_LVLARGS, LevelBlueprint, Room,
+                             generate_level_blueprint, generate_monster)
+
+# File layout:
+#   prologue struct (magic, version, level count, width, height, grid offset, metadata offset/length)
+#   zero padding up to GRID_ALIGNMENT
+#   count * width * height uint8 grids of TILE_TEMPLATES indices, each one indexed [x, y]
+#   JSON metadata - the lvlargs plus the seed, start, stairs, rooms and monsters of every level
+# The grids are a fixed-size block at a fixed offset, so the whole block can be memory-mapped as one array.
+# The metadata goes last since it's only known once every level has been generated
+DATASET_MAGIC = b"IMLAMAPS"
+DATASET_VERSION = 1
+GRID_ALIGNMENT = 4096
+_PROLOGUE_STRUCT = struct.Struct("<8sHIIIQQQ")
+
+
+def _blueprint_metadata(seed: int, blueprint: LevelBlueprint) -> dict:
+    return {"seed": seed,
+            "player_start_pos": list(blueprint.player_start_pos),
+            "stairs_up_pos": list(blueprint.stairs_up_pos),
+            "stairs_down_pos": list(blueprint.stairs_down_pos),
+            "rooms": [[r.p1.x, r.p1.y, r.p2.x, r.p2.y] for r in blueprint.rooms],
+            "monsters": [[m.name, m.pos.x, m.pos.y] for m in blueprint.monsters]}
+
+
+def generate_dataset_entry(lvlargs: dict, seed: int) -> tuple[bytes, dict]:
+    """Generates one level, returning its grid bytes and metadata. This is what runs in the worker processes"""
+    blueprint = generate_level_blueprint(**lvlargs, seed=seed)
+    return blueprint.grid.tobytes(), _blueprint_metadata(seed, blueprint)
+
+
+def write_dataset(path: str, lvlargs: dict, seeds: list[int], max_workers: int | None = None) -> float:
+    """Generates a level for every seed (in parallel) and writes them all into one dataset file at path
+        Returns how long it took, in seconds"""
+    tic = time.perf_counter()
+    width, height = lvlargs["width"], lvlargs["height"]
+    grid_size = width * height
+    metadata = []
+
+    with open(path, "wb") as f, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        f.write(b"\0" * GRID_ALIGNMENT)  # Room for the prologue, which is filled in at the end
+        # map keeps the results in seed order, so the grids can be streamed straight into the file
+        chunksize = max(1, len(seeds) // (4 * (max_workers or os.cpu_count() or 1)))
+        for grid_bytes, level_metadata in executor.map(generate_dataset_entry, [lvlargs] * len(seeds), seeds,
+                                                       chunksize=chunksize):
+            if len(grid_bytes) != grid_size:
+                raise ValueError(f"Seed {level_metadata['seed']} generated a level of the wrong size")
+            f.write(grid_bytes)
+            metadata.append(level_metadata)
+
+        metadata_bytes = json.dumps({"lvlargs": lvlargs, "levels": metadata}, separators=(",", ":")).encode()
+        metadata_offset = f.tell()
+        f.write(metadata_bytes)
+        f.seek(0)
+        f.write(_PROLOGUE_STRUCT.pack(DATASET_MAGIC, DATASET_VERSION, len(seeds), width, height,
+                                      GRID_ALIGNMENT, metadata_offset, len(metadata_bytes)))
+
+    return time.perf_counter() - tic
+
+
+class MapDataset:
+    """Read-only access to a dataset file written by write_dataset. Grids are memory-mapped, not read up front"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            magic, version, count, width, height, grid_offset, metadata_offset, metadata_len = \
+                _PROLOGUE_STRUCT.unpack(f.read(_PROLOGUE_STRUCT.size))
+            if magic != DATASET_MAGIC or version != DATASET_VERSION:
+                raise ValueError(f"{path} is not a map dataset (magic {magic!r}, version {version})")
+            f.seek(metadata_offset)
+            metadata = json.loads(f.read(metadata_len))
+
+        self.path = path
+        self.width = width
+        self.height = height
+        self.lvlargs: dict = metadata["lvlargs"]
+        self.levels: list[dict] = metadata["levels"]
+        self.grids = np.memmap(path, dtype=np.uint8, mode="r", offset=grid_offset, shape=(count, width, height))
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def get_blueprint(self, index: int) -> LevelBlueprint:
+        """Returns the blueprint of the level at index, with its grid copied out of the file"""
+        meta = self.levels[index]
+        return LevelBlueprint(grid=np.array(self.grids[index]),
+                              player_start_pos=Point(*meta["player_start_pos"]),
+                              stairs_up_pos=Point(*meta["stairs_up_pos"]),
+                              stairs_down_pos=Point(*meta["stairs_down_pos"]),
+                              monsters=[generate_monster(name, Point(x, y)) for name, x, y in meta["monsters"]],
+                              rooms=[Room(Point(x1, y1), Point(x2, y2)) for x1, y1, x2, y2 in meta["rooms"]])
+
+    def load_level(self, index: int) -> LevelData:
+        """Returns the level at index as a fresh LevelData"""
+        return self.get_blueprint(index).to_level_data()
+
+
+def parse_seed_range(seed_range: str) -> list[int]:
+    """Turns "start:stop" (stop exclusive) or a single seed into a list of seeds"""
+    if ":" in seed_range:
+        start, stop = seed_range.split(":")
+        return list(range(int(start), int(stop)))
+    return [int(seed_range)]
+
+
+def parse_lvlargs(lvlarg_strings: list[str]) -> dict:
+    """Applies key=value overrides (values parsed as JSON where possible) on top of DEFAULT_LVLARGS"""
+    lvlargs = dict(DEFAULT_LVLARGS)
+    for lvlarg in lvlarg_strings:
+        key, value = lvlarg.split("=", 1)
+        try:
+            lvlargs[key] = json.loads(value)
+        except json.JSONDecodeError:
+            lvlargs[key] = value
+    return lvlargs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a seeded batch of levels into one map dataset file")
+    parser.add_argument("path", help="dataset file to write")
+    parser.add_argument("--seeds", default="0:100", help="seed range as start:stop (stop exclusive), or one seed")
+    parser.add_argument("--lvlarg", action="append", default=[], metavar="KEY=VALUE",
+                        help="generation kwarg to override, e.g. --lvlarg generation_type=3 (repeatable)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    lvlargs = parse_lvlargs(args.lvlarg)
+    if lvlargs["generation_type"] == 2:
+        parser.error("the chunked overworld (generation_type 2) has no fixed size, so it can't go in a dataset")
+    if lvlargs["generation_type"] not in BLUEPRINT_GENERATION_TYPES:
+        parser.error(f"generation_type {lvlargs['generation_type']} can't be generated into a dataset, only "
+                     f"{' or '.join(map(str, BLUEPRINT_GENERATION_TYPES))} can")
+    seeds = parse_seed_range(args.seeds)
+
+    seconds = write_dataset(args.path, lvlargs, seeds, args.workers)
+    print(f"Wrote {len(seeds)} levels to {args.path} ({os.path.getsize(args.path)} bytes) in {seconds:0.2f}s")
+
+
+if __name__ == '__main__':
+    main()
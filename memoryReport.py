@@ -0,0 +1,169 @@
+import enum
+import logging
+import sys
+import tracemalloc
+import types
+from collections import deque
+from dataclasses import dataclass
+
+from autoTravel import TravelManager
+from dungeon import DungeonManager
+from levelData import LevelData
+from profiler import Profiler
+from screenDrawing import TopMessage, _color_escapes
+
+TRACEMALLOC_FRAMES = 5  # How much of the stack tracemalloc keeps per allocation
+TOP_ALLOCATION_DIFFS = 10
+
+# Shared, effectively permanent objects that shouldn't be charged to whatever happens to point at them
+_SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, enum.Enum)
+
+
+def deep_sizeof(obj, seen: set[int] | None = None) -> int:
+    """Returns the sys.getsizeof of obj plus everything it holds onto, counting each object once
+        Pass the same seen set to several calls to avoid counting anything they share twice"""
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SKIP_TYPES):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        elif not isinstance(o, (str, bytes, bytearray, int, float, bool)):
+            if hasattr(o, "__dict__"):
+                stack.append(vars(o))
+            for cls in type(o).__mro__:
+                for slot in getattr(cls, "__slots__", ()):
+                    if hasattr(o, slot):
+                        stack.append(getattr(o, slot))
+    return total
+
+
+def _tile_containers(level_data: LevelData) -> list:
+    """What actually holds the level's Tiles - the dict itself, or the loaded chunks of a chunked level"""
+    hot_chunks = getattr(level_data.tiles, "_hot_chunks", None)
+    return [level_data.tiles] if hot_chunks is None else [hot_chunks]
+
+
+def memory_by_category(level_data: LevelData) -> dict[str, int]:
+    """Returns roughly how many bytes each part of the game is holding onto
+        Tiles are counted first, so anything shared with them (like Point keys) is charged to tiles"""
+    seen: set[int] = set()
+    categories = {"tiles": deep_sizeof(_tile_containers(level_data), seen),
+                  "entities": deep_sizeof([level_data.player, level_data.monsters, level_data.floor_items,
+                                           level_data.floor_effects, level_data.interactables], seen),
+                  "vfx": deep_sizeof(level_data.vfx, seen),
+                  # Pack blackboards and the scent grid
+                  "monster ai": deep_sizeof(level_data.packs, seen) + deep_sizeof(level_data.scent, seen),
+                  "messages": deep_sizeof(TopMessage.message_buffer, seen),
+                  "cache: minimap": deep_sizeof(level_data.minimap, seen),
+                  # Keyed by terminal, which isn't the cache's to count
+                  "cache: color escapes": sys.getsizeof(_color_escapes) +
+                                          sum(deep_sizeof(escape, seen) for escape in _color_escapes.values()),
+                  "cache: profiler history": deep_sizeof(Profiler._history, seen)}
+
+    plan = TravelManager.get_plan()
+    categories["cache: travel map"] = deep_sizeof(plan.costs, seen) if plan is not None else 0
+
+    dungeon = DungeonManager.get_dungeon()
+    if dungeon is not None:
+        categories["cache: stored floors"] = deep_sizeof(dungeon.visited_levels._in_memory, seen)
+        pending = [future.result() for future in dungeon.pipeline._pending.values() if future.done()]
+        categories["cache: pre-generated floors"] = deep_sizeof(pending, seen)
+    return categories
+
+
+def tile_count(level_data: LevelData) -> int:
+    return sum(len(container) for container in _tile_containers(level_data))
+
+
+def entity_count(level_data: LevelData) -> int:
+    return 1 + len(level_data.monsters) + len(level_data.floor_items) + len(level_data.floor_effects) + \
+        len(level_data.interactables)
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:0.1f}{unit}" if unit != "B" else f"{size:0.0f}B"
+        size /= 1024
+    return f"{size:0.1f}GB"
+
+
+@dataclass
+class MemorySnapshot:
+    label: str  # When it was taken, e.g. "turn 50"
+    categories: dict[str, int]
+    tiles: int
+    entities: int
+    traced: tracemalloc.Snapshot | None  # None unless tracemalloc was running
+
+
+def take_snapshot(level_data: LevelData, label: str) -> MemorySnapshot:
+    traced = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+    return MemorySnapshot(label=label, categories=memory_by_category(level_data), tiles=tile_count(level_data),
+                          entities=entity_count(level_data), traced=traced)
+
+
+def start_tracing():
+    """tracemalloc only sees allocations made after it starts, and slows everything down, so it's opt-in"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+
+def format_report(snapshot: MemorySnapshot) -> list[str]:
+    lines = [f"Memory at {snapshot.label}: {format_bytes(sum(snapshot.categories.values()))} accounted for"]
+    for name, size in snapshot.categories.items():
+        lines.append(f"  {name:<28}{format_bytes(size):>10}")
+    if snapshot.tiles:
+        lines.append(f"  {'per tile':<28}{format_bytes(snapshot.categories['tiles'] / snapshot.tiles):>10}"
+                     f"  ({snapshot.tiles} tiles)")
+    lines.append(f"  {'per entity':<28}{format_bytes(snapshot.categories['entities'] / snapshot.entities):>10}"
+                 f"  ({snapshot.entities} entities)")
+    if snapshot.traced is not None:
+        traced_total = sum(stat.size for stat in snapshot.traced.statistics("filename"))
+        lines.append(f"  {'traced by tracemalloc':<28}{format_bytes(traced_total):>10}")
+    return lines
+
+
+def diff_snapshots(before: MemorySnapshot, after: MemorySnapshot, top: int = TOP_ALLOCATION_DIFFS) -> list[str]:
+    """Lists what grew (or shrank) between two snapshots - per category, then the biggest allocation sites"""
+    lines = [f"Memory change from {before.label} to {after.label}:"]
+    for name, size in after.categories.items():
+        delta = size - before.categories.get(name, 0)
+        if delta != 0:
+            lines.append(f"  {name:<28}{'+' if delta > 0 else '-'}{format_bytes(abs(delta)):>10}")
+    if before.traced is not None and after.traced is not None:
+        lines.append(f"  Biggest allocation changes:")
+        for stat in after.traced.compare_to(before.traced, "lineno")[:top]:
+            lines.append(f"    {stat}")
+    return lines
+
+
+class MemoryTracker:
+    """Static class behind the memory debug key - remembers the last snapshot so the next one can be diffed"""
+    _last_snapshot: MemorySnapshot | None = None
+    _reports: int = 0
+
+    @staticmethod
+    def report(level_data: LevelData) -> list[str]:
+        """The first call starts tracemalloc and reports, later calls report and diff against the previous call"""
+        MemoryTracker._reports += 1
+        start_tracing()
+        snapshot = take_snapshot(level_data, f"report {MemoryTracker._reports}")
+        lines = format_report(snapshot)
+        if MemoryTracker._last_snapshot is not None:
+            lines += diff_snapshots(MemoryTracker._last_snapshot, snapshot)
+        MemoryTracker._last_snapshot = snapshot
+        for line in lines:
+            logging.info(line)
+        return lines
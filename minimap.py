@@ -0,0 +1,185 @@
+import numpy as np
+
+from globalEnums import Point, TermColor
+from levelData import LevelData
+from screenDrawing import Camera, color_escape
+
+# The map shrunk down, a block of tiles to a glyph, for seeing the shape of a big level at a glance. The tiles'
+# has_been_visible and is_blocking_move are copied into arrays once, then only the blocks around wherever the player
+# has looked since the last draw get read back and pooled again
+MINIMAP_BLOCK = 4  # Tiles per glyph (along each side) in the corner panel. The overview uses multiples of it
+MINIMAP_PANEL_SIZE = (32, 10)  # Glyphs shown in the corner panel, not counting its border
+BLOCK_UNEXPLORED, BLOCK_FLOOR, BLOCK_WALL = 0, 1, 2
+BLOCK_GLYPHS = {BLOCK_UNEXPLORED: (" ", None), BLOCK_FLOOR: (".", TermColor.LIGHT_GREY),
+                BLOCK_WALL: ("#", TermColor.MID_GREY)}
+BORDER_COLOR = TermColor.DARK_GREY
+
+
+def pool_blocks(seen: np.ndarray, wall: np.ndarray, block: int) -> np.ndarray:
+    """Shrinks [x, y] grids of has_been_visible and is_blocking_move to a code per block x block tiles: floor if any
+        floor in it has been seen (so corridors don't vanish between walls), wall if only walls have, else unexplored"""
+    pad = ((0, -seen.shape[0] % block), (0, -seen.shape[1] % block))
+    seen, wall = np.pad(seen, pad), np.pad(wall, pad)
+    shape = (seen.shape[0] // block, block, seen.shape[1] // block, block)
+    any_floor = (seen & ~wall).reshape(shape).any(axis=(1, 3))
+    any_wall = (seen & wall).reshape(shape).any(axis=(1, 3))
+    codes = np.full(any_floor.shape, BLOCK_UNEXPLORED, dtype=np.uint8)
+    codes[any_wall] = BLOCK_WALL
+    codes[any_floor] = BLOCK_FLOOR
+    return codes
+
+
+class Minimap:
+    """A level's pooled map, kept per block size
+        Blocks (of MINIMAP_BLOCK tiles) the player may have seen more of are kept in dirty sets: one for reading
+        has_been_visible back from the tiles, and one per block size for pooling again"""
+
+    def __init__(self, level_data: LevelData):
+        self.width, self.height = level_data.width, level_data.height
+        self.seen = np.zeros((self.width, self.height), dtype=bool)
+        self.wall = np.zeros((self.width, self.height), dtype=bool)
+        for pos, tile in level_data.tiles.items():
+            self.seen[pos.x, pos.y] = tile.has_been_visible
+            self.wall[pos.x, pos.y] = tile.is_blocking_move
+        self._unread: set[tuple[int, int]] = set()
+        self._pooled: dict[int, np.ndarray] = {}
+        self._dirty: dict[int, set[tuple[int, int]]] = {}
+
+    def note_view(self, origin_x: int, origin_y: int, sight_range: int):
+        """Marks the blocks in sight of (origin_x, origin_y) dirty. Called with every FOV refresh, so it's cheap"""
+        bx0, by0 = max(0, origin_x - sight_range) // MINIMAP_BLOCK, max(0, origin_y - sight_range) // MINIMAP_BLOCK
+        bx1 = min(self.width - 1, origin_x + sight_range) // MINIMAP_BLOCK
+        by1 = min(self.height - 1, origin_y + sight_range) // MINIMAP_BLOCK
+        blocks = {(bx, by) for bx in range(bx0, bx1 + 1) for by in range(by0, by1 + 1)}
+        self._unread |= blocks
+        for dirty in self._dirty.values():
+            dirty |= blocks
+
+    def _read_back(self, level_data: LevelData):
+        tiles = level_data.tiles
+        seen = self.seen
+        for bx, by in self._unread:
+            xs = range(bx * MINIMAP_BLOCK, min(self.width, (bx + 1) * MINIMAP_BLOCK))
+            ys = range(by * MINIMAP_BLOCK, min(self.height, (by + 1) * MINIMAP_BLOCK))
+            seen[xs.start:xs.stop, ys.start:ys.stop] = [[tiles[Point(x, y)].has_been_visible for y in ys] for x in xs]
+        self._unread.clear()
+
+    def pooled(self, level_data: LevelData, block: int) -> np.ndarray:
+        """Block codes indexed [x, y], block x block tiles to each. block has to be a multiple of MINIMAP_BLOCK"""
+        self._read_back(level_data)
+        codes = self._pooled.get(block)
+        if codes is None:
+            codes = self._pooled[block] = pool_blocks(self.seen, self.wall, block)
+            self._dirty[block] = set()
+            return codes
+        dirty = self._dirty[block]
+        if dirty:
+            # Pool the box around every dirty block again in one go - they're almost always next to each other
+            scale = block // MINIMAP_BLOCK
+            cx0, cy0 = min(bx for bx, _ in dirty) // scale, min(by for _, by in dirty) // scale
+            cx1, cy1 = max(bx for bx, _ in dirty) // scale + 1, max(by for _, by in dirty) // scale + 1
+            codes[cx0:cx1, cy0:cy1] = pool_blocks(self.seen[cx0 * block:cx1 * block, cy0 * block:cy1 * block],
+                                                  self.wall[cx0 * block:cx1 * block, cy0 * block:cy1 * block], block)
+            dirty.clear()
+        return codes
+
+
+def level_minimap(level_data: LevelData) -> Minimap | None:
+    """Returns level_data's minimap, making it the first time. None for the chunked overworld, which has no fixed set
+        of tiles to make it from"""
+    if level_data.minimap is None and isinstance(level_data.tiles, dict):
+        level_data.minimap = Minimap(level_data)
+    return level_data.minimap
+
+
+class MinimapView:
+    """Which minimap is showing, if either: the corner panel or the full-screen overview"""
+    panel_visible: bool = False
+    overview_visible: bool = False
+
+    @staticmethod
+    def toggle_panel() -> bool:
+        MinimapView.panel_visible = not MinimapView.panel_visible
+        return MinimapView.panel_visible
+
+    @staticmethod
+    def toggle_overview() -> bool:
+        MinimapView.overview_visible = not MinimapView.overview_visible
+        return MinimapView.overview_visible
+
+
+def compose_blocks(term, level_data: LevelData, codes: np.ndarray, block: int, origin: Point, width: int,
+                   height: int, term_x: int, term_y: int) -> str:
+    """The width x height glyphs of codes starting at block origin, drawn at (term_x, term_y), with the player and any
+        seen stairs marked on top"""
+    markers = {}
+    for stairs_pos, char in ((level_data.stairs_up_pos, "<"), (level_data.stairs_down_pos, ">")):
+        if stairs_pos is not None and level_data.tiles[stairs_pos].has_been_visible:
+            markers[(stairs_pos.x // block, stairs_pos.y // block)] = (char, TermColor.WHITE)
+    player = level_data.player
+    markers[(player.pos.x // block, player.pos.y // block)] = (player.display_char, player.display_color)
+
+    out = []
+    for row in range(height):
+        by = origin.y + row
+        cells = []
+        for col in range(width):
+            bx = origin.x + col
+            if (bx, by) in markers:
+                char, color = markers[(bx, by)]
+            elif 0 <= bx < codes.shape[0] and 0 <= by < codes.shape[1]:
+                char, color = BLOCK_GLYPHS[codes[bx, by]]
+            else:
+                char, color = " ", None
+            cells.append(char if color is None else color_escape(term, color) + char + term.normal)
+        out.append(term.move_xy(term_x, term_y + row) + "".join(cells))
+    return "".join(out)
+
+
+def draw_minimap_panel(term, camera: Camera, level_data: LevelData):
+    """Draws the minimap in a bordered panel in the top-right corner of the camera, centered on the player"""
+    minimap = level_minimap(level_data)
+    if minimap is None:
+        return
+    codes = minimap.pooled(level_data, MINIMAP_BLOCK)
+    width = min(MINIMAP_PANEL_SIZE[0], camera.cam_width - 2, codes.shape[0])
+    height = min(MINIMAP_PANEL_SIZE[1], camera.cam_height - 2, codes.shape[1])
+    if width <= 0 or height <= 0:
+        return
+    # Centered on the player, but kept on the map
+    player_pos = level_data.player.pos
+    origin = Point(min(max(0, player_pos.x // MINIMAP_BLOCK - width // 2), codes.shape[0] - width),
+                   min(max(0, player_pos.y // MINIMAP_BLOCK - height // 2), codes.shape[1] - height))
+    term_x = camera.term_origin_x + camera.cam_width - width - 2
+    term_y = camera.term_origin_y
+    border = color_escape(term, BORDER_COLOR)
+    out = [term.move_xy(term_x, term_y) + border + "+" + "-" * width + "+" + term.normal]
+    for row in range(height):
+        out.append(term.move_xy(term_x, term_y + 1 + row) + border + "|" + term.normal)
+        out.append(term.move_xy(term_x + width + 1, term_y + 1 + row) + border + "|" + term.normal)
+    out.append(term.move_xy(term_x, term_y + height + 1) + border + "+" + "-" * width + "+" + term.normal)
+    out.append(compose_blocks(term, level_data, codes, MINIMAP_BLOCK, origin, width, height, term_x + 1, term_y + 1))
+    print("".join(out), end="", flush=True, file=term.stream)
+
+
+def overview_block(level_data: LevelData, camera: Camera) -> int:
+    """The smallest multiple of MINIMAP_BLOCK that fits the whole level in the camera"""
+    scale = max(1, -(-level_data.width // (camera.cam_width * MINIMAP_BLOCK)),
+                -(-level_data.height // (camera.cam_height * MINIMAP_BLOCK)))
+    return scale * MINIMAP_BLOCK
+
+
+def draw_overview(term, camera: Camera, level_data: LevelData) -> bool:
+    """Draws the whole level, shrunk to fit, over the entire camera view. Returns False if there's no minimap of
+        this level (the chunked overworld), having drawn nothing"""
+    minimap = level_minimap(level_data)
+    if minimap is None:
+        return False
+    block = overview_block(level_data, camera)
+    codes = minimap.pooled(level_data, block)
+    # Centered in the camera (so the origin is negative if the map is smaller than the camera)
+    origin = Point((codes.shape[0] - camera.cam_width) // 2, (codes.shape[1] - camera.cam_height) // 2)
+    frame = compose_blocks(term, level_data, codes, block, origin, camera.cam_width, camera.cam_height,
+                           camera.term_origin_x, camera.term_origin_y)
+    print(frame, end="", flush=True, file=term.stream)
+    return True
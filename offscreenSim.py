@@ -0,0 +1,135 @@
+import math
+import random
+import time
+from dataclasses import dataclass
+
+from globalEnums import Point
+from levelData import LevelData
+from levelStorage import LevelStore
+from profiler import Profiler, SPAN_OFFSCREEN
+
+# Floors the player has left keep going, just not in any detail. Instead of running every monster's update every
+# turn, each stored floor is moved on in one coarse step every so often (and once more when the player comes back),
+# by however many turns it's behind. A step is a handful of cheap rules per monster - heal a bit, wander a bit - with
+# no pathfinding, so it costs the same whether a floor is 5 turns behind or 500
+OFFSCREEN_INTERVAL = 25  # Turns between coarse steps of the floors in memory
+OFFSCREEN_MONSTER_BUDGET = 500  # Most monsters a coarse step moves on. Floors past it wait for the next step
+REGEN_PER_TURN = 0.05  # Health a monster gets back per turn nobody's fighting it
+WANDER_RADIUS = 8  # Furthest a monster ends up from where it was, however long it's been
+WANDER_TRIES = 4  # Spots a wandering monster tries before staying put
+
+
+@dataclass
+class OffscreenSettings:
+    """How much off-screen simulation happens, and so how much it costs"""
+    interval: int = OFFSCREEN_INTERVAL
+    monster_budget: int = OFFSCREEN_MONSTER_BUDGET
+    regen_per_turn: float = REGEN_PER_TURN
+    wander_radius: int = WANDER_RADIUS
+
+
+@dataclass
+class OffscreenStats:
+    steps: int = 0  # Coarse steps, counting catch-ups
+    floors: int = 0  # Floors moved on, over all the steps
+    monsters: int = 0
+    turns: int = 0  # Turns simulated, summed over the floors
+    seconds: float = 0.0
+
+    def summary(self) -> str:
+        per_step = self.seconds / self.steps * 1000 if self.steps else 0.0
+        return (f"{self.steps} steps, {self.floors} floors, {self.monsters} monsters, {self.turns} floor-turns "
+                f"simulated in {self.seconds * 1000:0.2f}ms ({per_step:0.3f}ms per step)")
+
+
+class OffscreenSimulator:
+    """Moves the floors the player isn't on forward in coarse steps
+        synced holds, by depth, the dungeon turn each stored floor has been simulated up to"""
+
+    def __init__(self, settings: OffscreenSettings | None = None, seed: int = 0):
+        self.settings = settings if settings is not None else OffscreenSettings()
+        self.seed = seed
+        self.synced: dict[int, int] = {}
+        self.stats = OffscreenStats()
+
+    def left(self, depth: int, turn: int):
+        """The player just left the floor at depth"""
+        self.synced[depth] = turn
+
+    def catch_up(self, depth: int, level_data: LevelData, turn: int):
+        """The player is back on the floor at depth, so do everything it's still behind by in one step"""
+        # A floor that was never left (or was stored by a save that's since been loaded) is taken as up to date
+        behind = turn - self.synced.pop(depth, turn)
+        if behind > 0:
+            with Profiler.span(SPAN_OFFSCREEN):
+                tic = time.perf_counter()
+                self.advance(depth, level_data, behind, turn)
+                self.stats.steps += 1
+                self.stats.seconds += time.perf_counter() - tic
+
+    def end_turn(self, store: LevelStore, turn: int):
+        """Called after every player turn. Steps the stored floors that are in memory every interval turns
+            Floors paged out to disk are left alone (reading them in would cost more than simulating them), and catch
+            up when the player comes back instead"""
+        if turn % self.settings.interval != 0:
+            return
+        stored_floors = store.in_memory()
+        if not stored_floors:
+            return
+        with Profiler.span(SPAN_OFFSCREEN):
+            tic = time.perf_counter()
+            # The floors change in place, so anything caching them (like the autosaver) has to be told
+            for depth in self.step(stored_floors, turn):
+                store.touch(depth)
+            self.stats.steps += 1
+            self.stats.seconds += time.perf_counter() - tic
+
+    def step(self, stored_floors: list[tuple[int, LevelData]], turn: int) -> list[int]:
+        """Moves on the floors furthest behind first, until the monster budget runs out (always at least one floor)
+            Returns the depths of the floors it moved on"""
+        for depth, _ in stored_floors:
+            self.synced.setdefault(depth, turn)
+        budget = self.settings.monster_budget
+        advanced = []
+        for depth, level_data in sorted(stored_floors, key=lambda item: (self.synced[item[0]], item[0])):
+            behind = turn - self.synced[depth]
+            if behind <= 0:
+                continue
+            if len(level_data.monsters) > budget and budget < self.settings.monster_budget:
+                break
+            self.advance(depth, level_data, behind, turn)
+            self.synced[depth] = turn
+            budget -= len(level_data.monsters)
+            advanced.append(depth)
+        return advanced
+
+    def advance(self, depth: int, level_data: LevelData, turns: int, turn: int):
+        """Moves level_data on by turns turns: monsters heal and wander, and the floor's memories and scent fade"""
+        settings = self.settings
+        # Seeded from where and when, so the same game always plays out the same, and the main random stream (which
+        # replays depend on) isn't touched
+        rng = random.Random((self.seed * 1_000_003 + depth) * 1_000_003 + turn)
+        level_data.turns += turns
+        if level_data.scent is not None:
+            level_data.scent.fade(turns)
+
+        tiles = level_data.tiles
+        occupied = {m.pos for m in level_data.monsters}
+        # A random walk of n steps ends up about sqrt(n) from where it started
+        radius = min(settings.wander_radius, math.isqrt(turns))
+        for monster in level_data.monsters:
+            if monster.health < monster.health_max:
+                monster.health = min(monster.health_max, monster.health + settings.regen_per_turn * turns)
+            if radius == 0:
+                continue
+            for _ in range(WANDER_TRIES):
+                pos = Point(monster.pos.x + rng.randint(-radius, radius), monster.pos.y + rng.randint(-radius, radius))
+                if pos in tiles and not tiles[pos].is_blocking_move and pos not in occupied:
+                    occupied.discard(monster.pos)
+                    occupied.add(pos)
+                    monster.pos = pos
+                    break
+
+        self.stats.floors += 1
+        self.stats.monsters += len(level_data.monsters)
+        self.stats.turns += turns
@@ -0,0 +1,132 @@
+import functools
+import json
+import logging
+import time
+from collections import deque
+
+# Span names used around the game loop. Anything else works too, these are just the ones that always show up
+SPAN_FOV = "fov"
+SPAN_AI = "ai"
+SPAN_PATHFINDING = "pathfinding"
+SPAN_COMPOSE = "compose"
+SPAN_TERMINAL_WRITE = "terminal write"
+SPAN_INPUT_WAIT = "input wait"
+SPAN_OFFSCREEN = "offscreen"
+SPAN_ANIMATION = "animation"
+
+ROLLING_WINDOW = 1000  # How many frames the percentiles are worked out over
+
+
+class _Span:
+    """Times one block of code and adds it to the current frame's total for name"""
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        frame = Profiler.current_frame
+        frame[self.name] = frame.get(self.name, 0.0) + elapsed
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """Static class that adds up how long each named span takes per frame, and keeps the last ROLLING_WINDOW frames
+        of each for percentiles. Spans can nest (pathfinding happens inside ai) and each one counts its full time"""
+    enabled: bool = True
+    overlay_visible: bool = False
+    current_frame: dict[str, float] = {}
+    last_frame: dict[str, float] = {}
+    last_frame_total: float = 0.0
+    frame_count: int = 0
+    _frame_start: float = time.perf_counter()
+    _history: dict[str, deque] = {}
+
+    @staticmethod
+    def span(name: str):
+        """Use as `with Profiler.span(SPAN_FOV):`"""
+        if not Profiler.enabled:
+            return _NULL_SPAN
+        return _Span(name)
+
+    @staticmethod
+    def end_frame():
+        """Closes off the current frame, rolling its span totals into the history"""
+        now = time.perf_counter()
+        Profiler.last_frame = Profiler.current_frame
+        Profiler.last_frame_total = now - Profiler._frame_start
+        Profiler.current_frame = {}
+        Profiler._frame_start = now
+        if not Profiler.last_frame:
+            return
+        Profiler.frame_count += 1
+        for name, seconds in Profiler.last_frame.items():
+            history = Profiler._history.get(name)
+            if history is None:
+                history = Profiler._history[name] = deque(maxlen=ROLLING_WINDOW)
+            history.append(seconds)
+
+    @staticmethod
+    def toggle_overlay():
+        Profiler.overlay_visible = not Profiler.overlay_visible
+
+    @staticmethod
+    def reset():
+        Profiler.current_frame = {}
+        Profiler.last_frame = {}
+        Profiler.last_frame_total = 0.0
+        Profiler.frame_count = 0
+        Profiler._frame_start = time.perf_counter()
+        Profiler._history = {}
+
+    @staticmethod
+    def stats() -> dict[str, dict[str, float]]:
+        """Returns p50/p95/max/mean (in ms) and the sample count of each span over the rolling window
+            Frames a span didn't run in aren't counted for it"""
+        results = {}
+        for name, history in Profiler._history.items():
+            samples = sorted(history)
+            count = len(samples)
+            results[name] = {"count": count,
+                             "p50_ms": samples[int(0.50 * (count - 1))] * 1000,
+                             "p95_ms": samples[int(0.95 * (count - 1))] * 1000,
+                             "max_ms": samples[-1] * 1000,
+                             "mean_ms": sum(samples) / count * 1000}
+        return results
+
+    @staticmethod
+    def export_json(path: str):
+        with open(path, "w") as f:
+            json.dump({"frames": Profiler.frame_count, "window": ROLLING_WINDOW, "spans": Profiler.stats()}, f,
+                      indent=2)
+        logging.debug(f"Wrote profile of {Profiler.frame_count} frames to {path}")
+
+
+def profiled(name: str):
+    """Decorator that runs the whole function inside Profiler.span(name)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Profiler.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
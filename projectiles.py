@@ -0,0 +1,139 @@
+from dataclasses import dataclass, field
+
+from animation import Animations, flight_animation
+from globalEnums import DamageType, Point, TermColor
+from imlaLogging import Trace, ai_log
+from levelData import LevelData
+from lineDrawing import line
+from screenDrawing import VFX
+
+# Projectiles (arrows, bolts, spells) fly along a straight line that's worked out before they move, and stop at the
+# first wall (anything that blocks sight, as with targeting) or the first thing standing in their way. Everything
+# fired in a tick is resolved together against one index of who is standing where, so checking a step is a dict lookup
+# rather than a pass over the monster list
+PROJECTILE_RANGE = 10  # How far a projectile flies (in steps, diagonals counting as one) if nothing stops it
+PROJECTILE_CHAR = "*"
+# Trail characters by the direction of flight, (sign of dx, sign of dy) -> char
+_TRAIL_CHARS = {(0, 0): PROJECTILE_CHAR, (1, 0): "-", (-1, 0): "-", (0, 1): "|", (0, -1): "|",
+                (1, 1): "\\", (-1, -1): "\\", (1, -1): "/", (-1, 1): "/"}
+
+# (dx, dy) -> the offsets of every cell on the line from (0, 0) to (dx, dy), both ends included
+_line_table: dict[tuple[int, int], tuple[tuple[int, int], ...]] = {}
+
+
+def line_offsets(dx: int, dy: int) -> tuple[tuple[int, int], ...]:
+    """The line from (0, 0) to (dx, dy) as offsets. A line is the same wherever it starts on the map, so each one is
+        only rasterized once and then shared by every shot along it"""
+    offsets = _line_table.get((dx, dy))
+    if offsets is None:
+        rr, cc = line(0, 0, dy, dx)
+        offsets = _line_table[(dx, dy)] = tuple(zip(cc, rr))
+    return offsets
+
+
+def trajectory(origin: Point, target: Point, max_range: int = PROJECTILE_RANGE) -> list[Point]:
+    """The cells a projectile fired from origin at target passes through, in order, ending at target or at
+        max_range, whichever comes first. origin itself isn't included"""
+    offsets = line_offsets(target.x - origin.x, target.y - origin.y)
+    return [Point(origin.x + dx, origin.y + dy) for dx, dy in offsets[1:max_range + 1]]
+
+
+@dataclass
+class Projectile:
+    """One thing in flight. owner is whoever fired it, which it flies straight past"""
+    owner: object
+    origin: Point
+    target: Point
+    damage: float
+    damage_type: DamageType = DamageType.PHYSICAL
+    max_range: int = PROJECTILE_RANGE
+    display_char: str = PROJECTILE_CHAR
+    display_color: TermColor = TermColor.WHITE
+    path: list[Point] = field(init=False)
+
+    def __post_init__(self):
+        self.path = trajectory(self.origin, self.target, self.max_range)
+
+
+@dataclass
+class Impact:
+    """Where a projectile stopped, and what (if anything) it hit there"""
+    projectile: Projectile
+    pos: Point
+    hit: object | None = None
+    damage: float = 0.0
+    steps: int = 0  # How far along its path it got
+
+
+def occupancy_index(level_data: LevelData) -> dict[Point, object]:
+    """Who is standing where, for everything a projectile can hit"""
+    occupants: dict[Point, object] = {m.pos: m for m in level_data.monsters}
+    occupants[level_data.player.pos] = level_data.player
+    return occupants
+
+
+def resolve_projectile(projectile: Projectile, level_data: LevelData, occupants: dict[Point, object]) -> Impact:
+    """Steps projectile along its path until a tile blocking sight or an occupant (other than its owner) stops it"""
+    tiles = level_data.tiles
+    stopped_at = projectile.origin
+    for steps, pos in enumerate(projectile.path):
+        if pos not in tiles or tiles[pos].is_blocking_LOS:
+            return Impact(projectile, stopped_at, steps=steps)
+        occupant = occupants.get(pos)
+        if occupant is not None and occupant is not projectile.owner:
+            return Impact(projectile, pos, hit=occupant, steps=steps + 1)
+        stopped_at = pos
+    return Impact(projectile, stopped_at, steps=len(projectile.path))
+
+
+def fire_volley(level_data: LevelData, projectiles: list[Projectile], animate: bool = True) -> list[Impact]:
+    """Resolves everything fired this tick, in order, against a single occupancy index, and deals the damage
+        Anything killed by an earlier projectile is taken out of the index, so later ones fly on past its body
+        With animate, the volley is queued to be played as an animation, or (when animations aren't being played) each
+        flight is added to level_data.vfx as a trail, drawn with the next frame like any other vfx"""
+    occupants = occupancy_index(level_data)
+    impacts = []
+    for projectile in projectiles:
+        impact = resolve_projectile(projectile, level_data, occupants)
+        if impact.hit is not None:
+            impact.damage = impact.hit.take_damage(projectile.damage, projectile.damage_type, level_data)
+            if impact.hit.health <= 0 and occupants.get(impact.pos) is impact.hit:
+                del occupants[impact.pos]
+        if Trace.ai:
+            ai_log.debug(f"Projectile from {projectile.origin} at {projectile.target} stopped at {impact.pos} after "
+                         f"{impact.steps} steps, hitting {getattr(impact.hit, 'name', None)}")
+        if animate and not Animations.enabled:
+            level_data.vfx.extend(trail_vfx(impact))
+        impacts.append(impact)
+    if animate:
+        Animations.add(flight_animation(impacts))
+    return impacts
+
+
+def resolve_pending_projectiles(level_data: LevelData, animate: bool = True) -> list[Impact]:
+    """Fires everything queued up in level_data.projectiles (by monsters, during their turns) as one volley"""
+    if not level_data.projectiles:
+        return []
+    impacts = fire_volley(level_data, level_data.projectiles, animate)
+    level_data.projectiles.clear()
+    return impacts
+
+
+def trail_vfx(impact: Impact) -> list[VFX]:
+    """The cells a projectile flew through, drawn in the direction it flew, with its own char where it stopped"""
+    projectile = impact.projectile
+    if impact.steps == 0:
+        # Fired point blank into a wall
+        return []
+    dx, dy = projectile.target.x - projectile.origin.x, projectile.target.y - projectile.origin.y
+    # Shallow lines still read as horizontal (and steep ones as vertical)
+    if abs(dx) > 2 * abs(dy):
+        dy = 0
+    elif abs(dy) > 2 * abs(dx):
+        dx = 0
+    trail_char = _TRAIL_CHARS[((dx > 0) - (dx < 0), (dy > 0) - (dy < 0))]
+    trail = [VFX(pos=p, display_char=trail_char, display_color=projectile.display_color, is_visible=True)
+             for p in projectile.path[:max(impact.steps - 1, 0)]]
+    trail.append(VFX(pos=impact.pos, display_char=projectile.display_char, display_color=projectile.display_color,
+                     is_visible=True))
+    return trail
@@ -0,0 +1,204 @@
+# Records a game's input so the exact same run can be replayed later, headless and at full speed
+# Record with:  python main.py --record run.imlareplay
+# Replay with:  python replayLog.py run.imlareplay --repeat 3
+# Replays check a hash of the game state after every batch of input against the recording, so a replay that drifts
+# from the original run is caught rather than quietly timing something else
+import argparse
+import hashlib
+import json
+import logging
+import random
+import statistics
+import sys
+import time
+import zlib
+from dataclasses import dataclass, field
+
+from gameTurn import drain_keys
+from keymap import Keymap, key_name
+
+# File layout: magic, then zlib-compressed JSON of the ReplayLog's fields
+REPLAY_MAGIC = b"IMLAREPL"
+REPLAY_VERSION = 1
+SLOWEST_BATCHES_SHOWN = 5
+
+
+class ReplayDesync(Exception):
+    """A replay asked for input the recording doesn't have, or reached a different state than the recording did"""
+
+
+@dataclass
+class ReplayLog:
+    """Everything needed to run a game again: its seeds, settings and every key read from the terminal
+        inputs holds what each inkey() call returned, in order, as key names. A run of n inkey() calls that came
+        back empty (polls for waiting keys) is stored as the int n"""
+    dungeon_seed: int
+    rng_seed: int
+    lvlargs: dict
+    bindings: dict[str, list[str]]
+    coalesce_input: bool
+    interrupt_on_threat: bool
+    inputs: list[str | int] = field(default_factory=list)
+    state_hashes: list[str] = field(default_factory=list)  # After each batch of input
+
+    def add_input(self, name: str):
+        if name:
+            self.inputs.append(name)
+        elif self.inputs and isinstance(self.inputs[-1], int):
+            self.inputs[-1] += 1
+        else:
+            self.inputs.append(1)
+
+    def save(self, path: str):
+        body = json.dumps({"version": REPLAY_VERSION, **self.__dict__}, separators=(",", ":")).encode()
+        with open(path, "wb") as f:
+            f.write(REPLAY_MAGIC + zlib.compress(body))
+
+    @staticmethod
+    def load(path: str) -> "ReplayLog":
+        with open(path, "rb") as f:
+            raw = f.read()
+        if not raw.startswith(REPLAY_MAGIC):
+            raise ValueError(f"{path} is not a replay log")
+        body = json.loads(zlib.decompress(raw[len(REPLAY_MAGIC):]))
+        version = body.pop("version")
+        if version != REPLAY_VERSION:
+            raise ValueError(f"{path} is a version {version} replay log, expected {REPLAY_VERSION}")
+        return ReplayLog(**body)
+
+
+def state_hash(dungeon) -> str:
+    """A short hash of the parts of the game a replay has to reproduce: where everyone is, their health, the turn
+        count and the state of the random module (so every roll is the same too)"""
+    level_data = dungeon.current_level
+    player = level_data.player
+    state = (dungeon.depth, dungeon.turns, tuple(player.pos), player.health, player.action_points,
+             [(m.name, tuple(m.pos), m.health, m.action_points) for m in level_data.monsters],
+             random.getstate())
+    return hashlib.blake2b(repr(state).encode(), digest_size=4).hexdigest()
+
+
+class _TerminalWrapper:
+    """Passes everything through to term except inkey"""
+
+    def __init__(self, term):
+        self._term = term
+
+    def __getattr__(self, name):
+        return getattr(self._term, name)
+
+
+class RecordingInput(_TerminalWrapper):
+    """A terminal whose inkey() also writes each key it returns into a ReplayLog"""
+
+    def __init__(self, term, log: ReplayLog):
+        super().__init__(term)
+        self.log = log
+
+    def inkey(self, *args, **kwargs):
+        key = self._term.inkey(*args, **kwargs)
+        self.log.add_input(key_name(key) if key else "")
+        return key
+
+
+class ReplayInput(_TerminalWrapper):
+    """A terminal whose inkey() returns the keys from a ReplayLog, in order, instead of reading the keyboard"""
+
+    def __init__(self, term, log: ReplayLog):
+        super().__init__(term)
+        self.inputs = iter(log.inputs)
+        self._empty_reads = 0
+
+    def inkey(self, *args, **kwargs) -> str:
+        if self._empty_reads:
+            self._empty_reads -= 1
+            return ""
+        entry = next(self.inputs, None)
+        if entry is None:
+            raise ReplayDesync("The replay read more input than was recorded")
+        if isinstance(entry, int):
+            self._empty_reads = entry - 1
+            return ""
+        return entry
+
+
+@dataclass
+class ReplayResult:
+    batch_seconds: list[float]  # Running then drawing each batch of input
+    batch_keys: list[list[str]]
+    turns: int
+    desync: str | None = None
+
+
+def replay(log: ReplayLog, verify: bool = True) -> ReplayResult:
+    """Runs the recorded game headless, the way main() ran it, timing every batch of input"""
+    # Imported here so recording (from main) doesn't pull in the headless runner
+    from headlessRunner import HeadlessGame
+
+    game = HeadlessGame(log.dungeon_seed, log.lvlargs, keymap=Keymap(log.bindings),
+                        interrupt_on_threat=log.interrupt_on_threat, wrap_term=lambda term: ReplayInput(term, log))
+    random.seed(log.rng_seed)
+    result = ReplayResult(batch_seconds=[], batch_keys=[], turns=0)
+    try:
+        for batch, expected_hash in enumerate(log.state_hashes):
+            keys = [game.term.inkey()]
+            if log.coalesce_input:
+                keys.extend(drain_keys(game.term))
+            tic = time.perf_counter()
+            running = game.press(keys)
+            result.batch_seconds.append(time.perf_counter() - tic)
+            result.batch_keys.append(keys)
+            actual_hash = state_hash(game.dungeon)
+            if verify and actual_hash != expected_hash:
+                result.desync = f"State after batch {batch} ({''.join(keys)!r}) hashed {actual_hash}, " \
+                                f"recording has {expected_hash}"
+                break
+            if not running:
+                break
+    except ReplayDesync as e:
+        result.desync = str(e)
+    result.turns = game.dungeon.turns
+    game.close()
+    return result
+
+
+def format_result(result: ReplayResult, elapsed: float) -> list[str]:
+    times = result.batch_seconds
+    lines = [f"Replayed {len(times)} batches ({result.turns} turns) in {elapsed:0.3f}s"]
+    if times:
+        ordered = sorted(times)
+        lines.append(f"Per batch: {statistics.median(times) * 1000:0.2f}ms median, "
+                     f"{ordered[int(len(ordered) * 0.95)] * 1000:0.2f}ms p95, {ordered[-1] * 1000:0.2f}ms max")
+        slowest = sorted(range(len(times)), key=lambda i: times[i], reverse=True)[:SLOWEST_BATCHES_SHOWN]
+        lines.append("Slowest batches: " + ", ".join(f"#{i} {''.join(result.batch_keys[i])!r} "
+                                                     f"{times[i] * 1000:0.2f}ms" for i in slowest))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a recorded game headless, timing it")
+    parser.add_argument("path", help="replay log written by main.py --record")
+    parser.add_argument("--repeat", type=int, default=1, help="replay this many times and report the best run")
+    parser.add_argument("--no-verify", action="store_true", help="don't check state hashes against the recording")
+    args = parser.parse_args()
+
+    log = ReplayLog.load(args.path)
+    print(f"{args.path}: dungeon seed {log.dungeon_seed}, {len(log.state_hashes)} batches of input")
+    best = None
+    for i in range(args.repeat):
+        tic = time.perf_counter()
+        result = replay(log, verify=not args.no_verify)
+        elapsed = time.perf_counter() - tic
+        if result.desync is not None:
+            print(f"Replay desynced: {result.desync}")
+            sys.exit(1)
+        if best is None or elapsed < best[1]:
+            best = (result, elapsed)
+    print("\n".join(format_result(*best)))
+    if not args.no_verify:
+        print("Every state hash matched the recording")
+
+
+if __name__ == '__main__':
+    logging.disable(logging.DEBUG)
+    main()
@@ -0,0 +1,431 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from dungeon import Dungeon
+from entity import ENTITY_UPDATES, FloorEffect, FloorItem, Interactable, Monster, Player
+from globalEnums import DamageType, ItemType, Point, TermColor
+from levelData import LevelData, PackBlackboard
+from levelGeneration import tile_data_from_grid
+from levelPipeline import LevelPipeline
+from levelStorage import load_optional_point, optional_point, tile_kind, tile_templates
+
+# A save is a directory of:
+#   manifest.json - seed, lvlargs, depth, turn count, the player, and for every floor its size, turn count, tile
+#                   palette, stairs/start positions and the names of the blobs holding its map and entities
+#   blobs/<hash>.bin - zlib-compressed blobs, named by a hash of what's in them. A map blob is one square chunk of a
+#                   floor: its palette-index grid (uint8, indexed [x, y]) then its bit-packed has_been_visible grid.
+#                   An entity blob is a floor's entities (and what its packs know) as JSON records, with update
+#                   functions stored by name
+# Since blobs are named by their contents, an unchanged chunk keeps its name and never needs writing again. The
+# manifest is replaced last (atomically), so a save that dies partway through leaves the previous one loadable
+SAVE_VERSION = 2
+SAVE_CHUNK_SIZE = 32
+AUTOSAVE_INTERVAL = 50  # Player turns between autosaves
+MANIFEST_NAME = "manifest.json"
+BLOB_DIR = "blobs"
+
+
+def _blob_name(raw: bytes) -> str:
+    return hashlib.blake2b(raw, digest_size=12).hexdigest()
+
+
+def _armor_record(armor: dict[DamageType, int]) -> dict[str, int]:
+    return {damage_type.name: amount for damage_type, amount in armor.items()}
+
+
+def _load_armor(record: dict[str, int]) -> dict[DamageType, int]:
+    return {DamageType[name]: amount for name, amount in record.items()}
+
+
+def player_record(player: Player) -> list:
+    return [player.name, list(player.pos), player.display_char, player.display_color.name, player.health_max,
+            player.health, _armor_record(player.armor), player.attack_power, player.xp, player.next_level_xp,
+            player.inventory, player.speed, player.action_points, player.sight_range]
+
+
+def load_player(record: list) -> Player:
+    (name, pos, char, color, health_max, health, armor, attack_power, xp, next_level_xp, inventory, speed,
+     action_points, sight_range) = record
+    return Player(name=name, pos=Point(*pos), display_char=char, display_color=TermColor[color],
+                  health_max=health_max, health=health, armor=_load_armor(armor), attack_power=attack_power,
+                  xp=xp, next_level_xp=next_level_xp, inventory=inventory, speed=speed,
+                  action_points=action_points, sight_range=sight_range)
+
+
+def floor_item_record(item: FloorItem) -> list:
+    # Death drops don't have a position until they're dropped
+    return [item.name, list(item.pos), item.display_char, item.display_color.name, item.is_visible, item.blocks_LOS,
+            item.item_type.name, item.item_amount]
+
+
+def load_floor_item(record: list) -> FloorItem:
+    name, pos, char, color, is_visible, blocks_los, item_type, item_amount = record
+    return FloorItem(name=name, pos=Point(*pos) if None not in pos else tuple(pos), display_char=char,
+                     display_color=TermColor[color], is_visible=is_visible, blocks_LOS=blocks_los,
+                     item_type=ItemType[item_type], item_amount=item_amount)
+
+
+def monster_record(monster: Monster) -> list:
+    drop = monster.on_death_drop
+    return [monster.name, list(monster.pos), monster.display_char, monster.display_color.name, monster.health_max,
+            monster.health, _armor_record(monster.armor), monster.attack_power, monster.sight_range,
+            monster.monster_update.__name__, floor_item_record(drop) if isinstance(drop, FloorItem) else None,
+            monster.is_visible, monster.blocks_LOS, monster.speed, monster.action_points, monster.faction]
+
+
+def load_monster(record: list) -> Monster:
+    (name, pos, char, color, health_max, health, armor, attack_power, sight_range, update, drop, is_visible,
+     blocks_los, speed, action_points, faction) = record
+    return Monster(name=name, pos=Point(*pos), display_char=char, display_color=TermColor[color],
+                   health_max=health_max, health=health, armor=_load_armor(armor), attack_power=attack_power,
+                   sight_range=sight_range, monster_update=ENTITY_UPDATES[update],
+                   on_death_drop=load_floor_item(drop) if drop is not None else None, is_visible=is_visible,
+                   blocks_LOS=blocks_los, speed=speed, action_points=action_points, faction=faction)
+
+
+def floor_effect_record(effect: FloorEffect) -> list:
+    return [effect.name, list(effect.pos), effect.display_char, effect.display_color.name, effect.attack_power,
+            effect.effect_update.__name__, effect.ticks_remaining, effect.is_visible, effect.blocks_LOS]
+
+
+def load_floor_effect(record: list) -> FloorEffect:
+    name, pos, char, color, attack_power, update, ticks_remaining, is_visible, blocks_los = record
+    return FloorEffect(name=name, pos=Point(*pos), display_char=char, display_color=TermColor[color],
+                       attack_power=attack_power, effect_update=ENTITY_UPDATES[update],
+                       ticks_remaining=ticks_remaining, is_visible=is_visible, blocks_LOS=blocks_los)
+
+
+def interactable_record(interactable: Interactable) -> list:
+    return [interactable.name, list(interactable.pos), interactable.display_char, interactable.display_color.name,
+            interactable.interaction_update.__name__, interactable.is_visible, interactable.blocks_LOS]
+
+
+def load_interactable(record: list) -> Interactable:
+    name, pos, char, color, update, is_visible, blocks_los = record
+    return Interactable(name=name, pos=Point(*pos), display_char=char, display_color=TermColor[color],
+                        interaction_update=ENTITY_UPDATES[update], is_visible=is_visible, blocks_LOS=blocks_los)
+
+
+def pack_record(pack: PackBlackboard) -> list:
+    # The path field and occupancy are rebuilt as needed, so only what the pack knows gets saved
+    return [pack.faction, optional_point(pack.last_seen_pos), pack.last_seen_turn]
+
+
+def load_pack(record: list) -> PackBlackboard:
+    faction, last_seen_pos, last_seen_turn = record
+    return PackBlackboard(faction, last_seen_pos=load_optional_point(last_seen_pos), last_seen_turn=last_seen_turn)
+
+
+@dataclass
+class FloorSnapshot:
+    """One floor, copied out into plain bytes/records so it can be written on another thread"""
+    depth: int
+    header: dict
+    chunks: list[bytes]  # Uncompressed map chunks, in the order given by the chunk size
+    entities: bytes  # Uncompressed JSON
+    blob_names: list[str] | None = None  # Filled in (once) by the writer: the chunks, then the entities
+
+
+def snapshot_floor(level_data: LevelData, depth: int, chunk_size: int = SAVE_CHUNK_SIZE) -> FloorSnapshot:
+    """Copies level_data's map and entities into a FloorSnapshot. Has to run between turns, on the game's thread"""
+    if not isinstance(level_data.tiles, dict):
+        raise TypeError("Only floors with a fixed set of tiles can be saved (not the chunked overworld)")
+    width, height = level_data.width, level_data.height
+    palette: dict[tuple, int] = {}
+    kinds, seen = [], []
+    tiles = level_data.tiles
+    for x in range(width):
+        for y in range(height):
+            tile = tiles[Point(x, y)]
+            kinds.append(palette.setdefault(tile_kind(tile), len(palette)))
+            seen.append(tile.has_been_visible)
+    if len(palette) > 256:
+        raise ValueError(f"Level has {len(palette)} distinct tile kinds, but saving supports at most 256")
+    grid = np.array(kinds, dtype=np.uint8).reshape((width, height))
+    seen_grid = np.array(seen, dtype=bool).reshape((width, height))
+
+    chunks = []
+    for chunk_x in range(0, width, chunk_size):
+        for chunk_y in range(0, height, chunk_size):
+            block = np.s_[chunk_x:chunk_x + chunk_size, chunk_y:chunk_y + chunk_size]
+            chunks.append(grid[block].tobytes() + np.packbits(seen_grid[block]).tobytes())
+
+    entities = {"monsters": [monster_record(m) for m in level_data.monsters],
+                "floor_items": [floor_item_record(i) for i in level_data.floor_items],
+                "floor_effects": [floor_effect_record(e) for e in level_data.floor_effects],
+                "interactables": [interactable_record(i) for i in level_data.interactables],
+                "packs": [pack_record(p) for p in level_data.packs.values()]}
+    header = {"depth": depth, "width": width, "height": height, "chunk_size": chunk_size, "turns": level_data.turns,
+              "palette": list(palette.keys()),
+              "player_start_pos": optional_point(level_data.player_start_pos),
+              "stairs_up_pos": optional_point(level_data.stairs_up_pos),
+              "stairs_down_pos": optional_point(level_data.stairs_down_pos)}
+    return FloorSnapshot(depth=depth, header=header, chunks=chunks,
+                         entities=json.dumps(entities, separators=(",", ":")).encode())
+
+
+def load_floor(header: dict, chunks: list[bytes], entities: bytes) -> LevelData:
+    """Rebuilds a LevelData from what snapshot_floor stored. The player is left as None"""
+    width, height, chunk_size = header["width"], header["height"], header["chunk_size"]
+    grid = np.empty((width, height), dtype=np.uint8)
+    seen = np.empty((width, height), dtype=bool)
+    chunk_iter = iter(chunks)
+    for chunk_x in range(0, width, chunk_size):
+        for chunk_y in range(0, height, chunk_size):
+            block = np.s_[chunk_x:chunk_x + chunk_size, chunk_y:chunk_y + chunk_size]
+            shape = grid[block].shape
+            cells = shape[0] * shape[1]
+            raw = next(chunk_iter)
+            grid[block] = np.frombuffer(raw, dtype=np.uint8, count=cells).reshape(shape)
+            seen[block] = np.unpackbits(np.frombuffer(raw, dtype=np.uint8, offset=cells),
+                                        count=cells).reshape(shape).astype(bool)
+
+    tile_data = tile_data_from_grid(grid, tile_templates(header["palette"]))
+    for x, y in zip(*np.nonzero(seen)):
+        tile_data[Point(int(x), int(y))].has_been_visible = True
+
+    records = json.loads(entities)
+    level_data = LevelData(tile_data=tile_data, width=width, height=height,
+                           player_start_pos=load_optional_point(header["player_start_pos"]),
+                           monsters=[load_monster(r) for r in records["monsters"]],
+                           floor_items=[load_floor_item(r) for r in records["floor_items"]],
+                           floor_effects=[load_floor_effect(r) for r in records["floor_effects"]],
+                           interactables=[load_interactable(r) for r in records["interactables"]], vfx=[],
+                           stairs_up_pos=load_optional_point(header["stairs_up_pos"]),
+                           stairs_down_pos=load_optional_point(header["stairs_down_pos"]))
+    level_data.turns = header["turns"]
+    level_data.packs = {pack.faction: pack for pack in map(load_pack, records["packs"])}
+    return level_data
+
+
+@dataclass
+class GameSnapshot:
+    """Everything a save needs, copied out of the game between turns"""
+    state: dict  # Goes straight into the manifest
+    floors: list[FloorSnapshot]
+
+
+@dataclass
+class SaveStats:
+    seconds: float = 0.0
+    blobs_written: int = 0
+    blobs_reused: int = 0
+    bytes_written: int = 0
+    save_size: int = 0  # Bytes on disk for the whole save, once written
+
+
+class SaveWriter:
+    """Writes GameSnapshots into a save directory, skipping any blob that's already there"""
+
+    def __init__(self, save_dir: str):
+        self.save_dir = save_dir
+        self.blob_dir = os.path.join(save_dir, BLOB_DIR)
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._blob_sizes: dict[str, int] = {name.removesuffix(".bin"): os.path.getsize(os.path.join(self.blob_dir, name))
+                                            for name in os.listdir(self.blob_dir)}
+
+    def _put_blob(self, raw: bytes, stats: SaveStats, name: str | None = None) -> str:
+        if name is None:
+            name = _blob_name(raw)
+        if name in self._blob_sizes:
+            stats.blobs_reused += 1
+            return name
+        packed = zlib.compress(raw)
+        with open(os.path.join(self.blob_dir, f"{name}.bin"), "wb") as f:
+            f.write(packed)
+        self._blob_sizes[name] = len(packed)
+        stats.blobs_written += 1
+        stats.bytes_written += len(packed)
+        return name
+
+    def write(self, snapshot: GameSnapshot) -> SaveStats:
+        tic = time.perf_counter()
+        stats = SaveStats()
+        floors = []
+        for floor in snapshot.floors:
+            if floor.blob_names is None:
+                floor.blob_names = [self._put_blob(raw, stats) for raw in floor.chunks + [floor.entities]]
+            else:
+                # Already hashed for an earlier save, so there's no need to hash it again
+                for name, raw in zip(floor.blob_names, floor.chunks + [floor.entities]):
+                    self._put_blob(raw, stats, name)
+            floors.append(dict(floor.header, chunks=floor.blob_names[:-1], entities=floor.blob_names[-1]))
+
+        manifest = dict(snapshot.state, version=SAVE_VERSION, floors=floors)
+        manifest_path = os.path.join(self.save_dir, MANIFEST_NAME)
+        manifest_bytes = json.dumps(manifest, separators=(",", ":")).encode()
+        with open(manifest_path + ".tmp", "wb") as f:
+            f.write(manifest_bytes)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        stats.bytes_written += len(manifest_bytes)
+
+        # Now the new manifest is in place, nothing refers to blobs left over from older saves
+        in_use = {name for floor in floors for name in floor["chunks"] + [floor["entities"]]}
+        for name in set(self._blob_sizes) - in_use:
+            os.remove(os.path.join(self.blob_dir, f"{name}.bin"))
+            del self._blob_sizes[name]
+
+        stats.save_size = len(manifest_bytes) + sum(self._blob_sizes.values())
+        stats.seconds = time.perf_counter() - tic
+        return stats
+
+
+@dataclass
+class LoadedGame:
+    seed: int
+    lvlargs: dict
+    depth: int
+    turns: int
+    player: Player
+    floors: dict[int, LevelData] = field(default_factory=dict)
+    seconds: float = 0.0
+    save_size: int = 0
+
+
+def save_exists(save_dir: str) -> bool:
+    return os.path.exists(os.path.join(save_dir, MANIFEST_NAME))
+
+
+def load_game(save_dir: str) -> LoadedGame:
+    """Reads the save in save_dir back into a LoadedGame, timing it"""
+    tic = time.perf_counter()
+    manifest_path = os.path.join(save_dir, MANIFEST_NAME)
+    with open(manifest_path, "rb") as f:
+        manifest_bytes = f.read()
+    manifest = json.loads(manifest_bytes)
+    if manifest.get("version") != SAVE_VERSION:
+        raise ValueError(f"{save_dir} holds a version {manifest.get('version')} save, expected {SAVE_VERSION}")
+    save_size = len(manifest_bytes)
+
+    def read_blob(name: str) -> bytes:
+        nonlocal save_size
+        with open(os.path.join(save_dir, BLOB_DIR, f"{name}.bin"), "rb") as blob_file:
+            packed = blob_file.read()
+        save_size += len(packed)
+        return zlib.decompress(packed)
+
+    loaded = LoadedGame(seed=manifest["seed"], lvlargs=manifest["lvlargs"], depth=manifest["depth"],
+                        turns=manifest["turns"], player=load_player(manifest["player"]))
+    for header in manifest["floors"]:
+        loaded.floors[header["depth"]] = load_floor(header, [read_blob(name) for name in header["chunks"]],
+                                                    read_blob(header["entities"]))
+    loaded.seconds = time.perf_counter() - tic
+    loaded.save_size = save_size
+    return loaded
+
+
+def restore_dungeon(loaded: LoadedGame, pipeline: LevelPipeline) -> Dungeon:
+    """Builds a Dungeon where the LoadedGame left off, with the player on their floor"""
+    dungeon = Dungeon(pipeline)
+    for depth, level_data in loaded.floors.items():
+        if depth != loaded.depth:
+            dungeon.visited_levels.put(depth, level_data)
+    dungeon.depth = loaded.depth
+    dungeon.turns = loaded.turns
+    dungeon.current_level = loaded.floors[loaded.depth]
+    dungeon.current_level.player = loaded.player
+    pipeline.prefetch_below(loaded.depth)
+    return dungeon
+
+
+class Autosaver:
+    """Saves the game into save_dir, writing on a background thread
+        The snapshot is taken on the game's thread between turns, which only copies the map and entities out.
+        Hashing, compressing and writing happen on the thread, and only chunks that changed get written.
+        Floors the player isn't on are only snapshotted again when their LevelStore version changes: when they're
+        stored again, or when the off-screen simulation moves them on"""
+
+    def __init__(self, save_dir: str, interval: int = AUTOSAVE_INTERVAL):
+        self.save_dir = save_dir
+        self.interval = interval
+        self.last_stats: SaveStats | None = None
+        self._writer = SaveWriter(save_dir)
+        self._stored_floors: dict[int, tuple[int, FloorSnapshot]] = {}  # depth -> (LevelStore version, snapshot)
+        self._last_save_turn: int | None = None
+        self._pending: GameSnapshot | None = None
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="autosave", daemon=True)
+        self._thread.start()
+
+    def snapshot(self, dungeon: Dungeon) -> GameSnapshot:
+        """Copies out everything the save needs. Has to run between turns, on the game's thread"""
+        pipeline = dungeon.pipeline
+        state = {"seed": pipeline.base_seed, "lvlargs": pipeline.lvlargs, "depth": dungeon.depth,
+                 "turns": dungeon.turns, "player": player_record(dungeon.current_level.player)}
+        floors = [snapshot_floor(dungeon.current_level, dungeon.depth)]
+
+        store = dungeon.visited_levels
+        stored_floors = {}
+        for depth in store.keys():
+            version = store.version(depth)
+            cached = self._stored_floors.get(depth)
+            if cached is None or cached[0] != version:
+                cached = (version, snapshot_floor(store.peek(depth), depth))
+            stored_floors[depth] = cached
+            floors.append(cached[1])
+        self._stored_floors = stored_floors
+        return GameSnapshot(state=state, floors=floors)
+
+    def maybe_save(self, dungeon: Dungeon):
+        """Starts a background save if it's been interval turns since the last one"""
+        if self._last_save_turn is None:
+            self._last_save_turn = dungeon.turns
+        if dungeon.turns - self._last_save_turn >= self.interval:
+            self.save_in_background(dungeon)
+
+    def save_in_background(self, dungeon: Dungeon):
+        snapshot = self.snapshot(dungeon)
+        self._last_save_turn = dungeon.turns
+        with self._condition:
+            # If the last save hasn't been written yet, this one replaces it
+            self._pending = snapshot
+            self._condition.notify()
+
+    def save_now(self, dungeon: Dungeon) -> SaveStats:
+        """Saves and waits for it to be written"""
+        self.save_in_background(dungeon)
+        self.wait()
+        return self.last_stats
+
+    def wait(self):
+        """Waits for any save that's been started to finish writing"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending is None and not self._busy)
+
+    def close(self):
+        self.wait()
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._closed)
+                if self._pending is None:
+                    return
+                snapshot, self._pending = self._pending, None
+                self._busy = True
+            try:
+                self.last_stats = self._writer.write(snapshot)
+                logging.debug(f"Saved turn {snapshot.state['turns']} to {self.save_dir} in "
+                              f"{self.last_stats.seconds * 1000:0.1f}ms: {self.last_stats.blobs_written} blobs "
+                              f"written, {self.last_stats.blobs_reused} unchanged, "
+                              f"{self.last_stats.save_size / 1024:0.1f}KB on disk")
+            except OSError:
+                logging.exception(f"Saving to {self.save_dir} failed")
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
@@ -0,0 +1,145 @@
+import numpy as np
+
+from globalEnums import Point, TermColor
+from levelData import LevelData
+from screenDrawing import VFX
+
+# The player leaves scent on every tile they stand on, which then spreads out and fades a little every turn. Monsters
+# that can't see the player follow it by stepping to whichever neighbour smells strongest - no searching needed, so it
+# costs the same however many of them are tracking
+# Scent spreads as the strongest neighbour's scent, weakened by SCENT_SPREAD, rather than by averaging neighbours
+# together. Averaging pools scent in rooms, which leaves bumps (like corridor mouths) that trackers get stuck on.
+# With SCENT_SPREAD below SCENT_DECAY, spread scent can never outweigh the trail itself, so the trail always gets
+# stronger towards the player, and scent off the trail always gets stronger towards the trail
+SCENT_DEPOSIT = 1.0  # What the player's tile is topped up to each turn
+SCENT_DECAY = 0.9  # Fraction of the scent left after a turn
+SCENT_SPREAD = 0.7  # Fraction of a tile's scent its neighbours pick up each turn. Has to be less than SCENT_DECAY
+SCENT_MIN = 0.001  # Anything fainter than this is gone
+# Intensity thresholds (highest first) -> color, for the debug overlay
+SCENT_OVERLAY_COLORS = [(0.5, TermColor.RED), (0.2, TermColor.ORANGE), (0.05, TermColor.YELLOW),
+                        (0.0, TermColor.DARK_OLIVE)]
+# The 8 neighbours as (dx, dy)
+_NEIGHBOUR_OFFSETS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+
+class ScentMap:
+    """Scent strength for every tile of a level, as a float grid indexed [x, y]. Walls never hold any"""
+
+    def __init__(self, passable: np.ndarray):
+        self.passable = passable
+        self.width, self.height = passable.shape
+        self.grid = np.zeros(passable.shape, dtype=np.float32)
+        # The box (x0, y0, x1, y1, exclusive) that holds all of the scent. Only that (plus a tile around it, for the
+        # scent to spread into) gets updated, since on a big level the player has only been through a small part
+        self.bounds: tuple[int, int, int, int] | None = None
+
+    @staticmethod
+    def for_level(level_data: LevelData) -> "ScentMap":
+        passable = np.zeros((level_data.width, level_data.height), dtype=bool)
+        for pos, tile in level_data.tiles.items():
+            passable[pos.x, pos.y] = not tile.is_blocking_move
+        return ScentMap(passable)
+
+    def deposit(self, pos: Point, amount: float = SCENT_DEPOSIT):
+        self.grid[pos.x, pos.y] = max(self.grid[pos.x, pos.y], amount)
+        if self.bounds is None:
+            self.bounds = (pos.x, pos.y, pos.x + 1, pos.y + 1)
+        else:
+            x0, y0, x1, y1 = self.bounds
+            self.bounds = (min(x0, pos.x), min(y0, pos.y), max(x1, pos.x + 1), max(y1, pos.y + 1))
+
+    def update(self):
+        """One turn of spreading and fading"""
+        if self.bounds is None:
+            return
+        x0, y0, x1, y1 = self.bounds
+        # Grow the box by the tile the scent can spread into, and by one more so the neighbours of its edge are there
+        # to read (they're outside the box, so they're empty)
+        x0, y0, x1, y1 = max(0, x0 - 1), max(0, y0 - 1), min(self.width, x1 + 1), min(self.height, y1 + 1)
+        window = self.grid[x0:x1, y0:y1]
+        padded = np.pad(window, 1)
+        w, h = window.shape
+        strongest = np.zeros_like(window)
+        for dx, dy in _NEIGHBOUR_OFFSETS:
+            np.maximum(strongest, padded[1 + dx:1 + dx + w, 1 + dy:1 + dy + h], out=strongest)
+        spread = np.maximum(window, strongest * SCENT_SPREAD)
+        spread *= SCENT_DECAY
+        spread[(spread < SCENT_MIN) | ~self.passable[x0:x1, y0:y1]] = 0
+        self.grid[x0:x1, y0:y1] = spread
+
+        xs, ys = np.nonzero(spread)
+        if len(xs) == 0:
+            self.bounds = None
+        else:
+            self.bounds = (x0 + int(xs.min()), y0 + int(ys.min()), x0 + int(xs.max()) + 1, y0 + int(ys.max()) + 1)
+
+    def fade(self, turns: int):
+        """turns' worth of fading all at once, without the spreading. For floors the player isn't on"""
+        if self.bounds is None:
+            return
+        self.grid *= SCENT_DECAY ** turns
+        self.grid[self.grid < SCENT_MIN] = 0
+        if not self.grid.any():
+            self.bounds = None
+
+    def strength(self, pos: Point) -> float:
+        if 0 <= pos.x < self.width and 0 <= pos.y < self.height:
+            return float(self.grid[pos.x, pos.y])
+        return 0.0
+
+    def uphill_step(self, pos: Point, occupied: set[Point] | None = None) -> Point | None:
+        """Returns the free neighbour of pos that smells strongest, if it smells stronger than pos itself"""
+        best_pos, best = None, self.strength(pos)
+        for dx, dy in _NEIGHBOUR_OFFSETS:
+            next_pos = Point(pos.x + dx, pos.y + dy)
+            scent = self.strength(next_pos)
+            if scent > best and (occupied is None or next_pos not in occupied):
+                best_pos, best = next_pos, scent
+        return best_pos
+
+
+def level_scent(level_data: LevelData) -> ScentMap | None:
+    """Returns level_data's scent map, making it the first time. None for the chunked overworld, which has no fixed
+        set of tiles to make it from"""
+    if level_data.scent is None and isinstance(level_data.tiles, dict):
+        level_data.scent = ScentMap.for_level(level_data)
+    return level_data.scent
+
+
+def lay_player_scent(level_data: LevelData):
+    """The player's part of a turn: leave scent where they're standing, then let all of it spread and fade"""
+    scent = level_scent(level_data)
+    if scent is not None:
+        scent.deposit(level_data.player.pos)
+        scent.update()
+
+
+class ScentOverlay:
+    """Debug overlay (F8) showing scent strength on top of the map"""
+    visible: bool = False
+
+    @staticmethod
+    def toggle() -> bool:
+        ScentOverlay.visible = not ScentOverlay.visible
+        return ScentOverlay.visible
+
+
+def scent_overlay(level_data: LevelData) -> dict[Point, VFX]:
+    """The tiles with scent on them, colored by how strong it is. Tiles with something standing on them are left
+        alone, so the overlay doesn't hide what's being tracked"""
+    scent = level_data.scent
+    if scent is None or scent.bounds is None:
+        return {}
+    taken = {m.pos for m in level_data.monsters}
+    taken.add(level_data.player.pos)
+    overlay = {}
+    x0, y0, x1, y1 = scent.bounds
+    for x, y in zip(*np.nonzero(scent.grid[x0:x1, y0:y1])):
+        pos = Point(x0 + int(x), y0 + int(y))
+        if pos in taken:
+            continue
+        strength = scent.grid[pos.x, pos.y]
+        color = next(color for threshold, color in SCENT_OVERLAY_COLORS if strength > threshold)
+        overlay[pos] = VFX(pos=pos, display_char=level_data.tiles[pos].floor_char, display_color=color,
+                           is_visible=True)
+    return overlay
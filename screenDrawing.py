@@ -4,12 +4,12 @@ import textwrap
 from dataclasses import dataclass
 
 from blessed.terminal import Terminal
-from skimage.draw import line
+from lineDrawing import line
 
 from globalEnums import Entity, Point, TermColor
+from imlaLogging import Trace, drawing_log
 from levelData import LevelData
-
-logging.basicConfig(filename='Imladebug.log', filemode='w', level=logging.DEBUG)
+from profiler import Profiler, SPAN_COMPOSE, SPAN_TERMINAL_WRITE
 
 
 @dataclass()
@@ -57,6 +57,10 @@ class Camera:
     def draw_camera(self, level_data: LevelData):
         draw_camera(self.term, self.cam_origin_x, self.cam_origin_y, self.cam_width, self.cam_height, self.term_origin_x, self.term_origin_y, level_data)
 
+    def draw_cells(self, level_data: LevelData, points, overlay: dict[Point, VFX] | None = None):
+        draw_cells(self.term, self.cam_origin_x, self.cam_origin_y, self.cam_width, self.cam_height,
+                   self.term_origin_x, self.term_origin_y, level_data, points, overlay)
+
     def draw_list_of_entities(self, entities: list[Entity]):
         draw_list_of_entities(entities, self.term, self.cam_origin_x, self.cam_origin_y, self.term_origin_x, self.term_origin_y)
 
@@ -82,10 +86,11 @@ class WindowManager:
 def draw_border(_term, origin_x, origin_y, box_width, box_height, border_char):
     """Draws a hollow box."""
     # draw a box from the top left corner
-    print(_term.move_xy(origin_x, origin_y) + border_char * box_width)
+    print(_term.move_xy(origin_x, origin_y) + border_char * box_width, file=_term.stream)
     for i in range(origin_y + 1, box_height - 1):
-        print(_term.move_xy(origin_x, i) + border_char + _term.move_xy(box_width - 1, i) + border_char)
-    print(border_char * box_width + _term.home)  # Adding the term.home avoids corner/scrolling issues
+        print(_term.move_xy(origin_x, i) + border_char + _term.move_xy(box_width - 1, i) + border_char,
+              file=_term.stream)
+    print(border_char * box_width + _term.home, file=_term.stream)  # Adding the term.home avoids corner/scrolling issues
 
 
 def entities_in_frame(all_entities: list[Entity], cam_origin_x: int, cam_origin_y: int, cam_width: int,
@@ -127,12 +132,39 @@ def center_camera_on_player(cam_width: int, cam_height: int, level_data: LevelDa
     return new_cam_origin_x, new_cam_origin_y
 
 
+def color_escape(term, color: TermColor) -> str:
+    """term.color_rgb(*color.value), cached. color_rgb searches for the nearest palette color on every call,
+        which was most of the time spent drawing a frame"""
+    key = (term, color)
+    escape = _color_escapes.get(key)
+    if escape is None:
+        escape = _color_escapes[key] = term.color_rgb(*color.value)
+    return escape
+
+
+_color_escapes: dict[tuple[Terminal, TermColor], str] = {}
+
+
 def draw_camera(term, cam_origin_x: int, cam_origin_y: int, cam_width: int, cam_height: int,
                 term_origin_x: int, term_origin_y: int, level_data: LevelData):
     """Draws everything in the camera view"""
-    # Todo: Look into increasing performance in ths method (or seeing if this is actually the issue)
+    # The whole frame is built up as one string first (compose), then written out in one go (terminal write)
+    with Profiler.span(SPAN_COMPOSE):
+        frame = compose_camera(term, cam_origin_x, cam_origin_y, cam_width, cam_height, term_origin_x, term_origin_y,
+                               level_data)
+    with Profiler.span(SPAN_TERMINAL_WRITE):
+        print(frame, end="", flush=True, file=term.stream)
+
+    # Purge the vfx
+    level_data.vfx.clear()
+
+
+def compose_camera(term, cam_origin_x: int, cam_origin_y: int, cam_width: int, cam_height: int,
+                   term_origin_x: int, term_origin_y: int, level_data: LevelData) -> str:
+    """Returns everything in the camera view as one string of terminal output"""
     # cam_origin x/y are in world-space
     # term_origin are the top-left corner in the console
+    out = []
     # Draw the tiles first
     for rows in range(cam_origin_y, cam_origin_y + cam_height):
         rowstr = ""
@@ -141,71 +173,93 @@ def draw_camera(term, cam_origin_x: int, cam_origin_y: int, cam_width: int, cam_
             try:
                 tile = level_data.tiles[pos]
                 if tile.is_visible:
-                    tile_char = term.color_rgb(*tile.visible_color.value) + \
-                                tile.floor_char
+                    tile_char = color_escape(term, tile.visible_color) + tile.floor_char
                 elif tile.has_been_visible:
-                    tile_char = term.color_rgb(*tile.fow_color.value) + \
-                                tile.floor_char
+                    tile_char = color_escape(term, tile.fow_color) + tile.floor_char
                 else:
                     tile_char = " "
             except KeyError:
                 tile_char = " "
 
             rowstr += tile_char
-        print(term.move_xy(term_origin_x, rows + term_origin_y - cam_origin_y) + rowstr + term.normal)
+        out.append(term.move_xy(term_origin_x, rows + term_origin_y - cam_origin_y) + rowstr + term.normal)
     # Todo: I suspect it'll be faster/more performant to work the entity/vfx displays into the above loop
     #   instead of multiple loops/draw cycles
-    #   term.move_xy(...) seems to be relatively expensive
     #   Also need to handle multiple Entities in one tile
 
-    # Draw the floor items
-    frame_items = entities_in_frame(all_entities=level_data.floor_items, cam_origin_x=cam_origin_x,
-                                    cam_origin_y=cam_origin_y, cam_width=cam_width, cam_height=cam_height,
-                                    visibility=True)
-    frame_items = filter(lambda entity: level_data.tiles[entity.pos].is_visible, frame_items)
-    draw_list_of_entities(frame_items, term, cam_origin_x, cam_origin_y, term_origin_x, term_origin_y)
-
-    # Draw the interactables
-    frame_interactables = entities_in_frame(all_entities=level_data.interactables, cam_origin_x=cam_origin_x,
-                                            cam_origin_y=cam_origin_y, cam_width=cam_width, cam_height=cam_height,
-                                            visibility=True)
-    frame_interactables = filter(lambda entity: level_data.tiles[entity.pos].is_visible, frame_interactables)
-    draw_list_of_entities(frame_interactables, term, cam_origin_x, cam_origin_y, term_origin_x, term_origin_y)
-
-    # Draw the monsters
-    frame_monsters = entities_in_frame(all_entities=level_data.monsters, cam_origin_x=cam_origin_x,
-                                       cam_origin_y=cam_origin_y, cam_width=cam_width, cam_height=cam_height,
-                                       visibility=True)
-    frame_monsters = filter(lambda entity: level_data.tiles[entity.pos].is_visible, frame_monsters)
-    draw_list_of_entities(frame_monsters, term, cam_origin_x, cam_origin_y, term_origin_x, term_origin_y)
-
-    # Draw the floor effects
-    frame_floor_effects = entities_in_frame(all_entities=level_data.floor_effects, cam_origin_x=cam_origin_x,
-                                            cam_origin_y=cam_origin_y, cam_width=cam_width, cam_height=cam_height,
-                                            visibility=True)
-    frame_floor_effects = filter(lambda entity: level_data.tiles[entity.pos].is_visible, frame_floor_effects)
-    draw_list_of_entities(frame_floor_effects, term, cam_origin_x, cam_origin_y, term_origin_x, term_origin_y)
+    # Draw the floor items, interactables, monsters and floor effects, in that order
+    for entity_list in (level_data.floor_items, level_data.interactables, level_data.monsters,
+                        level_data.floor_effects):
+        frame_entities = entities_in_frame(all_entities=entity_list, cam_origin_x=cam_origin_x,
+                                           cam_origin_y=cam_origin_y, cam_width=cam_width, cam_height=cam_height,
+                                           visibility=True)
+        frame_entities = filter(lambda entity: level_data.tiles[entity.pos].is_visible, frame_entities)
+        out.append(compose_list_of_entities(frame_entities, term, cam_origin_x, cam_origin_y, term_origin_x,
+                                            term_origin_y))
 
     # Draw the player
     player = level_data.player
-    print(term.move_xy(player.pos.x + term_origin_x - cam_origin_x, player.pos.y + term_origin_y - cam_origin_y)
-          + term.color_rgb(*player.display_color.value) + player.display_char + term.normal)
+    out.append(term.move_xy(player.pos.x + term_origin_x - cam_origin_x, player.pos.y + term_origin_y - cam_origin_y)
+               + color_escape(term, player.display_color) + player.display_char + term.normal)
 
     # Draw the vfx
     frame_vfx = entities_in_frame(all_entities=level_data.vfx, cam_origin_x=cam_origin_x,
                                   cam_origin_y=cam_origin_y, cam_width=cam_width, cam_height=cam_height,
                                   visibility=True)
     frame_vfx = filter(lambda entity: level_data.tiles[entity.pos].is_visible, frame_vfx)
-    draw_list_of_entities(frame_vfx, term, cam_origin_x, cam_origin_y, term_origin_x, term_origin_y)
+    out.append(compose_list_of_entities(frame_vfx, term, cam_origin_x, cam_origin_y, term_origin_x, term_origin_y))
 
-    # Purge the vfx
-    level_data.vfx.clear()
+    return "".join(out)
 
 
 def draw_list_of_entities(entities, term, cam_origin_x, cam_origin_y, term_origin_x, term_origin_y):
-    for ent in entities:
-        print(term.move_xy(ent.pos.x + term_origin_x - cam_origin_x, ent.pos.y + term_origin_y - cam_origin_y)
-              + term.color_rgb(*ent.display_color.value) + ent.display_char + term.normal)
+    print(compose_list_of_entities(entities, term, cam_origin_x, cam_origin_y, term_origin_x, term_origin_y),
+          end="", flush=True, file=term.stream)
+
+
+def compose_list_of_entities(entities, term, cam_origin_x, cam_origin_y, term_origin_x, term_origin_y) -> str:
+    return "".join(term.move_xy(ent.pos.x + term_origin_x - cam_origin_x, ent.pos.y + term_origin_y - cam_origin_y)
+                   + color_escape(term, ent.display_color) + ent.display_char + term.normal for ent in entities)
+
+
+def cell_appearance(level_data: LevelData, pos: Point, overlay: dict[Point, VFX] | None = None) \
+        -> tuple[str, TermColor | None]:
+    """Returns the char and color that draw_camera would end up showing at pos (None color for blank)
+        overlay is drawn on top of everything, like vfx"""
+    if overlay is not None and pos in overlay:
+        return overlay[pos].display_char, overlay[pos].display_color
+    # The player is always drawn, even though shadow casting never marks their own tile visible
+    if level_data.player is not None and level_data.player.pos == pos:
+        return level_data.player.display_char, level_data.player.display_color
+    tile = level_data.tiles[pos] if pos in level_data.tiles else None
+    if tile is None:
+        return " ", None
+    if tile.is_visible:
+        # Same stacking as draw_camera - later draws land on top
+        for entities in (level_data.floor_effects, level_data.monsters, level_data.interactables,
+                         level_data.floor_items):
+            for e in entities:
+                if e.pos == pos and e.is_visible:
+                    return e.display_char, e.display_color
+        return tile.floor_char, tile.visible_color
+    if tile.has_been_visible:
+        return tile.floor_char, tile.fow_color
+    return " ", None
+
+
+def draw_cells(term, cam_origin_x: int, cam_origin_y: int, cam_width: int, cam_height: int,
+               term_origin_x: int, term_origin_y: int, level_data: LevelData, points,
+               overlay: dict[Point, VFX] | None = None):
+    """Redraws just the cells at points (world-space), instead of the whole camera view"""
+    out = []
+    for pos in points:
+        if not (cam_origin_x <= pos.x < cam_origin_x + cam_width and cam_origin_y <= pos.y < cam_origin_y + cam_height):
+            continue
+        char, color = cell_appearance(level_data, pos, overlay)
+        out.append(term.move_xy(pos.x + term_origin_x - cam_origin_x, pos.y + term_origin_y - cam_origin_y))
+        out.append(char if color is None else color_escape(term, color) + char + term.normal)
+    if out:
+        print("".join(out), end="", flush=True, file=term.stream)
 
 
 class TopMessage:
@@ -236,36 +290,58 @@ class TopMessage:
         if TopMessage.term is not None:
             _term = TopMessage.term
             target_width = _term.width - 3
-            _message = TopMessage.message_buffer
-
-            chunks = textwrap.wrap(_message, width=target_width)
-            if len(chunks) > 0:
-                _message = chunks.pop(0)
-                if len(chunks) > 0:
-                    _message = _message + "..."
-            else:
-                _message = ""
+            _message = top_message_line(TopMessage.message_buffer, target_width)
 
-            print(_term.move_xy(0, 0) + format(_message, f'<{target_width}'))
+            print(_term.move_xy(0, 0) + format(_message, f'<{target_width}'), file=_term.stream)
             # print(_term.move_xy(0, 0) + "{:<{target_width}}".format(_message))  # Both this and the above line work
             TopMessage.message_buffer = ""
 
 
-def update_bottom_status(_term, level_data: LevelData):
+def top_message_line(message: str, target_width: int) -> str:
+    """The part of message that fits on the top line, with "..." if there was more"""
+    chunks = textwrap.wrap(message, width=target_width)
+    if len(chunks) > 0:
+        line = chunks.pop(0)
+        if len(chunks) > 0:
+            line = line + "..."
+        return line
+    return ""
+
+
+def bottom_status_fields(level_data: LevelData) -> tuple[str, str]:
+    """The player's health and position, padded the way the bottom status shows them"""
     player = level_data.player
     rounded_health = math.ceil(player.health)  # Small chance of float precision errors here
     rounded_max_health = math.ceil(player.health_max)
     formatted_health = "{:<7}".format(str(rounded_health) + "/" + str(rounded_max_health))
     formatted_pos = "{:<7}".format(str(player.pos.x) + "," + str(player.pos.y))
+    return formatted_health, formatted_pos
+
+
+def update_bottom_status(_term, level_data: LevelData):
+    formatted_health, formatted_pos = bottom_status_fields(level_data)
 
     # Todo: break this into some extra functions? Also add a health bar
     print(_term.normal + _term.move_xy(0,
-                                       _term.height - 2) + f"Health: {_term.color_rgb(*TermColor.RED.value)}{formatted_health}" + _term.normal)
+                                       _term.height - 2) + f"Health: {color_escape(_term, TermColor.RED)}{formatted_health}" + _term.normal,
+          file=_term.stream)
     print(_term.magenta_on_black + _term.move_xy(0,
-                                                 _term.height - 1) + f"Player loc: {formatted_pos}" + _term.home + _term.normal)
+                                                 _term.height - 1) + f"Player loc: {formatted_pos}" + _term.home + _term.normal,
+          file=_term.stream)
     # f"{number:02d}"
 
 
+def draw_profiler_overlay(_term):
+    """Draws the last frame's per-span times (see profiler) in the top-right corner"""
+    lines = [f"{'frame':<15}{Profiler.last_frame_total * 1000:>8.2f}ms"]
+    for name, seconds in sorted(Profiler.last_frame.items(), key=lambda item: -item[1]):
+        lines.append(f"{name:<15}{seconds * 1000:>8.2f}ms")
+    width = max(len(line) for line in lines)
+    x = max(0, _term.width - width)
+    print(_term.normal + "".join(_term.move_xy(x, 1 + i) + _term.black_on_white(format(line, f'<{width}'))
+                                 for i, line in enumerate(lines)), end="", flush=True, file=_term.stream)
+
+
 class OverlayMenu:
     term = None
     root_menu = None
@@ -331,7 +407,8 @@ def draw_line(level_data: LevelData, p1: Point, p2: Point, char: str, end_char:
     # todo - modify the last tile with end_char. also, only draw first spot if the length is 0
     rr, cc = line(p1.y, p1.x, p2.y, p2.x)
     # rr, cc = line(y1, x1, y2, x2)
-    logging.debug(f"rr: {rr}, cc: {cc}")
+    if Trace.drawing:
+        drawing_log.debug(f"Line from {p1} to {p2} covers {len(rr)} cells")
     if len(rr) == 0:
         return
 
@@ -0,0 +1,108 @@
+# Drives lots of simulated players against gameServer.py at once, and reports how quickly frames come back
+# Run with e.g.: python serverLoadTest.py --sessions 200 --keys 50
+#   Without --port or --unix, a server is started in this process (on a temporary UNIX socket) to test against
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+from frameDiff import FRAME_END
+from gameServer import GameServer
+from headlessRunner import random_walk
+
+FRAME_END_BYTES = FRAME_END.encode()
+
+
+@dataclass
+class ClientResult:
+    latencies: list[float] = field(default_factory=list)  # Seconds from sending a key to its frame arriving
+    first_frame_bytes: int = 0
+    frame_bytes: list[int] = field(default_factory=list)
+
+
+async def run_client(index: int, connect, keys: list[str], think_time: float) -> ClientResult:
+    """Plays keys one at a time, waiting for each key's frame before sending the next"""
+    result = ClientResult()
+    reader, writer = await connect()
+    result.first_frame_bytes = len(await reader.readuntil(FRAME_END_BYTES))
+    for key in keys:
+        tic = time.perf_counter()
+        writer.write(key.encode())
+        await writer.drain()
+        frame = await reader.readuntil(FRAME_END_BYTES)
+        result.latencies.append(time.perf_counter() - tic)
+        result.frame_bytes.append(len(frame))
+        if think_time:
+            await asyncio.sleep(think_time)
+    writer.write(b"Q")
+    await writer.drain()
+    await reader.read()  # The server hangs up once it's seen the Q
+    writer.close()
+    return result
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def load_test(args) -> list[ClientResult]:
+    server = None
+    socket_dir = None
+    unix_path = args.unix
+    if args.port is None and unix_path is None:
+        server = GameServer(args.seed)
+        socket_dir = tempfile.mkdtemp(prefix="imla_server_")
+        unix_path = os.path.join(socket_dir, "imla.sock")
+        listener = await server.start(unix_path=unix_path)
+
+    async def connect():
+        if unix_path is not None:
+            return await asyncio.open_unix_connection(unix_path, limit=2 ** 20)
+        return await asyncio.open_connection(args.host, args.port, limit=2 ** 20)
+
+    try:
+        return await asyncio.gather(*(run_client(i, connect, random_walk(args.seed + i, args.keys), args.think_time)
+                                      for i in range(args.sessions)))
+    finally:
+        if server is not None:
+            listener.close()
+            await listener.wait_closed()
+            print(f"Server: {server.stats()}")
+            server.shutdown()
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load tests gameServer.py with simulated players")
+    parser.add_argument("--sessions", type=int, default=100, help="players connected at once")
+    parser.add_argument("--keys", type=int, default=50, help="keys each player presses (a random walk)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds each player waits between keys")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the in-process server and the random walks")
+    parser.add_argument("--host", default="127.0.0.1", help="server address, with --port")
+    parser.add_argument("--port", type=int, default=None, help="test a server already listening on this TCP port")
+    parser.add_argument("--unix", metavar="PATH", default=None, help="test a server already listening on PATH")
+    args = parser.parse_args()
+
+    tic = time.perf_counter()
+    results = asyncio.run(load_test(args))
+    elapsed = time.perf_counter() - tic
+
+    latencies = [latency for r in results for latency in r.latencies]
+    frame_bytes = [size for r in results for size in r.frame_bytes]
+    print(f"{args.sessions} sessions x {args.keys} keys in {elapsed:0.2f}s ({len(latencies) / elapsed:0.0f} frames/s)")
+    if latencies:
+        print(f"Key to frame: {statistics.median(latencies) * 1000:0.1f}ms median, "
+              f"{percentile(latencies, 0.95) * 1000:0.1f}ms p95, {max(latencies) * 1000:0.1f}ms max")
+        print(f"Frame size: {statistics.mean(r.first_frame_bytes for r in results):0.0f} bytes for the first frame, "
+              f"{statistics.mean(frame_bytes):0.0f} bytes per frame after that")
+
+
+if __name__ == '__main__':
+    logging.disable(logging.DEBUG)
+    main()
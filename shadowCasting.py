@@ -4,8 +4,6 @@ from dataclasses import dataclass, field
 from globalEnums import Point
 from levelData import LevelData
 
-logging.basicConfig(filename='Imladebug.log', filemode='w', level=logging.DEBUG)
-
 
 @dataclass
 class Shadow:
@@ -107,6 +105,9 @@ def refresh_visibility(origin_x: int, origin_y: int, sight_range: int, level_dat
     #  and later on, light sources
     for octant in range(8):
         refresh_octant(origin_x, origin_y, sight_range, octant, level_data)
+    # has_been_visible can only have changed within sight_range, so that's all the minimap (if any) needs to re-read
+    if level_data.minimap is not None:
+        level_data.minimap.note_view(origin_x, origin_y, sight_range)
 
 
 def refresh_octant(origin_x: int, origin_y: int, sight_range: int, octant: int, level_data: LevelData):
@@ -116,7 +117,7 @@ def refresh_octant(origin_x: int, origin_y: int, sight_range: int, octant: int,
     # logging.debug(f"Beginning an octant refresh starting at {origin_x},{origin_y}")
 
     # Be mindful that the row,col numbers here are in octant coordinates
-    for row in range(1, max(level_data.width, level_data.height)-1):
+    for row in range(1, level_data.fov_row_limit(sight_range)):
         # logging.debug(f"{row = }")
         test_x, test_y = transform_octant(row, 0, octant)
         if (octant == 0 or octant == 7) and test_y + origin_y < 0:
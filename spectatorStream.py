@@ -0,0 +1,360 @@
+# Lets other people watch a game live. Each frame is encoded once, as the cells that changed, and the same bytes are
+# sent to every spectator of that game
+# Watch a game started with `python main.py --spectate-port 4100` using:
+#   python spectatorStream.py --port 4100
+# Or a gameServer.py session (started with --spectate-port) by its session number:
+#   python spectatorStream.py --port 4100 --channel 3
+import argparse
+import asyncio
+import logging
+import struct
+import threading
+import zlib
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from frameDiff import FrameDiffer, GlyphTable
+
+# Stream layout: every packet is a (type, length) struct then that many bytes of raw deflate data.
+# A keyframe starts a fresh compressor, and each diff after it continues that compressor's stream, so diffs compress
+# against everything since the last keyframe. That's also why a late joiner has to start from a keyframe - it gets
+# the latest keyframe and every diff since, then carries on live.
+# Decompressed, a packet is:
+#   frame header (frame number, width, height, number of glyph definitions)
+#   glyph definitions - index, has color, r, g, b, char length, then the char (UTF-8). Each glyph is defined once
+#       per keyframe interval: keyframes define every glyph in use so far, diffs only ones that are new
+#   run count, then for each run of changed cells: first cell, run length, then a uint16 glyph index per cell
+PACKET_KEYFRAME = 1
+PACKET_DIFF = 2
+KEYFRAME_INTERVAL = 60  # Frames between keyframes. Longer means smaller streams, but more to send a late joiner
+MAX_SPECTATOR_BUFFER = 256 * 1024  # A spectator this far behind skips diffs until the next keyframe
+_PACKET_STRUCT = struct.Struct("<BI")
+_FRAME_STRUCT = struct.Struct("<IHHH")
+_GLYPH_STRUCT = struct.Struct("<HBBBBB")
+_COUNT_STRUCT = struct.Struct("<I")
+_RUN_STRUCT = struct.Struct("<IH")
+
+
+def _runs(changed: np.ndarray) -> list[tuple[int, int]]:
+    """Splits sorted cell indices into (start, length) runs of consecutive cells"""
+    if len(changed) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(changed) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(changed)]))
+    return [(int(changed[s]), int(e - s)) for s, e in zip(starts.tolist(), ends.tolist())]
+
+
+@dataclass
+class StreamStats:
+    frames: int = 0
+    keyframes: int = 0
+    raw_bytes: int = 0  # Before compression
+    encoded_bytes: int = 0  # What actually gets sent, to each spectator
+    keyframe_bytes: int = 0
+    bytes_sent: int = 0  # Summed over every spectator
+    spectators: int = 0
+
+    def summary(self) -> str:
+        diffs = self.frames - self.keyframes
+        diff_bytes = self.encoded_bytes - self.keyframe_bytes
+        return (f"{self.frames} frames ({self.keyframes} keyframes), "
+                f"{diff_bytes / max(diffs, 1):0.0f} bytes per diff, "
+                f"{self.keyframe_bytes / max(self.keyframes, 1):0.0f} bytes per keyframe, "
+                f"{self.raw_bytes / max(self.encoded_bytes, 1):0.1f}x compression, "
+                f"{self.bytes_sent} bytes sent to {self.spectators} spectator(s)")
+
+
+class FrameEncoder:
+    """Turns a game's frames (glyph index arrays from frameDiff.compose_frame_cells) into stream packets"""
+
+    def __init__(self, glyphs: GlyphTable, keyframe_interval: int = KEYFRAME_INTERVAL):
+        self.glyphs = glyphs
+        self.keyframe_interval = keyframe_interval
+        self.differ = FrameDiffer()
+        self.frame_number = 0
+        self.stats = StreamStats()
+        self._compressor = None
+        self._glyphs_defined = 0
+
+    def encode(self, cells: np.ndarray, width: int, height: int) -> tuple[int, bytes]:
+        """Returns (packet type, packet) for the next frame"""
+        is_keyframe = self.frame_number % self.keyframe_interval == 0 or self.differ.previous is None \
+            or len(self.differ.previous) != len(cells)
+        if is_keyframe:
+            self.differ.reset()
+            self._compressor = zlib.compressobj(wbits=-15)
+            self._glyphs_defined = 0
+        changed = self.differ.changed_cells(cells)
+
+        glyph_count = len(self.glyphs)
+        if glyph_count > 65536:
+            raise ValueError(f"{glyph_count} glyphs is more than the stream can number")
+        parts = [_FRAME_STRUCT.pack(self.frame_number, width, height, glyph_count - self._glyphs_defined)]
+        for index in range(self._glyphs_defined, glyph_count):
+            char, color = self.glyphs.glyphs[index]
+            char_bytes = char.encode()
+            r, g, b = color.value if color is not None else (0, 0, 0)
+            parts.append(_GLYPH_STRUCT.pack(index, color is not None, r, g, b, len(char_bytes)) + char_bytes)
+        self._glyphs_defined = glyph_count
+
+        runs = _runs(changed)
+        parts.append(_COUNT_STRUCT.pack(len(runs)))
+        glyph_indices = cells.astype(np.uint16)
+        for start, length in runs:
+            parts.append(_RUN_STRUCT.pack(start, length))
+            parts.append(glyph_indices[start:start + length].tobytes())
+
+        raw = b"".join(parts)
+        body = self._compressor.compress(raw) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        packet_type = PACKET_KEYFRAME if is_keyframe else PACKET_DIFF
+        packet = _PACKET_STRUCT.pack(packet_type, len(body)) + body
+
+        self.frame_number += 1
+        self.stats.frames += 1
+        self.stats.raw_bytes += len(raw)
+        self.stats.encoded_bytes += len(packet)
+        if is_keyframe:
+            self.stats.keyframes += 1
+            self.stats.keyframe_bytes += len(packet)
+        return packet_type, packet
+
+
+@dataclass
+class _Spectator:
+    writer: asyncio.StreamWriter
+    needs_keyframe: bool = False
+
+
+class SpectatorChannel:
+    """One game's stream. publish() encodes on the caller's thread; delivering to spectators happens on the hub's
+        event loop, which is the only place the spectator list and the catch-up packets are touched"""
+
+    def __init__(self, hub: "SpectatorHub", channel_id: int, glyphs: GlyphTable):
+        self.hub = hub
+        self.channel_id = channel_id
+        self.encoder = FrameEncoder(glyphs)
+        self.spectators: list[_Spectator] = []
+        self._since_keyframe: list[bytes] = []  # The latest keyframe and every diff after it
+
+    @property
+    def stats(self) -> StreamStats:
+        return self.encoder.stats
+
+    def publish(self, cells: np.ndarray, width: int, height: int):
+        packet_type, packet = self.encoder.encode(cells, width, height)
+        if self.hub.loop is None:
+            self._deliver(packet_type, packet)  # Nobody can be watching before the hub starts
+        else:
+            self.hub.loop.call_soon_threadsafe(self._deliver, packet_type, packet)
+
+    def _deliver(self, packet_type: int, packet: bytes):
+        if packet_type == PACKET_KEYFRAME:
+            self._since_keyframe = []
+        self._since_keyframe.append(packet)
+        for spectator in self.spectators:
+            if spectator.needs_keyframe and packet_type != PACKET_KEYFRAME:
+                continue
+            if spectator.writer.transport.get_write_buffer_size() > MAX_SPECTATOR_BUFFER:
+                spectator.needs_keyframe = True
+                continue
+            spectator.needs_keyframe = False
+            spectator.writer.write(packet)
+            self.stats.bytes_sent += len(packet)
+
+    def join(self, writer: asyncio.StreamWriter) -> _Spectator:
+        spectator = _Spectator(writer)
+        for packet in self._since_keyframe:
+            writer.write(packet)
+            self.stats.bytes_sent += len(packet)
+        self.spectators.append(spectator)
+        self.stats.spectators += 1
+        return spectator
+
+    def leave(self, spectator: _Spectator):
+        if spectator in self.spectators:
+            self.spectators.remove(spectator)
+
+    def close(self):
+        """Ends the stream, hanging up on its spectators"""
+        for spectator in self.spectators:
+            spectator.writer.close()
+        self.spectators.clear()
+
+
+class SpectatorHub:
+    """Accepts spectator connections and hands each one to the channel it asks for (a line with the channel number)
+        Runs on an asyncio loop - either one that's already running (start), or its own thread (start_in_thread)"""
+
+    def __init__(self, glyphs: GlyphTable):
+        self.glyphs = glyphs
+        self.channels: dict[int, SpectatorChannel] = {}
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._thread: threading.Thread | None = None
+        self._closed_stats = StreamStats()
+
+    def all_stats(self) -> StreamStats:
+        """Every channel's stats added up, including ones that have since closed"""
+        total = StreamStats(**self._closed_stats.__dict__)
+        for channel in self.channels.values():
+            for name, value in channel.stats.__dict__.items():
+                setattr(total, name, getattr(total, name) + value)
+        return total
+
+    def open_channel(self, channel_id: int) -> SpectatorChannel:
+        channel = self.channels[channel_id] = SpectatorChannel(self, channel_id, self.glyphs)
+        return channel
+
+    def close_channel(self, channel_id: int):
+        channel = self.channels.pop(channel_id, None)
+        if channel is not None:
+            for name, value in channel.stats.__dict__.items():
+                setattr(self._closed_stats, name, getattr(self._closed_stats, name) + value)
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(channel.close)
+
+    async def start(self, host: str = "127.0.0.1", port: int | None = None, unix_path: str | None = None):
+        self.loop = asyncio.get_running_loop()
+        if unix_path is not None:
+            self._server = await asyncio.start_unix_server(self._handle_spectator, path=unix_path)
+        else:
+            self._server = await asyncio.start_server(self._handle_spectator, host=host, port=port)
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int | None = None, unix_path: str | None = None):
+        """For games that aren't async (main). The hub gets its own event loop on a daemon thread"""
+        loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=loop.run_forever, name="spectators", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(host, port, unix_path), loop).result()
+
+    def stop(self):
+        if self.loop is None:
+            return
+        if self._thread is not None:
+            asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        else:
+            self._server.close()
+
+    async def _stop(self):
+        for channel in self.channels.values():
+            channel.close()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_spectator(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            line = await reader.readline()
+            channel = self.channels.get(int(line.strip() or 0))
+        except ValueError:
+            channel = None
+        if channel is None:
+            writer.close()
+            return
+        spectator = channel.join(writer)
+        logging.debug(f"Spectator joined channel {channel.channel_id} ({len(channel.spectators)} watching)")
+        try:
+            await reader.read()  # Spectators don't send anything else, so this just waits for them to hang up
+        except ConnectionError:
+            pass
+        finally:
+            channel.leave(spectator)
+            writer.close()
+
+
+@dataclass
+class SpectatorScreen:
+    """The spectator's side: decodes packets back into a grid of glyphs"""
+    width: int = 0
+    height: int = 0
+    cells: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.uint16))
+    glyphs: dict[int, tuple[str, tuple[int, int, int] | None]] = field(default_factory=dict)
+    frame_number: int = -1
+    _decompressor: object = None
+
+    def apply(self, packet_type: int, body: bytes) -> list[int]:
+        """Applies one packet, returning the indices of the cells it changed"""
+        if packet_type == PACKET_KEYFRAME:
+            self._decompressor = zlib.decompressobj(wbits=-15)
+        elif self._decompressor is None:
+            return []  # Still waiting on a keyframe
+        raw = self._decompressor.decompress(body)
+
+        self.frame_number, width, height, glyph_count = _FRAME_STRUCT.unpack_from(raw)
+        offset = _FRAME_STRUCT.size
+        if (width, height) != (self.width, self.height):
+            self.width, self.height = width, height
+            self.cells = np.zeros(width * height, dtype=np.uint16)
+        for _ in range(glyph_count):
+            index, has_color, r, g, b, char_len = _GLYPH_STRUCT.unpack_from(raw, offset)
+            offset += _GLYPH_STRUCT.size
+            self.glyphs[index] = (raw[offset:offset + char_len].decode(), (r, g, b) if has_color else None)
+            offset += char_len
+
+        changed = []
+        (run_count,) = _COUNT_STRUCT.unpack_from(raw, offset)
+        offset += _COUNT_STRUCT.size
+        for _ in range(run_count):
+            start, length = _RUN_STRUCT.unpack_from(raw, offset)
+            offset += _RUN_STRUCT.size
+            self.cells[start:start + length] = np.frombuffer(raw, dtype=np.uint16, count=length, offset=offset)
+            offset += 2 * length
+            changed.extend(range(start, start + length))
+        return changed
+
+
+async def read_packet(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    packet_type, length = _PACKET_STRUCT.unpack(await reader.readexactly(_PACKET_STRUCT.size))
+    return packet_type, await reader.readexactly(length)
+
+
+async def watch(host: str, port: int | None, unix_path: str | None, channel: int):
+    """Shows a channel in this terminal until the game ends or Ctrl-C"""
+    import blessed
+
+    term = blessed.Terminal()
+    if unix_path is not None:
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"{channel}\n".encode())
+    screen = SpectatorScreen()
+    color_escapes: dict[tuple[int, int, int] | None, str] = {None: term.normal}
+    received = 0
+    with term.fullscreen(), term.hidden_cursor():
+        print(term.home + term.clear, end="", flush=True)
+        try:
+            while True:
+                packet_type, body = await read_packet(reader)
+                received += _PACKET_STRUCT.size + len(body)
+                out = []
+                for cell in screen.apply(packet_type, body):
+                    char, color = screen.glyphs[int(screen.cells[cell])]
+                    if color not in color_escapes:
+                        color_escapes[color] = term.color_rgb(*color)
+                    out.append(term.move_xy(cell % screen.width, cell // screen.width) + color_escapes[color] + char)
+                print("".join(out) + term.normal, end="", flush=True)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+    frames = screen.frame_number + 1
+    print(f"Stream ended. {received} bytes received, up to frame {frames}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watches a game streamed with --spectate-port/--spectate-unix")
+    parser.add_argument("--host", default="127.0.0.1", help="address of the game")
+    parser.add_argument("--port", type=int, default=4100, help="TCP port the game streams on")
+    parser.add_argument("--unix", metavar="PATH", default=None, help="UNIX socket the game streams on instead")
+    parser.add_argument("--channel", type=int, default=0, help="which game to watch (a gameServer.py session number)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(watch(args.host, args.port, args.unix, args.channel))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
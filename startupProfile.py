@@ -0,0 +1,107 @@
+# Startup timing, for --startup-profile. Stdlib only, and imported by main before anything heavy,
+# so it can time every import that comes after it
+import importlib.abc
+import sys
+import time
+
+STARTUP_TARGET_SECONDS = 0.2  # Launch to first frame
+
+
+class _TimedLoader:
+    """Wraps a module's loader to time exec_module. Everything else is passed straight through"""
+
+    def __init__(self, loader, name: str):
+        self._loader = loader
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        StartupProfile.module_started(self._name)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            StartupProfile.module_finished(self._name)
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    """Sits at the front of sys.meta_path and wraps the loader of whatever the real finders find"""
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, fullname)
+                return spec
+        return None
+
+
+class StartupProfile:
+    """Static class that records how long each module takes to import and how long each startup phase takes
+        Module times are inclusive (they count the imports they trigger) with self time worked out separately"""
+    active: bool = False
+    start_time: float = time.perf_counter()
+    module_times: dict[str, list[float]] = {}  # name -> [inclusive seconds, self seconds]
+    phases: list[tuple[str, float]] = []  # (phase, seconds since start) in the order they finished
+    _stack: list[list] = []  # [name, start time, seconds spent in nested imports]
+    _finder = None
+
+    @staticmethod
+    def install():
+        StartupProfile.active = True
+        StartupProfile._finder = _TimingFinder()
+        sys.meta_path.insert(0, StartupProfile._finder)
+
+    @staticmethod
+    def uninstall():
+        if StartupProfile._finder in sys.meta_path:
+            sys.meta_path.remove(StartupProfile._finder)
+
+    @staticmethod
+    def module_started(name: str):
+        StartupProfile._stack.append([name, time.perf_counter(), 0.0])
+
+    @staticmethod
+    def module_finished(name: str):
+        _, started, nested = StartupProfile._stack.pop()
+        inclusive = time.perf_counter() - started
+        StartupProfile.module_times[name] = [inclusive, inclusive - nested]
+        if StartupProfile._stack:
+            StartupProfile._stack[-1][2] += inclusive
+
+    @staticmethod
+    def mark(phase: str):
+        """Notes that phase just finished"""
+        if StartupProfile.active:
+            StartupProfile.phases.append((phase, time.perf_counter() - StartupProfile.start_time))
+
+    @staticmethod
+    def report(top: int = 25) -> str:
+        lines = [f"Startup phases (seconds since {__name__} was imported):"]
+        previous = 0.0
+        for phase, at in StartupProfile.phases:
+            lines.append(f"  {phase:<28}{at * 1000:>9.1f}ms  (+{(at - previous) * 1000:0.1f}ms)")
+            previous = at
+
+        # Group by top-level package, since that's the level imports can be made lazy at
+        packages: dict[str, float] = {}
+        for name, (inclusive, own) in StartupProfile.module_times.items():
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0.0) + own
+        lines.append(f"Slowest imports by package (self time, {len(StartupProfile.module_times)} modules):")
+        for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"  {package:<28}{seconds * 1000:>9.1f}ms")
+
+        if StartupProfile.phases:
+            total = StartupProfile.phases[-1][1]
+            verdict = "within" if total <= STARTUP_TARGET_SECONDS else "over"
+            lines.append(f"Total {total * 1000:0.1f}ms, {verdict} the {STARTUP_TARGET_SECONDS * 1000:0.0f}ms target "
+                         f"(interpreter startup before main.py isn't counted)")
+        return "\n".join(lines)
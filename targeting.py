@@ -0,0 +1,65 @@
+import logging
+
+from globalEnums import Point, TermColor
+from levelData import LevelData
+from projectiles import line_offsets
+from screenDrawing import VFX
+
+
+class TargetingCache:
+    """Everything targeting needs that doesn't change while the cursor moves, worked out once on entry
+        Lines (and whether anything blocks them) are kept per target cell, and the visible monsters in range are
+        sorted by distance for cycling through"""
+
+    def __init__(self, level_data: LevelData, origin: Point, max_range: int, precompute_lines: bool = True):
+        self.level_data = level_data
+        self.origin = origin
+        self.max_range = max_range
+        self._lines: dict[Point, tuple[list[Point], bool]] = {}
+        if precompute_lines:
+            for dx in range(-max_range, max_range + 1):
+                for dy in range(-max_range, max_range + 1):
+                    target = Point(origin.x + dx, origin.y + dy)
+                    if target in level_data.tiles:
+                        self._cache_line(target)
+
+        self.targets: list[Point] = sorted(
+            (m.pos for m in level_data.monsters
+             if self.is_in_range(m.pos) and m.pos in level_data.tiles and level_data.tiles[m.pos].is_visible),
+            key=lambda p: ((p.x - origin.x) ** 2 + (p.y - origin.y) ** 2, p.x, p.y))
+        self._target_index = -1
+
+    def is_in_range(self, p: Point) -> bool:
+        return abs(p.x - self.origin.x) <= self.max_range and abs(p.y - self.origin.y) <= self.max_range
+
+    def _cache_line(self, target: Point) -> tuple[list[Point], bool]:
+        tiles = self.level_data.tiles
+        # From the same line table projectiles fly along, so the line shown is the line a shot takes
+        points = [Point(self.origin.x + dx, self.origin.y + dy)
+                  for dx, dy in line_offsets(target.x - self.origin.x, target.y - self.origin.y)]
+        # The origin can't block its own line
+        is_clear = all(p in tiles and not tiles[p].is_blocking_LOS for p in points[1:])
+        self._lines[target] = (points, is_clear)
+        return self._lines[target]
+
+    def line_to(self, target: Point) -> list[Point]:
+        return (self._lines.get(target) or self._cache_line(target))[0]
+
+    def is_line_clear(self, target: Point) -> bool:
+        return (self._lines.get(target) or self._cache_line(target))[1]
+
+    def next_target(self) -> Point | None:
+        """Cycles through the visible monsters in range, nearest first. None if there aren't any"""
+        if not self.targets:
+            return None
+        self._target_index = (self._target_index + 1) % len(self.targets)
+        return self.targets[self._target_index]
+
+
+def line_overlay(points: list[Point], char: str, end_char: str, color: TermColor) -> dict[Point, VFX]:
+    """The cells screenDrawing.draw_line would add as vfx for a line along points, without adding them"""
+    if len(points) == 0:
+        return {}
+    overlay = {p: VFX(pos=p, display_char=char, display_color=color, is_visible=True) for p in points[1:-1]}
+    overlay[points[-1]] = VFX(pos=points[-1], display_char=end_char, display_color=color, is_visible=True)
+    return overlay
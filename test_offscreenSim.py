@@ -0,0 +1,35 @@
+import json
+
+from dungeon import Dungeon
+from entity import create_player
+from levelGeneration import DEFAULT_LVLARGS, generate_orc
+from levelPipeline import LevelPipeline
+from saveGame import Autosaver
+
+
+def test_autosave_picks_up_a_floor_simulated_between_saves(tmp_path):
+    """A floor moved on by the off-screen simulation after one autosave is saved as it is now by the next"""
+    dungeon = Dungeon(LevelPipeline(lvlargs=DEFAULT_LVLARGS, base_seed=5))
+    level_data = dungeon.start()
+    level_data.player = create_player(level_data.player_start_pos)
+    level_data.monsters = [generate_orc(level_data.player_start_pos)]
+    level_data.monsters[0].health = 1.0
+    level_data.player.pos = level_data.stairs_down_pos
+    dungeon.change_level(1)
+
+    autosaver = Autosaver(str(tmp_path))
+    try:
+        before = autosaver.snapshot(dungeon)
+        for _ in range(dungeon.offscreen.settings.interval):
+            dungeon.end_turn()
+        after = autosaver.snapshot(dungeon)
+    finally:
+        autosaver.close()
+        dungeon.pipeline.shutdown()
+
+    live = dungeon.visited_levels.peek(0)
+    saved = next(f for f in after.floors if f.depth == 0)
+    assert saved.header["turns"] == live.turns > next(f for f in before.floors if f.depth == 0).header["turns"]
+    saved_monster = json.loads(saved.entities)["monsters"][0]
+    assert saved_monster[1] == list(live.monsters[0].pos)
+    assert live.monsters[0].health > 1.0